@@ -1,4 +1,5 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel
 from app.config import get_settings
 
 settings = get_settings()
@@ -7,6 +8,136 @@ client: AsyncIOMotorClient = None
 db = None
 
 
+# Declared indexes per collection, reconciled by ensure_indexes() on startup.
+# Names are explicit so reconciliation can match them against what the
+# server already has.
+INDEXES: dict[str, list[IndexModel]] = {
+    "patients": [
+        IndexModel([("created_at", DESCENDING)], name="created_at_desc"),
+        IndexModel(
+            [("patient_id", ASCENDING)],
+            name="patient_id_unique",
+            unique=True,
+            # Patients created through the API have no patient_id, so only
+            # enforce uniqueness where one is actually set.
+            partialFilterExpression={"patient_id": {"$type": "string"}},
+        ),
+        IndexModel([("diagnosis", ASCENDING), ("created_at", DESCENDING)], name="diagnosis_created_at"),
+        IndexModel([("country", ASCENDING), ("created_at", DESCENDING)], name="country_created_at"),
+    ],
+    "diagnosis_history": [
+        IndexModel([("created_at", DESCENDING)], name="created_at_desc"),
+        IndexModel([("patient_id", ASCENDING), ("created_at", DESCENDING)], name="patient_id_created_at"),
+    ],
+    "image_analysis_history": [
+        IndexModel([("created_at", DESCENDING)], name="created_at_desc"),
+        IndexModel([("image_sha256", ASCENDING)], name="image_sha256"),
+    ],
+    "image_analysis_cache": [
+        # Entries are referenced from history, so they do not expire.
+        IndexModel(
+            [("phash_bands", ASCENDING), ("image_type", ASCENDING), ("model", ASCENDING)],
+            name="phash_bands_type_model",
+        ),
+    ],
+    "llm_cache": [
+        # Changing llm_cache_ttl_seconds rebuilds this index on next startup.
+        IndexModel(
+            [("created_at", ASCENDING)],
+            name="created_at_ttl",
+            expireAfterSeconds=settings.llm_cache_ttl_seconds,
+        ),
+    ],
+}
+
+# Options that change index behaviour; anything else in index_information()
+# (v, ns, background, ...) is ignored when comparing specs.
+_INDEX_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+
+def _spec_matches(declared: dict, existing: dict) -> bool:
+    if list(declared["key"].items()) != [(k, v) for k, v in existing["key"]]:
+        return False
+    for opt in _INDEX_OPTIONS:
+        if declared.get(opt) != existing.get(opt):
+            return False
+    return True
+
+
+def _existing_model(name: str, existing: dict) -> IndexModel:
+    options = {opt: existing[opt] for opt in _INDEX_OPTIONS if opt in existing}
+    return IndexModel(list(existing["key"]), name=name, **options)
+
+
+async def ensure_indexes(database=None) -> dict:
+    """Create declared indexes that are missing and rebuild ones whose spec changed.
+
+    Safe to run on every startup: indexes that already match are left alone
+    and undeclared indexes are never dropped, only reported. Each index is
+    built on its own, so one failure (e.g. duplicate patient_ids under the
+    unique index) is reported in `failed` without stopping the rest. A
+    changed index has to be dropped before its replacement can take the
+    name; if the new build fails, the old definition is restored.
+    """
+    database = database if database is not None else db
+    report = {"created": [], "rebuilt": [], "unchanged": [], "failed": []}
+    for coll_name, models in INDEXES.items():
+        coll = database[coll_name]
+        try:
+            existing = await coll.index_information()
+        except Exception as e:
+            report["failed"].append(f"{coll_name}: {e}")
+            continue
+        for model in models:
+            spec = model.document
+            name = spec["name"]
+            qualified = f"{coll_name}.{name}"
+            if name not in existing:
+                try:
+                    await coll.create_indexes([model])
+                    report["created"].append(qualified)
+                except Exception as e:
+                    report["failed"].append(f"{qualified}: {e}")
+                continue
+            if _spec_matches(spec, existing[name]):
+                report["unchanged"].append(qualified)
+                continue
+            try:
+                await coll.drop_index(name)
+                await coll.create_indexes([model])
+                report["rebuilt"].append(qualified)
+            except Exception as e:
+                try:
+                    await coll.create_indexes([_existing_model(name, existing[name])])
+                    report["failed"].append(f"{qualified}: {e} (kept the previous definition)")
+                except Exception:
+                    report["failed"].append(f"{qualified}: {e} (previous definition could not be restored)")
+    return report
+
+
+async def index_report(database=None) -> dict:
+    """Usage stats per index plus declared-but-missing and unused indexes."""
+    database = database if database is not None else db
+    collections = {}
+    for coll_name, models in INDEXES.items():
+        coll = database[coll_name]
+        declared = {m.document["name"] for m in models}
+        stats = {}
+        async for doc in coll.aggregate([{"$indexStats": {}}]):
+            stats[doc["name"]] = {
+                "key": dict(doc["key"]),
+                "ops": int(doc["accesses"]["ops"]),
+                "since": doc["accesses"]["since"],
+            }
+        collections[coll_name] = {
+            "indexes": stats,
+            "missing": sorted(declared - stats.keys()),
+            "unused": sorted(n for n, s in stats.items() if s["ops"] == 0 and n != "_id_"),
+            "undeclared": sorted(n for n in stats if n not in declared and n != "_id_"),
+        }
+    return collections
+
+
 async def connect_db():
     global client, db
     client = AsyncIOMotorClient(settings.mongodb_uri)
@@ -16,6 +147,17 @@ async def connect_db():
         db = client["euron_health"]
     await db.command("ping")
     print(f"Connected to MongoDB: {db.name}")
+    try:
+        report = await ensure_indexes(db)
+        print(
+            f"Indexes: {len(report['created'])} created, "
+            f"{len(report['rebuilt'])} rebuilt, {len(report['unchanged'])} unchanged"
+        )
+        for failure in report["failed"]:
+            print(f"Index build failed: {failure}")
+    except Exception as e:
+        # A duplicate patient_id in existing data must not keep the API down.
+        print(f"Index reconciliation failed: {e}")
 
 
 async def close_db():
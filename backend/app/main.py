@@ -1,9 +1,13 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
-from app.database import connect_db, close_db
-from app.routes import patients, diagnosis, data
+from app.config import get_settings
+from app.database import connect_db, close_db, get_db
+from app.routes import patients, diagnosis, data, jobs
+from app.utils.compression import CompressionMiddleware
+from app.utils.serialization import FastJSONResponse
 
 
 @asynccontextmanager
@@ -15,28 +19,28 @@ async def lifespan(app: FastAPI):
         print("ML model pre-loaded")
     except Exception as e:
         print(f"ML model not yet trained: {e}")
-    yield
-    await close_db()
 
+    if get_settings().image_model_preload:
+        from app.services.image_service import image_service
+        await asyncio.to_thread(image_service.load, True)
 
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from contextlib import asynccontextmanager
+    from app.services.history_writer import history_writer
+    history_writer.start(get_db())
 
-from app.database import connect_db, close_db
-from app.routes import patients, diagnosis, data
+    from app.services.patient_cache import patient_cache
+    cache_watcher = None
+    if get_settings().patient_cache_change_stream:
+        cache_watcher = asyncio.create_task(patient_cache.watch_changes(get_db().patients))
 
-
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    await connect_db()
-    try:
-        from app.services.ml_service import ml_service
-        ml_service.load()
-        print("ML model pre-loaded")
-    except Exception as e:
-        print(f"ML model not yet trained: {e}")
     yield
+
+    if cache_watcher:
+        cache_watcher.cancel()
+    from app.services.job_service import job_service
+    await job_service.shutdown()
+    from app.services import batch_service
+    batch_service.shutdown()
+    await history_writer.stop()
     await close_db()
 
 
@@ -45,6 +49,7 @@ app = FastAPI(
     description="AI-powered assistant for doctors",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=FastJSONResponse,
 
     # 🔥 FIX HERE
     docs_url="/api/docs",
@@ -58,10 +63,12 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware, minimum_size=get_settings().compression_min_size)
 
 app.include_router(patients.router)
 app.include_router(diagnosis.router)
 app.include_router(data.router)
+app.include_router(jobs.router)
 
 
 @app.get("/")
@@ -76,6 +83,7 @@ async def root():
             "diagnosis": "/api/diagnosis/predict",
             "image_analysis": "/api/diagnosis/analyze-image",
             "csv_upload": "/api/diagnosis/upload-csv",
+            "batch_jobs": "/api/jobs",
             "seed_data": "/api/data/seed",
             "train_model": "/api/data/train",
         },
@@ -84,7 +92,6 @@ async def root():
 
 @app.get("/api/health")
 async def health():
-    from app.database import get_db
     db = get_db()
     try:
         await db.command("ping")
@@ -95,59 +102,23 @@ async def health():
     from app.services.ml_service import ml_service
     model_status = "loaded" if ml_service._loaded else "not loaded"
 
-    return {
-        "status": "healthy",
-        "database": db_status,
-        "ml_model": model_status,
-    }
-
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3000", "http://frontend:3000", "*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-app.include_router(patients.router)
-app.include_router(diagnosis.router)
-app.include_router(data.router)
-
-
-@app.get("/")
-async def root():
-    return {
-        "name": "Euron Healthcare Diagnosis Support System",
-        "version": "1.0.0",
-        "status": "operational",
-        "endpoints": {
-            "docs": "/docs",
-            "patients": "/api/patients",
-            "diagnosis": "/api/diagnosis/predict",
-            "image_analysis": "/api/diagnosis/analyze-image",
-            "csv_upload": "/api/diagnosis/upload-csv",
-            "seed_data": "/api/data/seed",
-            "train_model": "/api/data/train",
-        },
-    }
-
-
-@app.get("/api/health")
-async def health():
-    from app.database import get_db
-    db = get_db()
-    try:
-        await db.command("ping")
-        db_status = "connected"
-    except Exception:
-        db_status = "disconnected"
-
-    from app.services.ml_service import ml_service
-    model_status = "loaded" if ml_service._loaded else "not loaded"
+    from app.services.patient_cache import patient_cache
+    from app.services.history_writer import history_writer
+    from app.services.llm_cache import llm_cache
+    from app.services.llm_client import llm_client
+    from app.services.knowledge_base import knowledge_base
+    from app.services.image_cache import image_cache
+    from app.services.image_service import image_service
 
     return {
         "status": "healthy",
         "database": db_status,
         "ml_model": model_status,
+        "patient_cache": patient_cache.stats(),
+        "history_writer": history_writer.stats(),
+        "llm_cache": llm_cache.stats(),
+        "llm_client": llm_client.stats(),
+        "knowledge_base": knowledge_base.stats(),
+        "image_cache": image_cache.stats(),
+        "image_model": image_service.stats(),
     }
@@ -0,0 +1,30 @@
+"""
+Download the pretrained image model once and pin it to IMAGE_MODEL_DIR as
+safetensors, so servers load it offline at startup.
+
+    cd backend && python -m app.ml.download_image_model
+"""
+import os
+
+from transformers import AutoFeatureExtractor, AutoModelForImageClassification
+
+from app.config import get_settings
+from app.services.image_service import image_service
+
+
+def download(target_dir: str = None) -> str:
+    target_dir = target_dir or get_settings().image_model_dir
+    os.makedirs(target_dir, exist_ok=True)
+    print(f"Downloading {image_service.model_name}...")
+    AutoFeatureExtractor.from_pretrained(image_service.model_name).save_pretrained(target_dir)
+    model = AutoModelForImageClassification.from_pretrained(image_service.model_name)
+    model.save_pretrained(target_dir, safe_serialization=True)
+    size_mb = sum(
+        os.path.getsize(os.path.join(target_dir, name)) for name in os.listdir(target_dir)
+    ) / 2**20
+    print(f"Saved to {target_dir} ({size_mb:.0f} MB)")
+    return target_dir
+
+
+if __name__ == "__main__":
+    download()
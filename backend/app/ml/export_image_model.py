@@ -0,0 +1,123 @@
+"""
+Export the pinned image model to ONNX next to its weights, for
+IMAGE_MODEL_BACKEND=onnx, and check it against the eager model.
+
+Writes model.onnx (fp32) and model.int8.onnx (dynamic int8 quantization
+of the MatMul/Gemm weights, the ONNX counterpart of quantize_linear) into
+IMAGE_MODEL_DIR, then compares each with its eager counterpart on sample
+images: fp32 must match eager fp32 closely, int8 is compared on top-k
+agreement. Exits non-zero if the fp32 export does not match.
+
+    cd backend && python -m app.ml.export_image_model
+    cd backend && python -m app.ml.export_image_model --check-only --images path/to/scans
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+from app.config import get_settings
+from app.services.image_backends import ONNX_FILES, EagerBackend, OnnxBackend, top_k
+from app.services.image_preprocess import decode_image
+
+OPSET = 17
+# Max |logit| difference tolerated between eager fp32 and ONNX fp32.
+FP32_ATOL = 1e-3
+
+
+def export(model_dir: str) -> dict:
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModelForImageClassification
+
+    model = AutoModelForImageClassification.from_pretrained(model_dir, local_files_only=True, use_safetensors=True)
+    model.eval()
+
+    class LogitsOnly(torch.nn.Module):
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+
+        def forward(self, pixel_values):
+            return self.inner(pixel_values=pixel_values).logits
+
+    fp32_path = os.path.join(model_dir, ONNX_FILES["fp32"])
+    int8_path = os.path.join(model_dir, ONNX_FILES["int8"])
+    with torch.inference_mode():
+        torch.onnx.export(
+            LogitsOnly(model),
+            (torch.zeros(1, 3, 224, 224),),
+            fp32_path,
+            input_names=["pixel_values"],
+            output_names=["logits"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=OPSET,
+        )
+    quantize_dynamic(fp32_path, int8_path, op_types_to_quantize=["MatMul", "Gemm"], weight_type=QuantType.QInt8)
+    return {name: os.path.getsize(path) / 2**20 for name, path in (("fp32", fp32_path), ("int8", int8_path))}
+
+
+def sample_images(directory=None, n: int = 16) -> list[Image.Image]:
+    if directory:
+        images = []
+        for name in sorted(os.listdir(directory))[:n]:
+            try:
+                images.append(decode_image(os.path.join(directory, name), 1024, 256).convert("RGB"))
+            except ValueError:
+                pass
+        return images
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:256, 0:256]
+    images = []
+    for _ in range(n):
+        fx, fy, phase = rng.uniform(10, 80, 2).tolist() + [rng.uniform(0, 6)]
+        base = 127 + 90 * np.sin(x / fx + phase) * np.cos(y / fy) + rng.normal(0, 12, x.shape)
+        images.append(Image.fromarray(base.clip(0, 255).astype(np.uint8), "L").convert("RGB"))
+    return images
+
+
+def check_parity(model_dir: str, images: list[Image.Image]) -> dict:
+    """Per precision: max |logit| difference, top-1 agreement and top-5 overlap of ONNX vs eager."""
+    report = {}
+    for quantize in (False, True):
+        eager = EagerBackend(model_dir, quantize=quantize)
+        onnx = OnnxBackend(model_dir, quantize=quantize)
+        eager.load()
+        onnx.load()
+        expected, actual = eager.logits(images), onnx.logits(images)
+        ref, got = top_k(expected), top_k(actual)
+        report[eager.variant] = {
+            "max_abs_diff": float(np.abs(expected - actual).max()),
+            "top1_agreement": float(np.mean([r[1][0] == g[1][0] for r, g in zip(ref, got)])),
+            "top5_overlap": float(np.mean([len(set(r[1]) & set(g[1])) / 5 for r, g in zip(ref, got)])),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the image model to ONNX and check parity")
+    parser.add_argument("--model-dir", default=get_settings().image_model_dir)
+    parser.add_argument("--check-only", action="store_true", help="skip the export, only compare")
+    parser.add_argument("--images", help="directory of images for the parity check (default: synthetic)")
+    parser.add_argument("-n", type=int, default=16)
+    args = parser.parse_args()
+
+    if not os.path.isfile(os.path.join(args.model_dir, "config.json")):
+        sys.exit(f"No model in {args.model_dir!r}; run `python -m app.ml.download_image_model` first")
+    if not args.check_only:
+        sizes = export(args.model_dir)
+        print(f"Exported to {args.model_dir}: " + ", ".join(f"{k} {v:.0f} MB" for k, v in sizes.items()))
+
+    report = check_parity(args.model_dir, sample_images(args.images, args.n))
+    for variant, r in report.items():
+        print(f"{variant}: max |logit diff| {r['max_abs_diff']:.2e}, top-1 agreement {r['top1_agreement']:.1%}, "
+              f"top-5 overlap {r['top5_overlap']:.1%}")
+    fp32 = report["fp32"]
+    if fp32["max_abs_diff"] > FP32_ATOL or fp32["top1_agreement"] < 1.0:
+        sys.exit("ONNX fp32 export does not match the eager model")
+
+
+if __name__ == "__main__":
+    main()
@@ -119,6 +119,11 @@ class PatientCreate(BaseModel):
     lab_results: Optional[LabResults] = None
 
 
+class PatientImport(PatientCreate):
+    """Row accepted by the bulk endpoint; external systems bring their own patient_id."""
+    patient_id: Optional[str] = None
+
+
 class DiagnosisRequest(BaseModel):
     patient_id: Optional[str] = None
     age: int
@@ -141,6 +146,8 @@ class DiagnosisResponse(BaseModel):
     root_cause: Optional[str] = None
     recommended_tests: list[str] = []
     recommended_treatments: list[str] = []
+    abnormal_findings: list[dict] = []
+    suggestion_source: Optional[str] = None
 
 
 class ImageAnalysisResponse(BaseModel):
@@ -149,3 +156,5 @@ class ImageAnalysisResponse(BaseModel):
     confidence: float
     abnormalities_detected: list[str]
     recommendation: str
+    image_id: Optional[str] = None
+    cache: Optional[str] = None
@@ -2,7 +2,8 @@
 import json
 import os
 from fastapi import APIRouter, HTTPException
-from app.database import get_db
+from app.database import get_db, index_report
+from app.utils.serialization import FastJSONResponse
 
 router = APIRouter(prefix="/api/data", tags=["data"])
 
@@ -40,6 +41,8 @@ async def reseed_database():
     """Clear and reseed database with fresh synthetic data."""
     db = get_db()
     await db.patients.delete_many({})
+    from app.services.patient_cache import patient_cache
+    patient_cache.clear()
 
     from app.utils.generate_synthetic_data import generate_all, save_to_json
     data_path = os.path.join(DATA_DIR, "synthetic_patients.json")
@@ -94,13 +97,16 @@ async def train_model():
 async def export_data(format: str = "json"):
     """Export patient data."""
     db = get_db()
-    cursor = db.patients.find({})
-    records = []
-    async for doc in cursor:
-        doc["_id"] = str(doc["_id"])
-        records.append(doc)
+    # ObjectId and datetime values are encoded by FastJSONResponse directly.
+    records = [doc async for doc in db.patients.find({})]
 
     if format == "json":
-        return {"data": records, "count": len(records)}
+        return FastJSONResponse({"data": records, "count": len(records)})
     else:
-        return {"data": records, "count": len(records)}
+        return FastJSONResponse({"data": records, "count": len(records)})
+
+
+@router.get("/indexes")
+async def get_indexes():
+    """Index usage stats with missing, unused and undeclared indexes per collection."""
+    return {"collections": await index_report(get_db())}
@@ -1,51 +1,68 @@
 """Diagnosis routes - ML prediction + AI suggestions."""
-import io
-import pandas as pd
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+import asyncio
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Query
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, Optional
 from datetime import datetime
 from app.models.patient import DiagnosisRequest, DiagnosisResponse
 from app.services.ml_service import ml_service
 from app.services.openai_service import openai_service
 from app.services.image_service import image_service
+from app.services.image_cache import UploadTooLarge, image_cache, upload_limit
+from app.services.history_writer import history_writer
+from app.services.reference_ranges import assess
+from app.services.knowledge_base import knowledge_base
+from app.services.enrichment import BatchEnricher
+from app.services.batch_service import (
+    PersistStats,
+    UploadParseError,
+    detach_upload,
+    iter_scored_chunks,
+    persist_chunk,
+    upload_format,
+)
+from app.config import get_settings
 from app.database import get_db
+from app.utils.projection import HISTORY_SUMMARY_FIELDS, build_projection
+from app.utils.serialization import FastJSONResponse, dumps, serialize_doc
 
 router = APIRouter(prefix="/api/diagnosis", tags=["diagnosis"])
 
 
-@router.post("/predict", response_model=DiagnosisResponse)
-async def predict_diagnosis(req: DiagnosisRequest):
-    """Predict disease from patient data using XGBoost model + OpenAI suggestions."""
+def _request_data(req: DiagnosisRequest) -> dict:
     data = req.model_dump()
     if req.vital_signs:
         data["vital_signs"] = req.vital_signs.model_dump()
     if req.lab_results:
         data["lab_results"] = req.lab_results.model_dump()
+    return data
+
 
+def _run_prediction(data: dict) -> dict:
     try:
-        prediction = ml_service.predict(data)
+        return ml_service.predict(data)
     except FileNotFoundError:
         raise HTTPException(503, "ML model not trained yet. Please train the model first.")
     except Exception as e:
         raise HTTPException(500, f"Prediction error: {str(e)}")
 
-    ai_result = await openai_service.get_diagnosis_suggestion(
-        predicted_disease=prediction["predicted_disease"],
-        confidence=prediction["confidence"],
-        top_predictions=prediction["top_predictions"],
-        patient_data=data,
-    )
 
-    db = get_db()
-    record = {
+def _history_record(data: dict, prediction: dict, ai_result: dict, source: str) -> dict:
+    # patient_id is always stored (None for ad hoc requests) so per-patient
+    # history queries can use the (patient_id, created_at) index.
+    return {
         **data,
+        "patient_id": data.get("patient_id"),
         "diagnosis": prediction["predicted_disease"],
         "confidence": prediction["confidence"],
         "ai_suggestion": ai_result.get("ai_suggestion", ""),
         "root_cause": ai_result.get("root_cause", ""),
+        "suggestion_source": source,
         "created_at": datetime.utcnow(),
     }
-    await db.diagnosis_history.insert_one(record)
 
+
+def _diagnosis_response(prediction: dict, ai_result: dict, findings: list[dict], source: str) -> DiagnosisResponse:
     return DiagnosisResponse(
         predicted_disease=prediction["predicted_disease"],
         confidence=prediction["confidence"],
@@ -54,109 +71,289 @@ async def predict_diagnosis(req: DiagnosisRequest):
         root_cause=ai_result.get("root_cause"),
         recommended_tests=ai_result.get("recommended_tests", []),
         recommended_treatments=ai_result.get("recommended_treatments", []),
+        abnormal_findings=findings,
+        suggestion_source=source,
     )
 
 
-@router.post("/upload-csv")
-async def upload_csv(file: UploadFile = File(...)):
-    """Parse CSV/Excel patient data and return predictions for each row."""
-    if not file.filename:
-        raise HTTPException(400, "No file provided")
+async def _suggestion(prediction: dict, data: dict, llm: bool, no_cache: bool) -> tuple[dict, str]:
+    """Knowledge-base suggestion for confident predictions, otherwise the LLM's."""
+    if knowledge_base.should_serve(prediction, force_llm=llm):
+        return knowledge_base.suggestion(prediction, data), "knowledge_base"
+    ai_result = await openai_service.get_diagnosis_suggestion(
+        predicted_disease=prediction["predicted_disease"],
+        confidence=prediction["confidence"],
+        top_predictions=prediction["top_predictions"],
+        patient_data=data,
+        use_cache=not no_cache,
+    )
+    return ai_result, "llm"
 
-    content = await file.read()
-    try:
-        if file.filename.endswith(".csv"):
-            df = pd.read_csv(io.BytesIO(content))
-        elif file.filename.endswith((".xlsx", ".xls")):
-            df = pd.read_excel(io.BytesIO(content))
-        else:
-            raise HTTPException(400, "Unsupported file format. Use CSV or Excel.")
-    except Exception as e:
-        raise HTTPException(400, f"Error parsing file: {str(e)}")
 
-    results = []
-    for _, row in df.iterrows():
-        data = {}
-        row_dict = row.to_dict()
-
-        data["age"] = int(row_dict.get("age", 0))
-        data["gender"] = str(row_dict.get("gender", "male"))
-        data["smoking"] = bool(row_dict.get("smoking", False))
-        data["alcohol"] = bool(row_dict.get("alcohol", False))
-
-        symptoms_raw = row_dict.get("symptoms", "")
-        if isinstance(symptoms_raw, str) and symptoms_raw:
-            data["symptoms"] = [s.strip() for s in symptoms_raw.split("|")]
-        else:
-            data["symptoms"] = []
+def _sse(event: str, payload) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + dumps(payload) + b"\n\n"
+
 
-        conditions_raw = row_dict.get("existing_conditions", "")
-        if isinstance(conditions_raw, str) and conditions_raw:
-            data["existing_conditions"] = [s.strip() for s in conditions_raw.split("|")]
+@router.post("/predict", response_model=DiagnosisResponse)
+async def predict_diagnosis(
+    req: DiagnosisRequest,
+    llm: bool = Query(False, description="Ask the LLM even when the prediction is confident"),
+    no_cache: bool = Query(False, description="Skip the LLM suggestion cache and ask the model again"),
+):
+    """Predict disease from patient data using XGBoost model + OpenAI suggestions.
+
+    Predictions at or above `kb_confidence_threshold` are explained from the
+    local knowledge base without an LLM call unless `llm=true`.
+    """
+    data = _request_data(req)
+    prediction = _run_prediction(data)
+    ai_result, source = await _suggestion(prediction, data, llm, no_cache)
+
+    await history_writer.write("diagnosis_history", _history_record(data, prediction, ai_result, source))
+
+    return _diagnosis_response(prediction, ai_result, assess(data)["findings"], source)
+
+
+@router.post("/predict/stream")
+async def predict_diagnosis_stream(
+    req: DiagnosisRequest,
+    llm: bool = Query(False, description="Ask the LLM even when the prediction is confident"),
+    no_cache: bool = Query(False, description="Skip the LLM suggestion cache and ask the model again"),
+):
+    """Same as /predict, streamed as Server-Sent Events.
+
+    Emits a `prediction` event with the ML result immediately, one `field`
+    event per AI suggestion field as the LLM produces it (all at once for
+    knowledge-base answers), and a final `done` event carrying the complete
+    DiagnosisResponse once history is queued.
+    """
+    data = _request_data(req)
+    prediction = _run_prediction(data)
+
+    async def events():
+        yield _sse("prediction", prediction)
+        if knowledge_base.should_serve(prediction, force_llm=llm):
+            source = "knowledge_base"
+            ai_result = knowledge_base.suggestion(prediction, data)
+            for field, value in ai_result.items():
+                yield _sse("field", {"field": field, "value": value})
         else:
-            data["existing_conditions"] = []
+            source = "llm"
+            ai_result = {}
+            async for field, value in openai_service.stream_diagnosis_suggestion(
+                predicted_disease=prediction["predicted_disease"],
+                confidence=prediction["confidence"],
+                top_predictions=prediction["top_predictions"],
+                patient_data=data,
+                use_cache=not no_cache,
+            ):
+                ai_result[field] = value
+                yield _sse("field", {"field": field, "value": value})
+
+        await history_writer.write("diagnosis_history", _history_record(data, prediction, ai_result, source))
+        yield _sse("done", _diagnosis_response(prediction, ai_result, assess(data)["findings"], source).model_dump())
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-        family_raw = row_dict.get("family_history", "")
-        if isinstance(family_raw, str) and family_raw:
-            data["family_history"] = [s.strip() for s in family_raw.split("|")]
+
+@router.post("/upload-csv")
+async def upload_csv(
+    file: UploadFile = File(...),
+    stream: bool = Query(False, description="Stream predictions back as NDJSON, one row per line"),
+    persist: bool = Query(False, description="Upsert rows into patients and record predictions in history"),
+    enrich: bool = Query(False, description="Add an AI suggestion to every scored row"),
+    llm: bool = Query(False, description="With enrich, ask the LLM even for confident predictions"),
+):
+    """Parse CSV/Excel/Parquet/Arrow patient data and return predictions for each row.
+
+    With `enrich=true` each row also carries the suggestion /predict would
+    give. Streamed rows are then sent as their suggestions complete, so
+    they may arrive out of order; use each row's `row` number.
+    """
+    if not file.filename:
+        raise HTTPException(400, "No file provided")
+    fmt = upload_format(file.filename)
+    if fmt is None:
+        raise HTTPException(400, "Unsupported file format. Use CSV (optionally .csv.gz), Excel, Parquet or Arrow IPC.")
+    try:
+        ml_service.load()
+    except FileNotFoundError:
+        raise HTTPException(503, "ML model not trained yet. Please train the model first.")
+
+    db = get_db()
+    stats = PersistStats() if persist else None
+    enricher = BatchEnricher(get_settings().batch_enrich_concurrency, force_llm=llm) if enrich else None
+
+    def summary(total: int) -> dict:
+        out = {"total_rows": total}
+        if stats:
+            out["persistence"] = stats.to_dict()
+        if enricher:
+            out["enrichment"] = enricher.to_dict()
+        return out
+
+    async def rows(chunk: list[dict], docs: Optional[list[dict]]) -> AsyncIterator[dict]:
+        """A chunk's rows, enriched if requested, then persisted."""
+        if enricher:
+            enriched = []
+            async for row in enricher.enrich_chunk(chunk, docs):
+                enriched.append(row)
+                yield row
+            chunk = sorted(enriched, key=lambda r: r["row"])
         else:
-            data["family_history"] = []
+            for row in chunk:
+                yield row
+        if persist:
+            await persist_chunk(db, chunk, docs, stats)
+
+    if stream:
+        fileobj = detach_upload(file)
+
+        async def ndjson():
+            total = 0
+            chunks = iter_scored_chunks(fileobj, fmt, with_documents=persist or enrich)
+            try:
+                async for chunk, docs in chunks:
+                    if enricher:
+                        async for row in rows(chunk, docs):
+                            yield dumps(row) + b"\n"
+                    else:
+                        if persist:
+                            await persist_chunk(db, chunk, docs, stats)
+                        yield b"".join(dumps(r) + b"\n" for r in chunk)
+                    total += len(chunk)
+                yield dumps(summary(total)) + b"\n"
+            except UploadParseError as e:
+                yield dumps({"error": f"Error parsing file: {str(e)}", **summary(total)}) + b"\n"
+            except Exception as e:
+                # Headers are already sent, so a server-side failure is reported in-band.
+                print(f"Batch upload failed: {e}")
+                yield dumps({"error": f"Batch processing failed: {str(e)}", **summary(total)}) + b"\n"
+            finally:
+                await chunks.aclose()
+                fileobj.close()
+
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
 
-        data["symptom_duration_days"] = int(row_dict.get("symptom_duration_days", 0) or 0)
+    results = []
+    chunks = iter_scored_chunks(file.file, fmt, with_documents=persist or enrich)
+    try:
+        async for chunk, docs in chunks:
+            results.extend([row async for row in rows(chunk, docs)])
+    except UploadParseError as e:
+        raise HTTPException(400, f"Error parsing file: {str(e)}")
+    except Exception as e:
+        print(f"Batch upload failed: {e}")
+        raise HTTPException(500, f"Batch processing failed: {str(e)}")
+    finally:
+        await chunks.aclose()
+    if enricher:
+        results.sort(key=lambda r: r["row"])
 
-        vital_signs = {}
-        lab_results = {}
-        for k, v in row_dict.items():
-            if k.startswith("vs_") and pd.notna(v):
-                vital_signs[k[3:]] = float(v)
-            elif k.startswith("lab_") and pd.notna(v):
-                lab_results[k[4:]] = float(v)
-        data["vital_signs"] = vital_signs
-        data["lab_results"] = lab_results
+    return FastJSONResponse({**summary(len(results)), "predictions": results})
 
-        try:
-            prediction = ml_service.predict(data)
-            results.append({
-                "row": int(_ + 1),
-                "patient_name": f"{row_dict.get('first_name', '')} {row_dict.get('last_name', '')}".strip(),
-                **prediction,
-            })
-        except Exception as e:
-            results.append({"row": int(_ + 1), "error": str(e)})
 
-    return {"total_rows": len(df), "predictions": results}
+def _image_history_record(filename: str, image_type: str, analysis: dict, created_at: datetime) -> dict:
+    record = {
+        "filename": filename,
+        "image_type": image_type,
+        "image_sha256": analysis["image_id"],
+        "blob": analysis["blob"],
+        "analysis_id": analysis["analysis_id"],
+        "cache": analysis["cache"],
+        "created_at": created_at,
+    }
+    if analysis["analysis_id"] is None:
+        # Not in the cache (fallback result or cache disabled): keep it here.
+        record["result"] = analysis["result"]
+    return record
 
 
 @router.post("/analyze-image")
 async def analyze_medical_image(
     file: UploadFile = File(...),
     image_type: str = Form("xray"),
+    no_cache: bool = Query(False, description="Re-analyze even if this image was analyzed before"),
 ):
-    """Analyze medical image (X-ray, MRI, CT scan)."""
+    """Analyze medical image (X-ray, MRI, CT scan).
+
+    Repeat uploads of the same bytes are answered from the image analysis
+    cache; history rows then reference the stored image and cache entry.
+    """
     if not file.filename:
         raise HTTPException(400, "No file provided")
 
-    allowed_types = ["image/jpeg", "image/png", "image/dicom", "image/webp"]
+    allowed_types = ["image/jpeg", "image/png", "image/dicom", "application/dicom", "image/webp"]
     if file.content_type and file.content_type not in allowed_types:
         if not file.filename.lower().endswith((".jpg", ".jpeg", ".png", ".webp", ".dcm")):
             raise HTTPException(400, f"Unsupported image type: {file.content_type}")
 
-    image_bytes = await file.read()
-    if len(image_bytes) > 20 * 1024 * 1024:
-        raise HTTPException(400, "Image too large. Max 20MB.")
+    # Stream the upload into the blob store rather than reading it into
+    # memory; DICOM studies may be far larger than other images.
+    head = await file.read(132)
+    await file.seek(0)
+    try:
+        image_id, blob, _ = await asyncio.to_thread(image_cache.store_stream, file.file, upload_limit(head))
+    except UploadTooLarge as e:
+        raise HTTPException(400, str(e))
 
-    result = await image_service.analyze_image(image_bytes, image_type)
+    analysis = await image_service.analyze_upload(blob, image_id, image_type, use_cache=not no_cache)
 
-    db = get_db()
-    await db.image_analysis_history.insert_one({
-        "filename": file.filename,
+    await history_writer.write(
+        "image_analysis_history", _image_history_record(file.filename, image_type, analysis, datetime.utcnow()),
+    )
+
+    return {**analysis["result"], "image_id": analysis["image_id"], "cache": analysis["cache"]}
+
+
+@router.post("/analyze-images")
+async def analyze_medical_images(
+    files: list[UploadFile] = File(...),
+    image_type: str = Form("xray"),
+    no_cache: bool = Query(False, description="Re-analyze even images analyzed before"),
+):
+    """Analyze several images, or zip archives of them (e.g. the slices of a study), in one request.
+
+    Results come back in upload order (zip members in archive order), one
+    history row each, written together.
+    """
+    settings = get_settings()
+    try:
+        stored = await asyncio.to_thread(
+            image_cache.store_uploads, [(f.filename or "", f.file) for f in files], settings.image_batch_max_files,
+        )
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    if not stored:
+        raise HTTPException(400, "No images found in the upload")
+
+    analyses = await image_service.analyze_batch(
+        [(blob, image_id) for _, image_id, blob in stored], image_type, use_cache=not no_cache,
+    )
+
+    created_at = datetime.utcnow()
+    await history_writer.write_many("image_analysis_history", [
+        _image_history_record(filename, image_type, analysis, created_at)
+        for (filename, _, _), analysis in zip(stored, analyses)
+    ])
+
+    cache = {}
+    for analysis in analyses:
+        cache[analysis["cache"]] = cache.get(analysis["cache"], 0) + 1
+    return FastJSONResponse({
+        "count": len(analyses),
         "image_type": image_type,
-        "result": result,
-        "created_at": datetime.utcnow(),
+        "cache": cache,
+        "results": [
+            {"filename": filename, **analysis["result"], "image_id": analysis["image_id"], "cache": analysis["cache"]}
+            for (filename, _, _), analysis in zip(stored, analyses)
+        ],
     })
 
-    return result
-
 
 @router.get("/symptoms")
 async def get_symptoms():
@@ -179,14 +376,17 @@ async def get_diseases():
 
 
 @router.get("/history")
-async def get_diagnosis_history(page: int = 1, limit: int = 20):
+async def get_diagnosis_history(
+    page: int = 1,
+    limit: int = 20,
+    view: str = Query("full", description="summary or full"),
+    fields: str = Query("", description="Comma-separated fields to return; overrides view"),
+):
     """Get diagnosis history."""
     db = get_db()
+    projection = build_projection(view, fields, HISTORY_SUMMARY_FIELDS)
     skip = (page - 1) * limit
     total = await db.diagnosis_history.count_documents({})
-    cursor = db.diagnosis_history.find({}).sort("created_at", -1).skip(skip).limit(limit)
-    history = []
-    async for doc in cursor:
-        doc["id"] = str(doc.pop("_id"))
-        history.append(doc)
-    return {"history": history, "total": total, "page": page, "limit": limit}
+    cursor = db.diagnosis_history.find({}, projection).sort("created_at", -1).skip(skip).limit(limit)
+    history = [serialize_doc(doc) async for doc in cursor]
+    return FastJSONResponse({"history": history, "total": total, "page": page, "limit": limit})
@@ -0,0 +1,63 @@
+"""Background batch scoring jobs - submit, poll progress, download results."""
+import asyncio
+import os
+from fastapi import APIRouter, HTTPException, UploadFile, File, Query
+from fastapi.responses import FileResponse
+from app.services.batch_service import upload_format
+from app.services.job_service import job_service
+from app.services.ml_service import ml_service
+
+router = APIRouter(prefix="/api/jobs", tags=["jobs"])
+
+RESULT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+@router.post("/", status_code=202)
+async def create_job(file: UploadFile = File(...)):
+    """Store the upload and score it in the background. Returns the job id immediately."""
+    if not file.filename:
+        raise HTTPException(400, "No file provided")
+    fmt = upload_format(file.filename)
+    if fmt is None:
+        raise HTTPException(400, "Unsupported file format. Use CSV (optionally .csv.gz), Excel, Parquet or Arrow IPC.")
+    try:
+        ml_service.load()
+    except FileNotFoundError:
+        raise HTTPException(503, "ML model not trained yet. Please train the model first.")
+
+    job = await job_service.submit(file.file, file.filename, fmt)
+    return {"job_id": job["job_id"], "status": job["status"], "status_url": f"/api/jobs/{job['job_id']}"}
+
+
+@router.get("/{job_id}")
+async def get_job(job_id: str):
+    """Job status with rows processed, throughput and ETA."""
+    job = job_service.get(job_id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+    if job["status"] == "completed":
+        job["downloads"] = {fmt: f"/api/jobs/{job_id}/result?format={fmt}" for fmt in RESULT_MEDIA_TYPES}
+    return job
+
+
+@router.get("/{job_id}/result")
+async def download_job_result(job_id: str, format: str = Query("csv", description="csv or parquet")):
+    job = job_service.get(job_id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+    if job["status"] != "completed":
+        raise HTTPException(409, f"Job is {job['status']}; results are available once it completes.")
+    if format not in RESULT_MEDIA_TYPES:
+        raise HTTPException(400, f"Unsupported format '{format}'. Use csv or parquet.")
+    try:
+        path = await asyncio.to_thread(job_service.result_path, job_id, format)
+    except ImportError:
+        raise HTTPException(501, "Parquet output requires pyarrow to be installed.")
+    return FileResponse(
+        path,
+        media_type=RESULT_MEDIA_TYPES[format],
+        filename=f"predictions-{job_id}{os.path.splitext(path)[1]}",
+    )
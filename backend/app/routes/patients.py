@@ -1,16 +1,21 @@
 """Patient CRUD routes."""
-from fastapi import APIRouter, HTTPException, Query
+import json
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, Request
 from datetime import datetime
 from bson import ObjectId
+from pydantic import TypeAdapter, ValidationError
+from pymongo.errors import BulkWriteError
 from app.database import get_db
-from app.models.patient import PatientCreate, PatientRecord
+from app.models.patient import PatientCreate, PatientImport, PatientRecord
+from app.services.patient_cache import patient_cache
+from app.utils.projection import HISTORY_SUMMARY_FIELDS, PATIENT_SUMMARY_FIELDS, build_projection
+from app.utils.serialization import FastJSONResponse, serialize_doc
 
 router = APIRouter(prefix="/api/patients", tags=["patients"])
 
-
-def serialize_doc(doc: dict) -> dict:
-    doc["id"] = str(doc.pop("_id"))
-    return doc
+BULK_CHUNK_SIZE = 1000
+_import_adapter = TypeAdapter(PatientImport)
 
 
 @router.post("/", status_code=201)
@@ -20,10 +25,104 @@ async def create_patient(patient: PatientCreate):
     data["created_at"] = datetime.utcnow()
     data["updated_at"] = datetime.utcnow()
     result = await db.patients.insert_one(data)
+    data.pop("_id", None)
     data["id"] = str(result.inserted_id)
+    patient_cache.invalidate(data["id"])
     return data
 
 
+async def _insert_chunk(db, rows: list[tuple[int, dict]], report: dict):
+    """Validate one chunk and insert the valid rows unordered."""
+    now = datetime.utcnow()
+    docs, row_numbers = [], []
+    for row_no, raw in rows:
+        try:
+            patient = _import_adapter.validate_python(raw)
+        except ValidationError as e:
+            report["errors"].append({
+                "row": row_no,
+                "error": "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()),
+            })
+            continue
+        doc = patient.model_dump()
+        if doc["patient_id"] is None:
+            # Keep the key absent so the partial unique index ignores the row.
+            del doc["patient_id"]
+        doc["created_at"] = now
+        doc["updated_at"] = now
+        docs.append(doc)
+        row_numbers.append(row_no)
+
+    if not docs:
+        return
+    try:
+        result = await db.patients.insert_many(docs, ordered=False)
+        report["inserted"] += len(result.inserted_ids)
+    except BulkWriteError as e:
+        details = e.details
+        report["inserted"] += details.get("nInserted", 0)
+        for err in details.get("writeErrors", []):
+            report["errors"].append({"row": row_numbers[err["index"]], "error": err.get("errmsg", "write error")})
+    patient_cache.invalidate_many(d.get("patient_id") for d in docs)
+
+
+@router.post("/bulk")
+async def bulk_create_patients(request: Request):
+    """Bulk insert patients from a JSON array or an NDJSON stream.
+
+    Rows are validated and written in chunks of BULK_CHUNK_SIZE with
+    unordered inserts; invalid or rejected rows are reported by their
+    1-based position and do not abort the rest of the batch.
+    """
+    db = get_db()
+    report = {"received": 0, "inserted": 0, "errors": []}
+    chunk: list[tuple[int, dict]] = []
+    content_type = request.headers.get("content-type", "")
+
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        buffer = b""
+        async for part in request.stream():
+            buffer += part
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if not line.strip():
+                    continue
+                report["received"] += 1
+                try:
+                    chunk.append((report["received"], json.loads(line)))
+                except json.JSONDecodeError as e:
+                    report["errors"].append({"row": report["received"], "error": f"Invalid JSON: {e}"})
+                if len(chunk) >= BULK_CHUNK_SIZE:
+                    await _insert_chunk(db, chunk, report)
+                    chunk = []
+        if buffer.strip():
+            report["received"] += 1
+            try:
+                chunk.append((report["received"], json.loads(buffer)))
+            except json.JSONDecodeError as e:
+                report["errors"].append({"row": report["received"], "error": f"Invalid JSON: {e}"})
+    else:
+        try:
+            rows = json.loads(await request.body())
+        except json.JSONDecodeError as e:
+            raise HTTPException(400, f"Invalid JSON: {e}")
+        if not isinstance(rows, list):
+            raise HTTPException(400, "Expected a JSON array of patients or an NDJSON body")
+        for raw in rows:
+            report["received"] += 1
+            chunk.append((report["received"], raw))
+            if len(chunk) >= BULK_CHUNK_SIZE:
+                await _insert_chunk(db, chunk, report)
+                chunk = []
+
+    if chunk:
+        await _insert_chunk(db, chunk, report)
+
+    report["errors"].sort(key=lambda e: e["row"])
+    report["failed"] = len(report["errors"])
+    return report
+
+
 @router.get("/")
 async def list_patients(
     page: int = Query(1, ge=1),
@@ -31,8 +130,13 @@ async def list_patients(
     search: str = Query("", description="Search by name or patient_id"),
     diagnosis: str = Query("", description="Filter by diagnosis"),
     country: str = Query("", description="Filter by country"),
+    view: str = Query("full", description="summary or full"),
+    fields: str = Query("", description="Comma-separated fields to return; overrides view"),
 ):
     db = get_db()
+    projection = build_projection(
+        view, fields, PATIENT_SUMMARY_FIELDS, set(PatientRecord.model_fields) | {"id"}
+    )
     query = {}
     if search:
         query["$or"] = [
@@ -47,16 +151,16 @@ async def list_patients(
 
     skip = (page - 1) * limit
     total = await db.patients.count_documents(query)
-    cursor = db.patients.find(query).sort("created_at", -1).skip(skip).limit(limit)
+    cursor = db.patients.find(query, projection).sort("created_at", -1).skip(skip).limit(limit)
     patients = [serialize_doc(doc) async for doc in cursor]
 
-    return {
+    return FastJSONResponse({
         "patients": patients,
         "total": total,
         "page": page,
         "limit": limit,
         "pages": (total + limit - 1) // limit,
-    }
+    })
 
 
 @router.get("/stats")
@@ -111,18 +215,21 @@ async def get_stats():
     async for doc in db.patients.aggregate(age_pipeline):
         age_stats.append({"range": str(doc["_id"]), "count": doc["count"]})
 
-    return {
+    return FastJSONResponse({
         "total_patients": total,
         "diagnosis_distribution": diagnosis_stats,
         "country_distribution": country_stats,
         "severity_distribution": severity_stats,
         "gender_distribution": gender_stats,
         "age_distribution": age_stats,
-    }
+    })
 
 
 @router.get("/{patient_id}")
 async def get_patient(patient_id: str):
+    cached = patient_cache.get(patient_id)
+    if cached is not None:
+        return FastJSONResponse(cached)
     db = get_db()
     patient = None
     if ObjectId.is_valid(patient_id):
@@ -131,7 +238,44 @@ async def get_patient(patient_id: str):
         patient = await db.patients.find_one({"patient_id": patient_id})
     if not patient:
         raise HTTPException(404, "Patient not found")
-    return serialize_doc(patient)
+    doc = serialize_doc(patient)
+    patient_cache.put(doc)
+    return FastJSONResponse(doc)
+
+
+async def _patient_keys(db, patient_id: str) -> list[str]:
+    """Every identifier history may be linked by: the given one, `_id` and `patient_id`."""
+    keys = {patient_id}
+    patient = patient_cache.get(patient_id)
+    if patient is None:
+        query = {"_id": ObjectId(patient_id)} if ObjectId.is_valid(patient_id) else {"patient_id": patient_id}
+        found = await db.patients.find_one(query, {"_id": 1, "patient_id": 1})
+        patient = serialize_doc(found) if found else {}
+    keys.update(v for v in (patient.get("id"), patient.get("patient_id")) if v)
+    return sorted(keys)
+
+
+@router.get("/{patient_id}/diagnoses")
+async def get_patient_diagnoses(
+    patient_id: str,
+    start: Optional[datetime] = Query(None, description="Only diagnoses at or after this time (ISO 8601)"),
+    end: Optional[datetime] = Query(None, description="Only diagnoses before this time (ISO 8601)"),
+    limit: int = Query(50, ge=1, le=500),
+):
+    """A patient's diagnosis history, newest first, served from the (patient_id, created_at) index."""
+    db = get_db()
+    keys = await _patient_keys(db, patient_id)
+    query = {"patient_id": keys[0] if len(keys) == 1 else {"$in": keys}}
+    if start or end:
+        query["created_at"] = {}
+        if start:
+            query["created_at"]["$gte"] = start
+        if end:
+            query["created_at"]["$lt"] = end
+    projection = build_projection("summary", "", HISTORY_SUMMARY_FIELDS)
+    cursor = db.diagnosis_history.find(query, projection).sort("created_at", -1).limit(limit)
+    diagnoses = [serialize_doc(doc) async for doc in cursor]
+    return FastJSONResponse({"patient_id": patient_id, "diagnoses": diagnoses, "count": len(diagnoses)})
 
 
 @router.delete("/{patient_id}")
@@ -144,4 +288,5 @@ async def delete_patient(patient_id: str):
         result = await db.patients.delete_one({"patient_id": patient_id})
     if not result or result.deleted_count == 0:
         raise HTTPException(404, "Patient not found")
+    patient_cache.invalidate(patient_id)
     return {"message": "Patient deleted"}
@@ -0,0 +1,404 @@
+"""Chunked parsing and vectorized scoring of batch patient uploads.
+
+Uploads are read a chunk of rows at a time so memory stays bounded
+regardless of file size, and each chunk is scored with a single model call.
+Parquet and Arrow IPC files are read column-wise as record batches; Excel,
+which openpyxl can only parse whole and single-threaded, is parsed in a
+separate process so it does not hold the GIL of the serving worker.
+"""
+import asyncio
+import gzip
+import io
+import multiprocessing
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import AsyncIterator, BinaryIO, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+from fastapi import UploadFile
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.config import get_settings
+from app.models.patient import PatientRecord
+from app.services.ml_service import ml_service
+
+CHUNK_ROWS = 5000
+LIST_COLUMNS = ("symptoms", "existing_conditions", "family_history")
+_TRUE_STRINGS = {"true", "1", "yes", "y", "t"}
+# Pipe-delimited columns stored as lists when rows are persisted.
+PATIENT_LIST_COLUMNS = LIST_COLUMNS + ("current_medications", "allergies")
+# Scalar PatientRecord fields copied from the upload when rows are persisted.
+PATIENT_COLUMNS = tuple(
+    name for name in PatientRecord.model_fields
+    if name not in PATIENT_LIST_COLUMNS + ("vital_signs", "lab_results", "created_at", "updated_at")
+)
+# Columns read from columnar files; vs_* and lab_* columns are added by prefix.
+INPUT_COLUMNS = PATIENT_COLUMNS + PATIENT_LIST_COLUMNS
+HISTORY_FIELDS = (
+    "age", "gender", "symptoms", "symptom_duration_days", "smoking", "alcohol",
+    "existing_conditions", "family_history", "vital_signs", "lab_results",
+)
+PERSIST_BATCH_SIZE = 1000
+# What pandas, pyarrow and openpyxl raise for malformed input. ParserError,
+# EmptyDataError, UnicodeDecodeError and pyarrow's ArrowInvalid are ValueErrors.
+_PARSE_ERRORS = (ValueError, pd.errors.ParserError, gzip.BadGzipFile, zipfile.BadZipFile, EOFError)
+
+_excel_pool: Optional[ProcessPoolExecutor] = None
+
+
+class UploadParseError(ValueError):
+    """The upload could not be read or scored as patient data."""
+
+
+def upload_format(filename: str) -> Optional[str]:
+    name = filename.lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith(".csv.gz"):
+        return "csv.gz"
+    if name.endswith((".xlsx", ".xls")):
+        return "excel"
+    if name.endswith(".parquet"):
+        return "parquet"
+    if name.endswith((".arrow", ".feather", ".ipc")):
+        return "arrow"
+    return None
+
+
+def detach_upload(file: UploadFile) -> BinaryIO:
+    """Take ownership of an upload's spooled file.
+
+    FastAPI closes form files as soon as the endpoint returns, before a
+    StreamingResponse body runs. The caller must close the returned file.
+    """
+    fileobj = file.file
+    file.file = io.BytesIO()
+    fileobj.seek(0)
+    return fileobj
+
+
+def _wanted_columns(names: list[str]) -> list[str]:
+    return [n for n in names if n in INPUT_COLUMNS or n.startswith(("vs_", "lab_"))]
+
+
+def _batch_to_frame(batch) -> pd.DataFrame:
+    """Convert an Arrow record batch, joining native list columns to pipe strings."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    columns, names = [], []
+    for name, column in zip(batch.schema.names, batch.columns):
+        if pa.types.is_list(column.type) or pa.types.is_large_list(column.type):
+            column = pc.binary_join(column.cast(pa.list_(pa.string())), "|")
+        columns.append(column)
+        names.append(name)
+    # Numeric columns without nulls convert without copying.
+    return pa.RecordBatch.from_arrays(columns, names=names).to_pandas()
+
+
+def _iter_parquet(fileobj: BinaryIO, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    import pyarrow.parquet as pq
+
+    parquet = pq.ParquetFile(fileobj)
+    columns = _wanted_columns(parquet.schema_arrow.names)
+    for batch in parquet.iter_batches(batch_size=chunk_rows, columns=columns):
+        yield _batch_to_frame(batch)
+
+
+def _iter_arrow(fileobj: BinaryIO, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    import pyarrow as pa
+
+    try:
+        reader = pa.ipc.open_file(fileobj)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    except pa.ArrowInvalid:
+        fileobj.seek(0)
+        batches = pa.ipc.open_stream(fileobj)
+    for batch in batches:
+        batch = batch.select(_wanted_columns(batch.schema.names))
+        for start in range(0, batch.num_rows, chunk_rows):
+            yield _batch_to_frame(batch.slice(start, chunk_rows))
+
+
+def _read_excel_bytes(content: bytes) -> pd.DataFrame:
+    return pd.read_excel(io.BytesIO(content))
+
+
+def _read_excel(fileobj: BinaryIO) -> pd.DataFrame:
+    """Parse an Excel upload in the worker process pool."""
+    global _excel_pool
+    if _excel_pool is None:
+        _excel_pool = ProcessPoolExecutor(
+            get_settings().excel_parse_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _excel_pool.submit(_read_excel_bytes, fileobj.read()).result()
+
+
+def iter_frames(fileobj: BinaryIO, fmt: str, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Yield upload chunks as DataFrames. Blocking; call from a worker thread."""
+    fileobj.seek(0)
+    if fmt in ("csv", "csv.gz"):
+        compression = "gzip" if fmt == "csv.gz" else None
+        with pd.read_csv(fileobj, chunksize=chunk_rows, compression=compression) as reader:
+            yield from reader
+    elif fmt == "parquet":
+        yield from _iter_parquet(fileobj, chunk_rows)
+    elif fmt == "arrow":
+        yield from _iter_arrow(fileobj, chunk_rows)
+    else:
+        df = _read_excel(fileobj)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+
+
+def shutdown():
+    global _excel_pool
+    if _excel_pool is not None:
+        _excel_pool.shutdown(cancel_futures=True)
+        _excel_pool = None
+
+
+def _column(df: pd.DataFrame, name: str, default) -> pd.Series:
+    if name in df.columns:
+        return df[name]
+    return pd.Series(default, index=df.index)
+
+
+def _pipe_list(col: pd.Series) -> pd.Series:
+    """Normalize "a | b |c" cells to "a|b|c"; non-string cells become ""."""
+    text = col.where(col.map(type) == str, "")
+    return text.str.replace(r"\s*\|\s*", "|", regex=True).str.strip().str.strip("|")
+
+
+def _pipe_count(col: pd.Series) -> pd.Series:
+    return np.where(col == "", 0, col.str.count(r"\|") + 1)
+
+
+def _to_bool(col: pd.Series) -> pd.Series:
+    if col.dtype == bool:
+        return col
+    if pd.api.types.is_numeric_dtype(col):
+        return col.fillna(0) != 0
+    return col.astype(str).str.strip().str.lower().isin(_TRUE_STRINGS)
+
+
+def normalize_frame(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.Series]:
+    """Turn a raw upload chunk into the canonical batch frame.
+
+    Returns the frame and a Series holding an error message for rows that
+    cannot be scored (NaN otherwise).
+    """
+    out = pd.DataFrame(index=df.index)
+
+    age = pd.to_numeric(_column(df, "age", 0), errors="coerce")
+    errors = pd.Series(None, index=df.index, dtype=object)
+    errors[age.isna()] = "Invalid or missing age"
+
+    out["age"] = age.fillna(0).astype(int)
+    out["gender"] = _column(df, "gender", "male").fillna("male").astype(str)
+    out["smoking"] = _to_bool(_column(df, "smoking", False))
+    out["alcohol"] = _to_bool(_column(df, "alcohol", False))
+    out["symptom_duration_days"] = (
+        pd.to_numeric(_column(df, "symptom_duration_days", 0), errors="coerce").fillna(0).astype(int)
+    )
+    for name in LIST_COLUMNS:
+        out[name] = _pipe_list(_column(df, name, ""))
+    out["n_existing_conditions"] = _pipe_count(out["existing_conditions"])
+    out["n_family_history"] = _pipe_count(out["family_history"])
+
+    for col in df.columns:
+        if isinstance(col, str) and col.startswith(("vs_", "lab_")):
+            out[col] = pd.to_numeric(df[col], errors="coerce")
+
+    first = _column(df, "first_name", "").fillna("").astype(str)
+    last = _column(df, "last_name", "").fillna("").astype(str)
+    out["patient_name"] = (first + " " + last).str.strip()
+    return out, errors
+
+
+def _split_pipes(value: str) -> list[str]:
+    return value.split("|") if value else []
+
+
+def _records(df: pd.DataFrame, columns: list[str]) -> list[dict]:
+    # to_dict("records") on zero columns returns [] rather than one {} per row
+    if not columns:
+        return [{} for _ in range(len(df))]
+    return df[columns].to_dict("records")
+
+
+def patient_documents(df: pd.DataFrame, frame: pd.DataFrame, valid: np.ndarray) -> list[dict]:
+    """Build patient documents for the valid rows of a chunk, in row order."""
+    raw = df[valid]
+    norm = frame[valid]
+    scalar_cols = [c for c in PATIENT_COLUMNS if c in raw.columns]
+    lists = {
+        name: norm[name] if name in norm.columns else _pipe_list(_column(raw, name, ""))
+        for name in PATIENT_LIST_COLUMNS
+    }
+    vs_cols = [c for c in norm.columns if c.startswith("vs_")]
+    lab_cols = [c for c in norm.columns if c.startswith("lab_")]
+
+    docs = []
+    records = _records(raw, scalar_cols)
+    vitals = _records(norm, vs_cols)
+    labs = _records(norm, lab_cols)
+    typed = norm[["age", "gender", "smoking", "alcohol", "symptom_duration_days"]].to_dict("records")
+    list_values = {name: col.tolist() for name, col in lists.items()}
+    for i, record in enumerate(records):
+        doc = {k: v for k, v in record.items() if not (v is None or (isinstance(v, float) and np.isnan(v)))}
+        if "patient_id" in doc:
+            doc["patient_id"] = str(doc["patient_id"])
+        doc.update(typed[i])
+        for name, values in list_values.items():
+            doc[name] = _split_pipes(values[i])
+        doc["vital_signs"] = {k[3:]: v for k, v in vitals[i].items() if not np.isnan(v)}
+        doc["lab_results"] = {k[4:]: v for k, v in labs[i].items() if not np.isnan(v)}
+        docs.append(doc)
+    return docs
+
+
+def _score(df: pd.DataFrame, row_offset: int, with_documents: bool) -> tuple[list[dict], Optional[list[dict]]]:
+    frame, errors = normalize_frame(df)
+    valid = errors.isna().to_numpy()
+    predictions = iter(ml_service.predict_matrix(ml_service.build_feature_matrix(frame[valid])))
+
+    results = []
+    for i, (name, ok, error) in enumerate(zip(frame["patient_name"], valid, errors)):
+        row = row_offset + i + 1
+        if not ok:
+            results.append({"row": row, "error": error})
+        else:
+            results.append({"row": row, "patient_name": name, **next(predictions)})
+    docs = patient_documents(df, frame, valid) if with_documents else None
+    return results, docs
+
+
+def score_frame(df: pd.DataFrame, row_offset: int = 0) -> list[dict]:
+    """Score one chunk. Row numbers are 1-based positions in the whole upload."""
+    return _score(df, row_offset, False)[0]
+
+
+async def iter_scored_chunks(
+    fileobj: BinaryIO, fmt: str, chunk_rows: int = CHUNK_ROWS, with_documents: bool = False
+) -> AsyncIterator[tuple[list[dict], Optional[list[dict]]]]:
+    """Parse and score chunks in a worker thread.
+
+    Yields (results, documents) per chunk; documents holds one patient
+    document per successfully scored row when `with_documents` is set.
+    Malformed input raises UploadParseError. Close the iterator with
+    aclose() when stopping early so the parser is released.
+    """
+    frames = iter_frames(fileobj, fmt, chunk_rows)
+    offset = 0
+
+    def next_chunk():
+        try:
+            df = next(frames, None)
+            if df is None:
+                return None
+            return _score(df, offset, with_documents)
+        except _PARSE_ERRORS as e:
+            raise UploadParseError(str(e)) from e
+
+    try:
+        while True:
+            scored = await asyncio.to_thread(next_chunk)
+            if scored is None:
+                break
+            offset += len(scored[0])
+            yield scored
+    finally:
+        frames.close()
+
+
+class PersistStats:
+    """Running totals for persist mode, reported alongside the predictions."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.rows = 0
+        self.patients_inserted = 0
+        self.patients_upserted = 0
+        self.patients_updated = 0
+        self.history_inserted = 0
+        self.errors: list[dict] = []
+
+    def to_dict(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            "rows_persisted": self.rows,
+            "patients_inserted": self.patients_inserted,
+            "patients_upserted": self.patients_upserted,
+            "patients_updated": self.patients_updated,
+            "history_inserted": self.history_inserted,
+            "errors": self.errors,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.rows / elapsed, 1) if elapsed else 0.0,
+        }
+
+
+async def _bulk_write(collection, ops: list, rows: list[int], stats: PersistStats, what: str):
+    for start in range(0, len(ops), PERSIST_BATCH_SIZE):
+        batch = ops[start:start + PERSIST_BATCH_SIZE]
+        try:
+            result = await collection.bulk_write(batch, ordered=False)
+        except BulkWriteError as e:
+            result = None
+            details = e.details
+            for err in details.get("writeErrors", []):
+                stats.errors.append({"row": rows[start + err["index"]], "error": f"{what}: {err.get('errmsg', 'write error')}"})
+            counts = (details.get("nInserted", 0), details.get("nUpserted", 0), details.get("nModified", 0))
+        else:
+            counts = (result.inserted_count, result.upserted_count, result.modified_count)
+        if what == "patients":
+            stats.patients_inserted += counts[0]
+            stats.patients_upserted += counts[1]
+            stats.patients_updated += counts[2]
+        else:
+            stats.history_inserted += counts[0]
+
+
+async def persist_chunk(db, results: list[dict], docs: list[dict], stats: PersistStats):
+    """Upsert a chunk's patients (by patient_id when present) and record its predictions.
+
+    Both collections are written with unordered bulk_write batches; rows
+    that fail are reported in `stats.errors` without stopping the rest.
+    """
+    from app.services.patient_cache import patient_cache
+
+    now = datetime.utcnow()
+    scored = [r for r in results if "error" not in r]
+    patient_ops, history_ops, rows = [], [], []
+    for result, doc in zip(scored, docs):
+        pid = doc.get("patient_id")
+        if pid:
+            patient_ops.append(UpdateOne(
+                {"patient_id": pid},
+                {"$set": {**doc, "updated_at": now}, "$setOnInsert": {"created_at": now}},
+                upsert=True,
+            ))
+        else:
+            doc["_id"] = ObjectId()
+            pid = str(doc["_id"])
+            patient_ops.append(InsertOne({**doc, "created_at": now, "updated_at": now}))
+        history_ops.append(InsertOne({
+            "patient_id": pid,
+            **{k: doc.get(k) for k in HISTORY_FIELDS},
+            "diagnosis": result["predicted_disease"],
+            "confidence": result["confidence"],
+            **{k: result[k] for k in ("ai_suggestion", "root_cause", "suggestion_source") if k in result},
+            "source": "upload",
+            "created_at": now,
+        }))
+        rows.append(result["row"])
+
+    await _bulk_write(db.patients, patient_ops, rows, stats, "patients")
+    await _bulk_write(db.diagnosis_history, history_ops, rows, stats, "diagnosis_history")
+    patient_cache.invalidate_many(d.get("patient_id") for d in docs)
+    stats.rows += len(rows)
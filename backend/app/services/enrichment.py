@@ -0,0 +1,94 @@
+"""AI enrichment of batch upload predictions.
+
+Each scored row gets the same suggestion /predict would give: from the
+local knowledge base when the prediction is confident, otherwise from the
+LLM. LLM calls for one upload are capped at `concurrency`, below the
+client-wide limit so interactive /predict traffic is not starved. Rows
+whose normalized profile matches one already in flight share its call;
+repeats of a finished call are answered by llm_cache.
+"""
+import asyncio
+from typing import AsyncIterator, Optional
+
+from app.services.knowledge_base import knowledge_base
+from app.services.llm_cache import diagnosis_cache_key
+from app.services.openai_service import DIAGNOSIS_MODEL, openai_service
+
+
+class BatchEnricher:
+    def __init__(self, concurrency: int = 8, force_llm: bool = False, use_cache: bool = True):
+        self.force_llm = force_llm
+        self.use_cache = use_cache
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.rows = 0
+        self.knowledge_base = 0
+        self.llm_requests = 0
+        self.deduplicated = 0
+
+    async def _llm(self, prediction: dict, patient: dict) -> dict:
+        async with self._semaphore:
+            self.llm_requests += 1
+            return await openai_service.get_diagnosis_suggestion(
+                predicted_disease=prediction["predicted_disease"],
+                confidence=prediction["confidence"],
+                top_predictions=prediction["top_predictions"],
+                patient_data=patient,
+                use_cache=self.use_cache,
+            )
+
+    async def _suggestion(self, prediction: dict, patient: dict) -> tuple[dict, str]:
+        if knowledge_base.should_serve(prediction, force_llm=self.force_llm):
+            self.knowledge_base += 1
+            return knowledge_base.suggestion(prediction, patient), "knowledge_base"
+
+        key = diagnosis_cache_key(
+            DIAGNOSIS_MODEL, prediction["predicted_disease"], prediction["confidence"],
+            prediction["top_predictions"], patient,
+        )
+        future = self._inflight.get(key)
+        if future is not None:
+            self.deduplicated += 1
+        else:
+            future = asyncio.ensure_future(self._llm(prediction, patient))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: one row's request being cancelled must not cancel the shared call
+        return dict(await asyncio.shield(future)), "llm"
+
+    async def _enrich_row(self, result: dict, patient: Optional[dict]) -> dict:
+        if patient is None:
+            return result
+        suggestion, source = await self._suggestion(result, patient)
+        return {**result, **suggestion, "suggestion_source": source}
+
+    async def enrich_chunk(self, results: list[dict], docs: list[dict]) -> AsyncIterator[dict]:
+        """Yield a chunk's rows as their suggestions complete, not in row order.
+
+        `docs` holds one patient document per successfully scored row, as
+        produced by iter_scored_chunks(with_documents=True); error rows are
+        yielded unchanged.
+        """
+        patients = iter(docs)
+        tasks = [
+            asyncio.ensure_future(self._enrich_row(r, None if "error" in r else next(patients)))
+            for r in results
+        ]
+        self.rows += len(docs)
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Only reached with work pending if the consumer went away.
+            for task in tasks:
+                task.cancel()
+            for future in list(self._inflight.values()):
+                future.cancel()
+
+    def to_dict(self) -> dict:
+        return {
+            "rows_enriched": self.rows,
+            "knowledge_base": self.knowledge_base,
+            "llm_requests": self.llm_requests,
+            "deduplicated": self.deduplicated,
+        }
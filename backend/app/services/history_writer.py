@@ -0,0 +1,148 @@
+"""Write-behind buffer for diagnosis and image analysis history.
+
+Request handlers enqueue history documents and return without waiting on
+Mongo; a background task flushes them with `insert_many` whenever
+`batch_size` documents are buffered or `flush_interval` seconds have passed
+since the first one arrived. The queue is bounded, so when Mongo falls
+behind `write()` blocks instead of growing memory without limit.
+"""
+import asyncio
+import time
+from collections import defaultdict
+from typing import Optional
+
+from pymongo.errors import BulkWriteError
+
+from app.config import get_settings
+
+_STOP = object()
+
+
+class HistoryWriter:
+    def __init__(self, max_queue: int = 10000, batch_size: int = 200, flush_interval: float = 0.5):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._db = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+        self.blocked_writes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, db):
+        self._db = db
+        self._queue = asyncio.Queue(self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def write(self, collection: str, doc: dict):
+        """Queue a history document; writes through directly if the writer is not running."""
+        if not self.running:
+            from app.database import get_db
+            db = self._db if self._db is not None else get_db()
+            await db[collection].insert_one(doc)
+            return
+        if self._queue.full():
+            self.blocked_writes += 1
+        await self._queue.put((collection, doc))
+        self.enqueued += 1
+
+    async def write_many(self, collection: str, docs: list[dict]):
+        """Queue several documents; written through with one insert_many if the writer is not running."""
+        if not docs:
+            return
+        if not self.running:
+            from app.database import get_db
+            db = self._db if self._db is not None else get_db()
+            await db[collection].insert_many(docs, ordered=False)
+            return
+        for doc in docs:
+            await self.write(collection, doc)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[tuple[str, dict]]):
+        by_collection = defaultdict(list)
+        for collection, doc in batch:
+            by_collection[collection].append(doc)
+
+        start = time.monotonic()
+        for collection, docs in by_collection.items():
+            try:
+                result = await self._db[collection].insert_many(docs, ordered=False)
+                self.written += len(result.inserted_ids)
+            except BulkWriteError as e:
+                inserted = e.details.get("nInserted", 0)
+                self.written += inserted
+                self.failed += len(docs) - inserted
+                print(f"History flush to {collection} partially failed: {len(docs) - inserted} documents")
+            except Exception as e:
+                self.failed += len(docs)
+                print(f"History flush to {collection} failed, dropped {len(docs)} documents: {e}")
+
+        elapsed_ms = (time.monotonic() - start) * 1000
+        self.flushes += 1
+        self.last_flush_ms = round(elapsed_ms, 2)
+        self.max_flush_ms = max(self.max_flush_ms, self.last_flush_ms)
+        self._total_flush_ms += elapsed_ms
+
+    async def stop(self):
+        """Flush everything queued so far and stop the background task."""
+        if not self.running:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "max_queue": self.max_queue,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "failed": self.failed,
+            "blocked_writes": self.blocked_writes,
+            "flushes": self.flushes,
+            "last_flush_ms": self.last_flush_ms,
+            "avg_flush_ms": round(self._total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+            "max_flush_ms": self.max_flush_ms,
+        }
+
+
+_settings = get_settings()
+history_writer = HistoryWriter(
+    _settings.history_queue_size,
+    _settings.history_batch_size,
+    _settings.history_flush_interval_seconds,
+)
@@ -0,0 +1,144 @@
+"""Inference backends for the local image model.
+
+"eager" runs the transformers model in PyTorch, optionally with int8
+linear layers (quantize_linear). "onnx" runs the graph written next to the
+weights by `python -m app.ml.export_image_model` under onnxruntime, with
+the feature extractor's resize/rescale/normalize redone in numpy from
+preprocessor_config.json, so neither torch nor transformers is imported.
+
+Both are synchronous, load lazily and return raw logits as a float32
+array of shape (images, classes).
+"""
+import json
+import os
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+ONNX_FILES = {"fp32": "model.onnx", "int8": "model.int8.onnx"}
+
+
+def quantize_linear(model):
+    """Dynamic int8 quantization of every nn.Linear, which hold nearly all of Swin's weights and FLOPs.
+
+    Weights are stored as int8 and activations quantized on the fly, so no
+    calibration data is needed; attention softmax and layer norms stay fp32.
+    """
+    import torch
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def top_k(logits: np.ndarray, k: int = 5) -> list[tuple[list[float], list[int]]]:
+    """Softmax probabilities and class ids of the k best classes, per row."""
+    shifted = np.exp(logits - logits.max(axis=1, keepdims=True))
+    probs = shifted / shifted.sum(axis=1, keepdims=True)
+    idx = np.argsort(-probs, axis=1)[:, :k]
+    return [(probs[i, idx[i]].tolist(), idx[i].tolist()) for i in range(len(probs))]
+
+
+class EagerBackend:
+    name = "eager"
+
+    def __init__(self, source: str, local_only: bool = True, quantize: bool = True, threads: int = 0):
+        self.source = source
+        self.local_only = local_only
+        self.quantize = quantize
+        self.threads = threads
+        self.variant = "int8" if quantize else "fp32"
+        self._model = None
+        self._extractor = None
+
+    def load(self):
+        import torch
+        from transformers import AutoFeatureExtractor, AutoModelForImageClassification
+
+        if self.threads > 0:
+            torch.set_num_threads(self.threads)
+        self._extractor = AutoFeatureExtractor.from_pretrained(self.source, local_files_only=self.local_only)
+        model = AutoModelForImageClassification.from_pretrained(
+            self.source,
+            local_files_only=self.local_only,
+            use_safetensors=True if self.local_only else None,
+        )
+        model.eval()
+        self._model = quantize_linear(model) if self.quantize else model
+
+    @property
+    def id2label(self) -> dict:
+        return self._model.config.id2label
+
+    def num_threads(self) -> int:
+        import torch
+        return torch.get_num_threads()
+
+    def logits(self, images: list[Image.Image]) -> np.ndarray:
+        import torch
+        inputs = self._extractor(images=images, return_tensors="pt")
+        with torch.inference_mode():
+            return self._model(**inputs).logits.float().numpy()
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, model_dir: str, quantize: bool = True, threads: int = 0):
+        self.model_dir = model_dir
+        self.threads = threads
+        self.variant = f"onnx-{'int8' if quantize else 'fp32'}"
+        self.path = os.path.join(model_dir, ONNX_FILES["int8" if quantize else "fp32"])
+        self._session = None
+        self._id2label: dict = {}
+        self._size = (224, 224)
+        self._resample = Image.BICUBIC
+        self._scale = 1 / 255
+        self._mean: Optional[np.ndarray] = None
+        self._std: Optional[np.ndarray] = None
+
+    def load(self):
+        import onnxruntime as ort
+
+        if not os.path.isfile(self.path):
+            raise FileNotFoundError(f"No exported model at {self.path!r}; run `python -m app.ml.export_image_model`")
+        with open(os.path.join(self.model_dir, "config.json")) as f:
+            self._id2label = {int(k): v for k, v in json.load(f).get("id2label", {}).items()}
+        with open(os.path.join(self.model_dir, "preprocessor_config.json")) as f:
+            pre = json.load(f)
+        size = pre.get("size", 224)
+        if isinstance(size, int):
+            self._size = (size, size)
+        elif "height" in size and "width" in size:
+            self._size = (size["width"], size["height"])
+        else:
+            raise ValueError(f"Unsupported preprocessor size {size!r} for the onnx backend")
+        self._resample = Image.Resampling(pre.get("resample", Image.BICUBIC))
+        self._scale = pre.get("rescale_factor", 1 / 255) if pre.get("do_rescale", True) else 1.0
+        if pre.get("do_normalize", True):
+            self._mean = np.asarray(pre["image_mean"], dtype=np.float32)
+            self._std = np.asarray(pre["image_std"], dtype=np.float32)
+
+        options = ort.SessionOptions()
+        if self.threads > 0:
+            options.intra_op_num_threads = self.threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = ort.InferenceSession(self.path, options, providers=["CPUExecutionProvider"])
+
+    @property
+    def id2label(self) -> dict:
+        return self._id2label
+
+    def num_threads(self) -> int:
+        return self.threads or os.cpu_count() or 1
+
+    def preprocess(self, images: list[Image.Image]) -> np.ndarray:
+        """What the ViT feature extractor does: resize, rescale, normalize, channels first."""
+        batch = np.stack([
+            np.asarray(image.convert("RGB").resize(self._size, self._resample), dtype=np.float32)
+            for image in images
+        ]) * np.float32(self._scale)
+        if self._mean is not None:
+            batch = (batch - self._mean) / self._std
+        return np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
+
+    def logits(self, images: list[Image.Image]) -> np.ndarray:
+        return self._session.run(["logits"], {"pixel_values": self.preprocess(images)})[0]
@@ -0,0 +1,326 @@
+"""Content-addressed storage and analysis cache for uploaded images.
+
+Every upload is identified by the SHA-256 of its bytes. The bytes are kept
+once under `<upload_dir>/images/ab/cd/<sha256>.<ext>` however many times
+they are uploaded, and analysis results live in the `image_analysis_cache`
+collection keyed by hash, image type and the model that produced them, so
+a repeat upload skips GPT-4o and the local model entirely.
+`image_analysis_history` rows reference the blob and the cache entry
+instead of carrying their own copy of the result, which is why cache
+entries have no TTL: changing the model or prompt changes the key instead.
+
+A 64-bit difference hash (dHash) is also stored. With
+`image_cache_phash_match` on, an upload whose hash is within
+`image_cache_phash_distance` bits of a cached one of the same type is
+answered from that entry. It is off by default: re-saving or re-scaling an
+image keeps its dHash, but so can two different patients' scans that
+happen to look alike at 9x8 pixels. Candidates are found through the hash
+split into distance + 1 bands, so the distance is capped at
+MAX_PHASH_DISTANCE to keep bands selective; entries stored under a
+different distance setting still match exactly, but not by band.
+"""
+import copy
+import hashlib
+import os
+import uuid
+import zipfile
+from collections import OrderedDict
+from datetime import datetime
+from typing import BinaryIO, Optional
+
+from PIL import Image
+
+from app.config import get_settings
+from app.services.image_preprocess import ImageSource, decode_image, sniff_format
+
+COLLECTION = "image_analysis_cache"
+MAX_PHASH_DISTANCE = 7
+MAX_IMAGE_MB = 20
+_COPY_CHUNK = 1024 * 1024
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def upload_limit(head: bytes) -> int:
+    """Maximum upload size in bytes for a file starting with `head`; DICOM studies get their own limit."""
+    mb = get_settings().dicom_max_upload_mb if sniff_format(head) == "dicom" else MAX_IMAGE_MB
+    return mb * 1024 * 1024
+
+
+def _peek(fileobj: BinaryIO, n: int = 132) -> bytes:
+    head = fileobj.read(n)
+    fileobj.seek(0)
+    return head
+
+
+def perceptual_hash(src: ImageSource) -> Optional[str]:
+    """64-bit dHash as 16 hex digits, or None if the image cannot be decoded."""
+    try:
+        image = decode_image(src, 64, 64).convert("L").resize((9, 8), Image.LANCZOS)
+    except ValueError:
+        return None
+    pixels = list(image.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+
+def phash_bands(phash: str, bands: int = 4) -> list[str]:
+    """Split a 64-bit hash into runs of bits; two hashes within `bands` - 1 bits of each other share at least one."""
+    value = int(phash, 16)
+    bounds = [round(i * 64 / bands) for i in range(bands + 1)]
+    out = []
+    for i in range(bands):
+        width = bounds[i + 1] - bounds[i]
+        run = (value >> (64 - bounds[i + 1])) & ((1 << width) - 1)
+        out.append(f"{i}:{run:0{(width + 3) // 4}x}")
+    return out
+
+
+def hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+class ImageAnalysisCache:
+    def __init__(self, max_entries: int = 500, enabled: bool = True,
+                 phash_match: bool = False, phash_distance: int = 3):
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.phash_match = phash_match
+        if not 0 <= phash_distance <= MAX_PHASH_DISTANCE:
+            print(f"image_cache_phash_distance={phash_distance} is outside 0-{MAX_PHASH_DISTANCE}; clamping")
+            phash_distance = min(max(phash_distance, 0), MAX_PHASH_DISTANCE)
+        self.phash_distance = phash_distance
+        # Pigeonhole: distance d flips at most d bits, leaving one of d + 1 bands intact.
+        self.phash_band_count = phash_distance + 1
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+        self.errors = 0
+        self.blobs_written = 0
+        self.blobs_deduplicated = 0
+        self.saved_latency_ms = 0.0
+
+    @property
+    def blob_dir(self) -> str:
+        return os.path.join(get_settings().upload_dir, "images")
+
+    def blob_path(self, digest: str, head: bytes) -> str:
+        ext = sniff_format(head) or "bin"
+        return os.path.join(self.blob_dir, digest[:2], digest[2:4], f"{digest}.{ext}")
+
+    def store_stream(self, fileobj: BinaryIO, max_bytes: int) -> tuple[str, str, int]:
+        """Copy a file object into the store, hashing as it goes. Blocking.
+
+        Returns (sha256, path, size). The upload is never held in memory
+        whole; if it is already stored, the copy is discarded. Raises
+        UploadTooLarge past `max_bytes`.
+        """
+        tmp_dir = os.path.join(self.blob_dir, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        tmp = os.path.join(tmp_dir, uuid.uuid4().hex)
+        sha = hashlib.sha256()
+        head, size = b"", 0
+        try:
+            with open(tmp, "wb") as out:
+                while chunk := fileobj.read(_COPY_CHUNK):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise UploadTooLarge(f"Image too large. Max {max_bytes // 2**20}MB.")
+                    if len(head) < 132:
+                        head += chunk[:132]
+                    sha.update(chunk)
+                    out.write(chunk)
+            digest = sha.hexdigest()
+            path = self.blob_path(digest, head)
+            if os.path.exists(path):
+                self.blobs_deduplicated += 1
+                os.remove(tmp)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp, path)
+                self.blobs_written += 1
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return digest, path, size
+
+    def store_uploads(self, uploads: list[tuple[str, BinaryIO]], max_files: int) -> list[tuple[str, str, str]]:
+        """Store uploaded files, expanding zip archives, as (filename, sha256, path). Blocking.
+
+        Zip members that are not recognisable images (DICOMDIR aside, any
+        readme or metadata) and hidden/__MACOSX entries are skipped; a
+        top-level upload that is neither raises ValueError before anything is
+        stored. Also raises ValueError past `max_files` images and
+        UploadTooLarge for any image over its upload_limit().
+        """
+        stored = []
+
+        def add(name: str, fileobj: BinaryIO, head: bytes):
+            if len(stored) >= max_files:
+                raise ValueError(f"Too many images. Max {max_files} per request.")
+            digest, path, _ = self.store_stream(fileobj, upload_limit(head))
+            stored.append((name, digest, path))
+
+        heads = [_peek(fileobj) for _, fileobj in uploads]
+        for (filename, _), head in zip(uploads, heads):
+            if not head.startswith(b"PK\x03\x04") and sniff_format(head) is None:
+                raise ValueError(f"{filename}: unsupported file type; upload images, DICOM or zip archives of them.")
+
+        for (filename, fileobj), head in zip(uploads, heads):
+            if not head.startswith(b"PK\x03\x04"):
+                add(filename, fileobj, head)
+                continue
+            try:
+                archive = zipfile.ZipFile(fileobj)
+            except zipfile.BadZipFile as e:
+                raise ValueError(f"{filename}: {e}")
+            with archive:
+                for info in archive.infolist():
+                    base = os.path.basename(info.filename)
+                    if info.is_dir() or base.startswith(".") or info.filename.startswith("__MACOSX/"):
+                        continue
+                    with archive.open(info) as member:
+                        member_head = _peek(member)
+                        if sniff_format(member_head) is not None:
+                            add(f"{filename}/{info.filename}", member, member_head)
+        return stored
+
+    @staticmethod
+    def key(digest: str, image_type: str, model: str) -> str:
+        return f"{digest}:{image_type}:{model}"
+
+    def _collection(self):
+        from app.database import get_db
+        db = get_db()
+        return db[COLLECTION] if db is not None else None
+
+    def _remember(self, entry: dict):
+        if self.max_entries <= 0:
+            return
+        self._entries[entry["_id"]] = entry
+        self._entries.move_to_end(entry["_id"])
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _hit(self, entry: dict) -> dict:
+        self.saved_latency_ms += entry.get("latency_ms", 0.0)
+        return copy.deepcopy(entry)
+
+    async def get(self, digest: str, image_type: str, model: str, phash: Optional[str] = None) -> Optional[dict]:
+        """Cached entry (with `_id` and `result`) for this image, or None."""
+        if not self.enabled:
+            return None
+        key = self.key(digest, image_type, model)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.memory_hits += 1
+            return self._hit(entry)
+
+        coll = self._collection()
+        if coll is None:
+            self.misses += 1
+            return None
+        try:
+            entry = await coll.find_one({"_id": key})
+            if entry is not None:
+                self.db_hits += 1
+            elif self.phash_match and phash is not None:
+                entry = await self._nearest(coll, image_type, model, phash)
+                if entry is not None:
+                    self.near_hits += 1
+                    return self._hit(entry)
+        except Exception as e:
+            self.errors += 1
+            print(f"Image cache lookup failed: {e}")
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._remember(entry)
+        return self._hit(entry)
+
+    async def _nearest(self, coll, image_type: str, model: str, phash: str) -> Optional[dict]:
+        candidates = coll.find(
+            {"phash_bands": {"$in": phash_bands(phash, self.phash_band_count)}, "image_type": image_type, "model": model},
+        ).limit(50)
+        best, best_distance = None, self.phash_distance + 1
+        async for doc in candidates:
+            distance = hamming(phash, doc["phash"])
+            if distance < best_distance:
+                best, best_distance = doc, distance
+        return best
+
+    async def put(self, digest: str, image_type: str, model: str, result: dict,
+                  blob: str, phash: Optional[str], latency_ms: float) -> Optional[str]:
+        """Store a result; returns the entry id, or None if it was not persisted."""
+        if not self.enabled:
+            return None
+        key = self.key(digest, image_type, model)
+        entry = {
+            "_id": key,
+            "sha256": digest,
+            "image_type": image_type,
+            "model": model,
+            "result": result,
+            "blob": blob,
+            "phash": phash,
+            "phash_bands": phash_bands(phash, self.phash_band_count) if phash else [],
+            "latency_ms": round(latency_ms, 1),
+            "created_at": datetime.utcnow(),
+        }
+        self._remember(copy.deepcopy(entry))
+        self.stores += 1
+        coll = self._collection()
+        if coll is None:
+            return None
+        try:
+            await coll.replace_one({"_id": key}, entry, upsert=True)
+        except Exception as e:
+            self.errors += 1
+            print(f"Image cache store failed: {e}")
+            return None
+        return key
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.db_hits + self.near_hits
+        lookups = hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "phash_match": self.phash_match,
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "stores": self.stores,
+            "errors": self.errors,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "blobs_written": self.blobs_written,
+            "blobs_deduplicated": self.blobs_deduplicated,
+            "saved_latency_ms": round(self.saved_latency_ms, 1),
+        }
+
+
+_settings = get_settings()
+image_cache = ImageAnalysisCache(
+    _settings.image_cache_size,
+    _settings.image_cache_enabled,
+    _settings.image_cache_phash_match,
+    _settings.image_cache_phash_distance,
+)
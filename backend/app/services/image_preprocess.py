@@ -0,0 +1,162 @@
+"""Decode, downscale and re-encode uploaded images before analysis.
+
+The vision API rescales every image to fit 2048x2048 and then to 768 px on
+the short side ("high" detail; 512x512 for "low"), so anything larger is
+bytes we pay to upload and it throws away. Images are identified by their
+magic bytes rather than the client's content type, JPEGs are decoded with
+Pillow's draft mode (DCT scaling, so a 12 MP photo is never fully
+decompressed), DICOM goes through app.services.dicom, and the result is
+re-encoded as a compact JPEG, or PNG when it has transparency.
+
+Sources are either the image bytes or the path of a stored file; paths
+let large DICOM studies be read frame by frame instead of whole.
+
+All functions here are CPU-bound and synchronous; call them through
+asyncio.to_thread.
+"""
+import base64
+import io
+import os
+from typing import Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from app.config import get_settings
+from app.services.dicom import decode_dicom
+
+# Pillow warns above this many pixels and raises DecompressionBombError above
+# twice it (default ~89M / ~179M). Everything is reduced to at most 1024 px
+# for the models, and the largest plain radiographs (mammograms) are ~25 MP,
+# so refuse anything over 60 MP before it is decoded. DICOM pixel data is
+# decoded by pydicom and bounded by dicom_max_upload_mb instead.
+Image.MAX_IMAGE_PIXELS = 30_000_000
+
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+)
+
+ImageSource = Union[bytes, str]
+
+DETAIL_LIMITS = {
+    # detail: (max long side, max short side)
+    "high": (2048, 768),
+    "low": (512, 512),
+}
+
+
+def sniff_format(data: bytes) -> Optional[str]:
+    """Real image format from magic bytes: jpeg, png, webp, gif, bmp, tiff, dicom or None."""
+    for signature, fmt in _SIGNATURES:
+        if data.startswith(signature):
+            return fmt
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[128:132] == b"DICM":
+        return "dicom"
+    return None
+
+
+def _head(src: ImageSource, n: int = 132) -> bytes:
+    if isinstance(src, bytes):
+        return src[:n]
+    with open(src, "rb") as f:
+        return f.read(n)
+
+
+def _read(src: ImageSource) -> bytes:
+    if isinstance(src, bytes):
+        return src
+    with open(src, "rb") as f:
+        return f.read()
+
+
+def _target_scale(width: int, height: int, max_long: int, max_short: int) -> float:
+    return min(1.0, max_long / max(width, height), max_short / min(width, height))
+
+
+def _to_display_mode(image: Image.Image) -> Image.Image:
+    """8-bit L, RGB or RGBA; 16-bit and float greyscale are rescaled, not clipped."""
+    if image.mode in ("L", "RGB", "RGBA"):
+        return image
+    if image.mode in ("I", "I;16", "I;16B", "I;16L", "F"):
+        pixels = np.asarray(image, dtype=np.float32)
+        low, high = float(pixels.min()), float(pixels.max())
+        scale = 255.0 / (high - low) if high > low else 0.0
+        return Image.fromarray(((pixels - low) * scale).astype(np.uint8), "L")
+    if image.mode in ("LA", "PA", "RGBa") or (image.mode == "P" and "transparency" in image.info):
+        return image.convert("RGBA")
+    return image.convert("L" if image.mode == "1" else "RGB")
+
+
+def decode_image(src: ImageSource, max_long: int, max_short: int) -> Image.Image:
+    """Decode to an 8-bit image no larger than the given bounds.
+
+    Raises ValueError for unknown formats and files that cannot be decoded.
+    """
+    fmt = sniff_format(_head(src))
+    if fmt == "dicom":
+        return decode_dicom(src, max_long, max_short, get_settings().dicom_max_frames)
+    if fmt is None:
+        raise ValueError("Unsupported image format: unknown")
+    try:
+        image = Image.open(io.BytesIO(src) if isinstance(src, bytes) else src)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Cannot decode {fmt} image: {e}")
+    width, height = image.size
+    scale = _target_scale(width, height, max_long, max_short)
+    if fmt == "jpeg" and scale < 1.0:
+        # Decode at the smallest 1/2, 1/4 or 1/8 scale that is still large enough.
+        image.draft(image.mode if image.mode in ("L", "RGB") else "RGB",
+                    (int(width * scale) + 1, int(height * scale) + 1))
+    try:
+        image = _to_display_mode(image)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Cannot decode {fmt} image: {e}")
+    width, height = image.size
+    scale = _target_scale(width, height, max_long, max_short)
+    if scale < 1.0:
+        image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+    return image
+
+
+def encode_compact(image: Image.Image, jpeg_quality: int = 85) -> tuple[bytes, str]:
+    """Re-encode as JPEG, or PNG when there is an alpha channel. Returns (bytes, mime type)."""
+    buf = io.BytesIO()
+    if image.mode == "RGBA":
+        image.save(buf, "PNG", optimize=True)
+        return buf.getvalue(), "image/png"
+    image.save(buf, "JPEG", quality=jpeg_quality, optimize=True)
+    return buf.getvalue(), "image/jpeg"
+
+
+def prepare_for_vision(src: ImageSource, detail: str = "high", jpeg_quality: int = 85) -> dict:
+    """Downscale and re-encode an upload for the vision API.
+
+    Returns the data URL plus sizes, so callers can log what was saved.
+    An image that needed no resizing and is already a small JPEG or PNG is
+    sent as uploaded, with its real mime type.
+    """
+    max_long, max_short = DETAIL_LIMITS.get(detail, DETAIL_LIMITS["high"])
+    fmt = sniff_format(_head(src))
+    size = len(src) if isinstance(src, bytes) else os.path.getsize(src)
+    image = decode_image(src, max_long, max_short)
+    encoded, mime = encode_compact(image, jpeg_quality)
+    if fmt in ("jpeg", "png") and size <= len(encoded):
+        data = _read(src)
+        if Image.open(io.BytesIO(data)).size == image.size:
+            encoded, mime = data, f"image/{fmt}"
+    return {
+        "data_url": f"data:{mime};base64,{base64.b64encode(encoded).decode('ascii')}",
+        "mime_type": mime,
+        "width": image.width,
+        "height": image.height,
+        "original_bytes": size,
+        "encoded_bytes": len(encoded),
+    }
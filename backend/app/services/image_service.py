@@ -1,8 +1,30 @@
 """Medical image analysis service using Hugging Face pre-trained models."""
-import io
-import torch
+import asyncio
+import os
+import threading
+import time
+from typing import Optional
+
 from PIL import Image
-from transformers import AutoFeatureExtractor, AutoModelForImageClassification
+
+from app.config import get_settings
+from app.services.image_backends import EagerBackend, OnnxBackend, top_k
+from app.services.image_cache import image_cache, perceptual_hash
+from app.services.image_preprocess import ImageSource, decode_image, prepare_for_vision
+
+VISION_MODEL = "gpt-4o"
+# Bump when the vision prompt changes so cached analyses are not served.
+IMAGE_PROMPT_VERSION = 1
+# Don't retry a failed model load on every fallback request.
+LOAD_RETRY_SECONDS = 300.0
+
+
+def _rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return None
 
 
 class MedicalImageService:
@@ -10,35 +32,238 @@ class MedicalImageService:
     with medical-specific prompt engineering via OpenAI for interpretation."""
 
     def __init__(self):
-        self._model = None
-        self._extractor = None
+        self._backend = None
         self._loaded = False
+        # One forward pass at a time per worker: the runtime already spreads
+        # it over the intra-op threads, and overlapping calls would oversubscribe them.
+        self._inference_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._retry_at = 0.0
+        self.load_error: Optional[str] = None
+        self.load_stats: dict = {}
         self.model_name = "microsoft/swin-base-patch4-window7-224-in22k"
 
-    def load(self):
-        if self._loaded:
+    @property
+    def variant(self) -> str:
+        settings = get_settings()
+        precision = "int8" if settings.image_model_quantize else "fp32"
+        return f"onnx-{precision}" if settings.image_model_backend == "onnx" else precision
+
+    def _source(self) -> tuple[str, bool]:
+        """(path or hub id, local_files_only) to load from."""
+        settings = get_settings()
+        if os.path.isfile(os.path.join(settings.image_model_dir, "config.json")):
+            return settings.image_model_dir, True
+        if settings.image_model_allow_download:
+            return self.model_name, False
+        raise FileNotFoundError(
+            f"No image model in {settings.image_model_dir!r}; run `python -m app.ml.download_image_model` "
+            "or set IMAGE_MODEL_ALLOW_DOWNLOAD=true"
+        )
+
+    def load(self, warm_up: bool = False):
+        """Load the local model once per process, optionally running a warm-up forward pass.
+
+        Pinned weights are opened as safetensors with local_files_only, so
+        nothing touches the network and the file is memory-mapped rather
+        than read up front. With IMAGE_MODEL_BACKEND=onnx the exported graph
+        next to them is used instead. A failed load is retried at most every
+        LOAD_RETRY_SECONDS; the error is reported by stats().
+        """
+        with self._load_lock:
+            if not self._loaded and time.monotonic() >= self._retry_at:
+                self._load()
+            if warm_up and self._loaded and "warmup_ms" not in self.load_stats:
+                self._warm_up()
+
+    def _warm_up(self):
+        """One forward pass on a blank image; the caller holds _load_lock."""
+        started = time.perf_counter()
+        try:
+            with self._inference_lock:
+                self._backend.logits([Image.new("RGB", (224, 224), (128, 128, 128))])
+        except Exception as e:
+            # A model that cannot run one image is treated like one that failed to load.
+            self.load_error = f"Warm-up failed: {e}"
+            self._retry_at = time.monotonic() + LOAD_RETRY_SECONDS
+            print(f"Image model warm-up failed: {e}. Will use OpenAI vision fallback.")
+            self._loaded = False
+            self._backend = None
             return
+        self.load_stats["warmup_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    def _load(self):
+        settings = get_settings()
+        started = time.perf_counter()
+        rss_before = _rss_mb()
         try:
-            self._extractor = AutoFeatureExtractor.from_pretrained(self.model_name)
-            self._model = AutoModelForImageClassification.from_pretrained(self.model_name)
-            self._model.eval()
+            if settings.image_model_backend == "onnx":
+                source = settings.image_model_dir
+                backend = OnnxBackend(source, settings.image_model_quantize, settings.image_model_threads)
+            else:
+                source, local_only = self._source()
+                backend = EagerBackend(
+                    source, local_only, settings.image_model_quantize, settings.image_model_threads,
+                )
+            backend.load()
+            self._backend = backend
             self._loaded = True
-            print(f"Image model loaded: {self.model_name}")
+            self.load_error = None
+            rss_after = _rss_mb()
+            self.load_stats = {
+                "source": source,
+                "load_seconds": round(time.perf_counter() - started, 2),
+                "rss_delta_mb": round(rss_after - rss_before, 1) if rss_before is not None else None,
+            }
+            print(f"Image model loaded: {self.model_name} ({self.variant}, {backend.num_threads()} threads) "
+                  f"from {source} in {self.load_stats['load_seconds']}s")
         except Exception as e:
+            self.load_error = str(e)
+            self._retry_at = time.monotonic() + LOAD_RETRY_SECONDS
             print(f"Failed to load image model: {e}. Will use OpenAI vision fallback.")
             self._loaded = False
 
+    def stats(self) -> dict:
+        rss = _rss_mb()
+        return {
+            "loaded": self._loaded,
+            "model": self.model_name,
+            "backend": get_settings().image_model_backend,
+            "variant": self.variant,
+            "threads": self._backend.num_threads() if self._backend else None,
+            **self.load_stats,
+            "process_rss_mb": round(rss, 1) if rss is not None else None,
+            "error": self.load_error,
+        }
+
+    def analysis_model(self) -> str:
+        """Identifier of the model that answers when nothing fails; part of the cache key."""
+        settings = get_settings()
+        if settings.openai_api_key:
+            return f"{VISION_MODEL}:{settings.vision_image_detail}:v{IMAGE_PROMPT_VERSION}"
+        return f"{self.model_name}:{self.variant}"
+
+    async def analyze_upload(self, blob: str, image_id: str, image_type: str = "xray", use_cache: bool = True) -> dict:
+        """Analyze an image stored by image_cache.store_stream, through the analysis cache.
+
+        Returns the analysis `result` with the image's SHA-256 (`image_id`),
+        its `blob` path, the cache entry id (`analysis_id`, None when the
+        result was not cached) and `cache`: hit, near (perceptual match),
+        miss or bypass. Fallback results from a failed vision call are
+        never cached.
+        """
+        return (await self.analyze_batch([(blob, image_id)], image_type, use_cache))[0]
+
+    async def analyze_batch(
+        self, images: list[tuple[str, str]], image_type: str = "xray", use_cache: bool = True,
+    ) -> list[dict]:
+        """analyze_upload for several stored images, as (blob, image_id) pairs, in input order.
+
+        Decodes run concurrently in worker threads, images seen earlier in
+        the batch are analyzed once, vision calls are capped at
+        image_batch_llm_concurrency, and images the local model answers go
+        through it in batched forward passes.
+        """
+        model = self.analysis_model()
+        # The dHash costs a decode, so it is only computed for near-match
+        # lookups and for results about to be stored, never for exact hits.
+        phashes: dict[str, Optional[str]] = {}
+
+        async def phash_of(blob: str, image_id: str) -> Optional[str]:
+            if image_id not in phashes:
+                phashes[image_id] = await asyncio.to_thread(perceptual_hash, blob)
+            return phashes[image_id]
+
+        analyses: list[Optional[dict]] = [None] * len(images)
+        if use_cache:
+            if image_cache.enabled and image_cache.phash_match:
+                lookup = await asyncio.gather(*(phash_of(blob, image_id) for blob, image_id in images))
+            else:
+                lookup = [None] * len(images)
+            entries = await asyncio.gather(*(
+                image_cache.get(image_id, image_type, model, phash)
+                for (_, image_id), phash in zip(images, lookup)
+            ))
+            for i, entry in enumerate(entries):
+                if entry is not None:
+                    blob, image_id = images[i]
+                    analyses[i] = {"result": entry["result"], "image_id": image_id, "blob": blob,
+                                   "analysis_id": entry["_id"],
+                                   "cache": "hit" if entry["sha256"] == image_id else "near"}
+        else:
+            image_cache.bypassed += len(images)
+
+        pending: dict[str, list[int]] = {}
+        for i, (_, image_id) in enumerate(images):
+            if analyses[i] is None:
+                pending.setdefault(image_id, []).append(i)
+        if not pending:
+            return analyses
+
+        blobs = {image_id: images[indices[0]][0] for image_id, indices in pending.items()}
+        outcomes = await self._analyze_many(blobs, image_type)
+
+        async def store(image_id: str) -> Optional[str]:
+            result, answered_by, latency_ms = outcomes[image_id]
+            if answered_by != model or not image_cache.enabled:
+                return None
+            phash = await phash_of(blobs[image_id], image_id)
+            return await image_cache.put(image_id, image_type, model, result, blobs[image_id], phash, latency_ms)
+
+        analysis_ids = await asyncio.gather(*(store(image_id) for image_id in pending))
+        for (image_id, indices), analysis_id in zip(pending.items(), analysis_ids):
+            for i in indices:
+                analyses[i] = {"result": outcomes[image_id][0], "image_id": image_id, "blob": blobs[image_id],
+                               "analysis_id": analysis_id, "cache": "miss" if use_cache else "bypass"}
+        return analyses
+
     async def analyze_image(
         self, image_bytes: bytes, image_type: str = "xray"
     ) -> dict:
         """Analyze medical image and return findings."""
-        from app.services.openai_service import openai_service
-        from app.config import get_settings
-        import base64
+        result, _ = await self._analyze(image_bytes, image_type)
+        return result
+
+    async def _analyze(self, src: ImageSource, image_type: str) -> tuple[dict, Optional[str]]:
+        """Findings plus the id of the model that produced them (None if no model could)."""
+        result, answered_by, _ = (await self._analyze_many({"": src}, image_type))[""]
+        return result, answered_by
 
+    async def _analyze_many(self, sources: dict, image_type: str) -> dict:
+        """{key: (findings, model id or None, latency ms)} for {key: image source}.
+
+        The vision model is tried first when configured; whatever it could
+        not answer goes to the local model as one batch.
+        """
         settings = get_settings()
+        outcomes = {}
+        if settings.openai_api_key:
+            semaphore = asyncio.Semaphore(settings.image_batch_llm_concurrency)
+
+            async def vision(key):
+                async with semaphore:
+                    started = time.perf_counter()
+                    result = await self._vision_analysis(sources[key], image_type)
+                    return key, result, (time.perf_counter() - started) * 1000
+
+            for key, result, latency_ms in await asyncio.gather(*(vision(key) for key in sources)):
+                if result is not None:
+                    outcomes[key] = (result, self.analysis_model(), latency_ms)
 
-        b64_image = base64.b64encode(image_bytes).decode("utf-8")
+        remaining = [key for key in sources if key not in outcomes]
+        if remaining:
+            started = time.perf_counter()
+            results = await self._basic_analysis([sources[key] for key in remaining], image_type)
+            latency_ms = (time.perf_counter() - started) * 1000 / len(remaining)
+            for key, (result, answered_by) in zip(remaining, results):
+                outcomes[key] = (result, answered_by, latency_ms)
+        return outcomes
+
+    async def _vision_analysis(self, src: ImageSource, image_type: str) -> Optional[dict]:
+        """Findings from the vision model, or None if it could not be used."""
+        from app.services.llm_client import llm_client
+
+        settings = get_settings()
 
         image_type_labels = {
             "xray": "chest X-ray",
@@ -66,69 +291,104 @@ Respond ONLY with valid JSON:
 }}"""
 
         try:
-            if settings.openai_api_key:
-                response = await openai_service.client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "You are a medical imaging AI specialist. Respond only with valid JSON.",
-                        },
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": prompt},
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/png;base64,{b64_image}",
-                                        "detail": "high",
-                                    },
+            prepared = await asyncio.to_thread(
+                prepare_for_vision, src, settings.vision_image_detail, settings.vision_jpeg_quality
+            )
+        except ValueError as e:
+            print(f"Image preprocessing error: {e}")
+            return None
+
+        try:
+            response = await llm_client.chat_completion(
+                model=VISION_MODEL,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You are a medical imaging AI specialist. Respond only with valid JSON.",
+                    },
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": prompt},
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": prepared["data_url"],
+                                    "detail": settings.vision_image_detail,
                                 },
-                            ],
-                        },
-                    ],
-                    temperature=0.2,
-                    max_tokens=1500,
-                )
-                import json
-                content = response.choices[0].message.content.strip()
-                if content.startswith("```"):
-                    content = content.split("\n", 1)[1].rsplit("```", 1)[0].strip()
-                return json.loads(content)
-            else:
-                return self._basic_analysis(image_bytes, image_type)
+                            },
+                        ],
+                    },
+                ],
+                temperature=0.2,
+                max_tokens=1500,
+            )
+            import json
+            content = response.choices[0].message.content.strip()
+            if content.startswith("```"):
+                content = content.split("\n", 1)[1].rsplit("```", 1)[0].strip()
+            return json.loads(content)
         except Exception as e:
             print(f"Image analysis error: {e}")
-            return self._basic_analysis(image_bytes, image_type)
+            return None
 
-    def _basic_analysis(self, image_bytes: bytes, image_type: str) -> dict:
-        """Fallback analysis using the Hugging Face model features."""
+    def _decode_for_model(self, src: ImageSource) -> Optional[Image.Image]:
         try:
-            self.load()
-            if self._model and self._extractor:
-                image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-                inputs = self._extractor(images=image, return_tensors="pt")
-                with torch.no_grad():
-                    outputs = self._model(**inputs)
-                    probs = torch.nn.functional.softmax(outputs.logits, dim=-1)
-                    top_prob, top_idx = torch.topk(probs, 5)
-
-                findings = []
-                for prob, idx in zip(top_prob[0], top_idx[0]):
-                    label = self._model.config.id2label.get(idx.item(), f"class_{idx.item()}")
-                    findings.append(f"{label} ({prob.item()*100:.1f}%)")
-
-                return {
-                    "image_type": image_type,
-                    "findings": f"Image classification results: {', '.join(findings[:3])}. Note: Using general vision model - results should be reviewed by a radiologist.",
-                    "confidence": round(top_prob[0][0].item() * 100, 2),
-                    "abnormalities_detected": ["Requires specialist review"],
-                    "recommendation": "Please have a qualified radiologist review this image for accurate medical interpretation.",
-                }
-        except Exception as e:
+            # The extractor resizes to 224 px; decoding larger is wasted work.
+            return decode_image(src, 1024, 256).convert("RGB")
+        except ValueError as e:
             print(f"Basic analysis error: {e}")
+            return None
+
+    def _classify(self, images: list[Image.Image]) -> Optional[list[tuple[list[float], list[str]]]]:
+        """Top-5 (probabilities, labels) per image in forward passes of image_batch_size; None if no model."""
+        self.load()
+        backend = self._backend
+        if not self._loaded or backend is None:
+            return None
+        batch_size = max(1, get_settings().image_batch_size)
+        scores = []
+        for start in range(0, len(images), batch_size):
+            with self._inference_lock:
+                logits = backend.logits(images[start:start + batch_size])
+            scores.extend(
+                (probs, [backend.id2label.get(idx, f"class_{idx}") for idx in ids])
+                for probs, ids in top_k(logits, 5)
+            )
+        return scores
+
+    async def _basic_analysis(self, sources: list, image_type: str) -> list[tuple[dict, Optional[str]]]:
+        """Fallback analysis using the Hugging Face model features; (findings, model id or None) per source."""
+        images = await asyncio.gather(*(asyncio.to_thread(self._decode_for_model, src) for src in sources))
+        decoded = [image for image in images if image is not None]
+        scores = None
+        if decoded:
+            try:
+                scores = await asyncio.to_thread(self._classify, decoded)
+            except Exception as e:
+                print(f"Basic analysis error: {e}")
+        scores = iter(scores or [])
+
+        results = []
+        for image in images:
+            score = next(scores, None) if image is not None else None
+            if score is None:
+                results.append((self._unavailable(image_type), None))
+                continue
+            top_prob, labels = score
+            findings = [f"{label} ({prob*100:.1f}%)" for prob, label in zip(top_prob, labels)]
+
+            results.append(({
+                "image_type": image_type,
+                "findings": f"Image classification results: {', '.join(findings[:3])}. Note: Using general vision model - results should be reviewed by a radiologist.",
+                "confidence": round(top_prob[0] * 100, 2),
+                "abnormalities_detected": ["Requires specialist review"],
+                "recommendation": "Please have a qualified radiologist review this image for accurate medical interpretation.",
+            }, f"{self.model_name}:{self.variant}"))
+        return results
 
+    @staticmethod
+    def _unavailable(image_type: str) -> dict:
         return {
             "image_type": image_type,
             "findings": "Unable to perform automated analysis. Image received successfully.",
@@ -0,0 +1,274 @@
+"""Background scoring jobs for large batch uploads.
+
+Each job lives in `<upload_dir>/jobs/<job_id>/`: the uploaded input, a
+`job.json` status file and the prediction outputs. Status is kept on disk
+rather than in memory so any uvicorn worker can answer progress and
+download requests for a job started by another. Finished jobs are removed
+after `batch_job_retention_hours`.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing
+from datetime import datetime, timedelta
+from typing import BinaryIO, Optional
+
+import pandas as pd
+
+from app.config import get_settings
+from app.services.batch_service import CHUNK_ROWS, iter_frames, score_frame
+
+RESULT_CSV = "predictions.csv"
+RESULT_PARQUET = "predictions.parquet"
+STATUS_FILE = "job.json"
+FINISHED = ("completed", "failed")
+RESULT_COLUMNS = ["row", "patient_name", "predicted_disease", "confidence", "top_predictions", "error"]
+
+
+def _results_frame(results: list[dict]) -> pd.DataFrame:
+    df = pd.DataFrame(results).reindex(columns=RESULT_COLUMNS)
+    df["top_predictions"] = df["top_predictions"].map(
+        lambda v: json.dumps(v) if isinstance(v, list) else None
+    )
+    return df
+
+
+def _init_worker():
+    # Spawned workers start with a fresh ml_service; load the model once per process.
+    from app.services.ml_service import ml_service
+    ml_service.load()
+
+
+class JobService:
+    def __init__(self):
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def jobs_dir(self) -> str:
+        return os.path.join(get_settings().upload_dir, "jobs")
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, job_id)
+
+    def _pool_executor(self) -> Optional[ProcessPoolExecutor]:
+        workers = get_settings().batch_job_workers
+        if workers <= 0:
+            return None
+        if self._pool is None:
+            # spawn, not fork: the parent runs an event loop and Mongo client threads.
+            self._pool = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker,
+            )
+        return self._pool
+
+    def _write_status(self, job: dict):
+        path = os.path.join(self.job_dir(job["job_id"]), STATUS_FILE)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(job, f, default=str)
+        os.replace(tmp, path)
+
+    def _read_status(self, job_id: str) -> Optional[dict]:
+        path = os.path.join(self.job_dir(job_id), STATUS_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            job = json.load(f)
+        if job["status"] not in FINISHED and job.get("host") == socket.gethostname() \
+                and not _pid_alive(job.get("pid")):
+            # The process running it was killed before it could record the outcome.
+            job["status"] = "failed"
+            job["error"] = "Server process exited before the job finished"
+            job["finished_at"] = datetime.utcnow()
+            self._write_status(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        # job ids are uuid4 hex; reject anything else before touching the filesystem
+        if len(job_id) != 32 or not all(c in "0123456789abcdef" for c in job_id):
+            return None
+        return self._read_status(job_id)
+
+    def cleanup(self):
+        """Delete job directories finished longer than the retention ago. Blocking."""
+        cutoff = datetime.utcnow() - timedelta(hours=get_settings().batch_job_retention_hours)
+        if not os.path.isdir(self.jobs_dir):
+            return
+        for job_id in os.listdir(self.jobs_dir):
+            if job_id in self._tasks:
+                continue
+            try:
+                job = self._read_status(job_id)
+                if job is None:
+                    # Upload never got a status file; fall back to the directory age.
+                    expired = datetime.utcfromtimestamp(os.path.getmtime(self.job_dir(job_id))) < cutoff
+                else:
+                    expired = job["status"] in FINISHED and datetime.fromisoformat(job["finished_at"]) < cutoff
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+            if expired:
+                shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+
+    def result_path(self, job_id: str, fmt: str) -> str:
+        """Path of a finished job's output, converting to Parquet on first request. Blocking."""
+        job_dir = self.job_dir(job_id)
+        csv_path = os.path.join(job_dir, RESULT_CSV)
+        if fmt == "csv":
+            return csv_path
+        parquet_path = os.path.join(job_dir, RESULT_PARQUET)
+        if not os.path.exists(parquet_path):
+            tmp = parquet_path + ".tmp"
+            pd.read_csv(csv_path).to_parquet(tmp, index=False)
+            os.replace(tmp, parquet_path)
+        return parquet_path
+
+    async def submit(self, fileobj: BinaryIO, filename: str, fmt: str) -> dict:
+        await asyncio.to_thread(self.cleanup)
+        job_id = uuid.uuid4().hex
+        job_dir = self.job_dir(job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        ext = ".csv.gz" if fmt == "csv.gz" else os.path.splitext(filename)[1].lower()
+        input_path = os.path.join(job_dir, "input" + ext)
+
+        def save():
+            fileobj.seek(0)
+            with open(input_path, "wb") as out:
+                shutil.copyfileobj(fileobj, out, 1024 * 1024)
+
+        await asyncio.to_thread(save)
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "filename": filename,
+            "format": fmt,
+            "created_at": datetime.utcnow(),
+            "started_at": None,
+            "finished_at": None,
+            "bytes_total": os.path.getsize(input_path),
+            "bytes_read": 0,
+            "rows_processed": 0,
+            "rows_failed": 0,
+            "progress": 0.0,
+            "rows_per_second": 0.0,
+            "eta_seconds": None,
+            "error": None,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+        }
+        self._write_status(job)
+        self._tasks[job_id] = asyncio.create_task(self._run(job, input_path))
+        return job
+
+    async def _run(self, job: dict, input_path: str):
+        job_dir = self.job_dir(job["job_id"])
+        csv_path = os.path.join(job_dir, RESULT_CSV)
+        pool = self._pool_executor()
+        max_inflight = get_settings().batch_job_workers * 2 if pool else 1
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        job["status"] = "running"
+        job["started_at"] = datetime.utcnow()
+        self._write_status(job)
+
+        def append(results: list[dict], header: bool):
+            _results_frame(results).to_csv(csv_path, mode="w" if header else "a", header=header, index=False)
+
+        pending: deque = deque()
+        try:
+            with open(input_path, "rb") as f, closing(iter_frames(f, job["format"], CHUNK_ROWS)) as frames:
+                def read_next():
+                    df = next(frames, None)
+                    return df, f.tell()
+
+                offset = 0
+                written = 0
+
+                async def drain_one():
+                    nonlocal written
+                    fut, bytes_read = pending.popleft()
+                    results = await fut
+                    await asyncio.to_thread(append, results, written == 0)
+                    written += 1
+                    job["rows_processed"] += len(results)
+                    job["rows_failed"] += sum(1 for r in results if "error" in r)
+                    job["bytes_read"] = bytes_read
+                    elapsed = time.monotonic() - started
+                    progress = min(bytes_read / job["bytes_total"], 1.0) if job["bytes_total"] else 0.0
+                    job["progress"] = round(progress, 4)
+                    job["rows_per_second"] = round(job["rows_processed"] / elapsed, 1) if elapsed else 0.0
+                    job["eta_seconds"] = round(elapsed * (1 - progress) / progress, 1) if progress else None
+                    await asyncio.to_thread(self._write_status, job)
+
+                while True:
+                    df, bytes_read = await asyncio.to_thread(read_next)
+                    if df is None:
+                        break
+                    if pool:
+                        fut = loop.run_in_executor(pool, score_frame, df, offset)
+                    else:
+                        fut = asyncio.ensure_future(asyncio.to_thread(score_frame, df, offset))
+                    pending.append((fut, bytes_read))
+                    offset += len(df)
+                    if len(pending) >= max_inflight:
+                        await drain_one()
+                while pending:
+                    await drain_one()
+
+            if written == 0:
+                await asyncio.to_thread(append, [], True)
+            job["status"] = "completed"
+            job["progress"] = 1.0
+            job["eta_seconds"] = 0.0
+        except asyncio.CancelledError:
+            job["status"] = "failed"
+            job["error"] = "Interrupted by server shutdown"
+            raise
+        except BrokenProcessPool:
+            # A worker died (OOM kill, segfault); the pool can't take new work,
+            # so drop it and let the next job start a fresh one.
+            if self._pool is pool:
+                self._pool = None
+                pool.shutdown(wait=False, cancel_futures=True)
+            job["status"] = "failed"
+            job["error"] = "A scoring worker process died; resubmit the file"
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+        finally:
+            for fut, _ in pending:
+                fut.cancel()
+            job["finished_at"] = datetime.utcnow()
+            self._write_status(job)
+            self._tasks.pop(job["job_id"], None)
+
+    async def shutdown(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+job_service = JobService()
@@ -0,0 +1,104 @@
+"""Local knowledge base used instead of the LLM for confident predictions.
+
+Built once from `generate_synthetic_data.DISEASES`, the same curated table
+the model was trained on, so every class the model can predict has an
+entry. When the ML confidence reaches `kb_confidence_threshold` the
+suggestion is assembled from the entry plus the patient's own matching
+symptoms and out-of-range markers, in microseconds and with no API call.
+"""
+from typing import Optional
+
+from app.config import get_settings
+from app.services.reference_ranges import REFERENCE_RANGES, assess
+from app.utils.generate_synthetic_data import DISEASES
+
+
+def _marker_tests(entry: dict) -> list[str]:
+    fields = list(entry.get("lab_markers", {})) + list(entry.get("vital_markers", {}))
+    return [REFERENCE_RANGES[f]["label"] if f in REFERENCE_RANGES else f.replace("_", " ") for f in fields]
+
+
+class KnowledgeBase:
+    def __init__(self, diseases: dict, threshold: float = 85.0):
+        self.threshold = threshold
+        self._entries = {
+            name.lower(): {
+                "disease": name,
+                "root_cause": entry["root_cause"],
+                "symptoms": set(entry["symptoms"]),
+                "treatments": list(entry["treatments"]),
+                "risk_factors": list(entry.get("risk_factors", [])),
+                "marker_fields": set(entry.get("lab_markers", {})) | set(entry.get("vital_markers", {})),
+                "tests": _marker_tests(entry),
+            }
+            for name, entry in diseases.items()
+        }
+        self.served = 0
+        self.deferred = 0
+        self.forced = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, disease: str) -> Optional[dict]:
+        return self._entries.get(disease.lower())
+
+    def should_serve(self, prediction: dict, force_llm: bool = False) -> bool:
+        """True when the prediction is confident enough and the disease is known."""
+        if force_llm:
+            self.forced += 1
+            return False
+        serve = prediction["confidence"] >= self.threshold and self.lookup(prediction["predicted_disease"]) is not None
+        if serve:
+            self.served += 1
+        else:
+            self.deferred += 1
+        return serve
+
+    def suggestion(self, prediction: dict, patient_data: dict) -> dict:
+        """A suggestion shaped like OpenAIService.get_diagnosis_suggestion's result."""
+        entry = self.lookup(prediction["predicted_disease"])
+        disease, confidence = entry["disease"], prediction["confidence"]
+        matched = [s for s in patient_data.get("symptoms") or [] if s in entry["symptoms"]]
+        out_of_range = [
+            f for f in assess(patient_data)["findings"]
+            if f["field"] in entry["marker_fields"] and f["status"] in ("low", "high")
+        ]
+
+        assessment = f"ML model predicts {disease} with {confidence}% confidence."
+        if matched:
+            assessment += f" Consistent symptoms: {', '.join(matched)}."
+        if out_of_range:
+            assessment += " Supporting findings: " + ", ".join(
+                f"{f['label']} {f['value']:g} {f['unit']} ({f['status']})" for f in out_of_range
+            ) + "."
+        if entry["risk_factors"]:
+            assessment += f" Known risk factors: {', '.join(entry['risk_factors'])}."
+
+        others = [p for p in prediction.get("top_predictions", [])[1:4] if p["confidence"] >= 1]
+        return {
+            "ai_suggestion": assessment,
+            "root_cause": entry["root_cause"],
+            "recommended_tests": list(entry["tests"]),
+            "recommended_treatments": list(entry["treatments"]),
+            "red_flags": [f"{f['label']} {f['value']:g} {f['unit']} is {f['status']}" for f in out_of_range],
+            "differential_notes": (
+                "Also consider: " + ", ".join(f"{p['disease']} ({p['confidence']}%)" for p in others)
+                if others else ""
+            ),
+        }
+
+    def stats(self) -> dict:
+        to_llm = self.deferred + self.forced
+        decided = self.served + to_llm
+        return {
+            "entries": len(self._entries),
+            "threshold": self.threshold,
+            "served": self.served,
+            "deferred_to_llm": self.deferred,
+            "forced_llm": self.forced,
+            "llm_call_rate": round(to_llm / decided, 4) if decided else 0.0,
+        }
+
+
+knowledge_base = KnowledgeBase(DISEASES, get_settings().kb_confidence_threshold)
@@ -0,0 +1,169 @@
+"""Two-level cache of LLM diagnosis suggestions.
+
+Keys are a SHA-256 of the normalized prompt inputs plus the model name:
+vitals and labs are rounded and symptom/condition lists sorted, so repeat
+submissions and CSV re-runs of the same profile share an entry. Lookups go
+to an in-process LRU first, then to the `llm_cache` collection, whose TTL
+index (see app.database.INDEXES) expires old suggestions. Entries carry the
+same expiry in memory, so a worker stops serving a suggestion when Mongo
+would, and documents the TTL monitor has not removed yet are ignored.
+"""
+import copy
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+import orjson
+
+from app.config import get_settings
+
+# Bump when the prompt template changes so stale suggestions are not served.
+PROMPT_VERSION = 2
+COLLECTION = "llm_cache"
+
+
+def _round(value, digits: int = 1):
+    if isinstance(value, float):
+        return round(value, digits)
+    return value
+
+
+def _measurements(values) -> dict:
+    if hasattr(values, "model_dump"):
+        values = values.model_dump()
+    return {k: _round(v) for k, v in sorted((values or {}).items()) if v is not None}
+
+
+def diagnosis_cache_key(
+    model: str,
+    predicted_disease: str,
+    confidence: float,
+    top_predictions: list[dict],
+    patient_data: dict,
+) -> str:
+    payload = {
+        "v": PROMPT_VERSION,
+        "abnormal_only": get_settings().llm_prompt_abnormal_only,
+        "model": model,
+        "predicted_disease": predicted_disease,
+        "confidence": round(confidence),
+        "top_predictions": [[p["disease"], round(p["confidence"])] for p in top_predictions[:5]],
+        "age": patient_data.get("age"),
+        "gender": patient_data.get("gender"),
+        "symptoms": sorted(s.strip().lower() for s in patient_data.get("symptoms") or []),
+        "symptom_duration_days": patient_data.get("symptom_duration_days"),
+        "existing_conditions": sorted(patient_data.get("existing_conditions") or []),
+        "family_history": sorted(patient_data.get("family_history") or []),
+        "smoking": bool(patient_data.get("smoking")),
+        "alcohol": bool(patient_data.get("alcohol")),
+        "vital_signs": _measurements(patient_data.get("vital_signs")),
+        "lab_results": _measurements(patient_data.get("lab_results")),
+    }
+    return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+class LLMResponseCache:
+    def __init__(self, max_entries: int = 2000, enabled: bool = True, ttl_seconds: float = 7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        # key -> (response, latency_ms, monotonic expiry)
+        self._entries: OrderedDict[str, tuple[dict, float, float]] = OrderedDict()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+        self.errors = 0
+        self.saved_latency_ms = 0.0
+
+    def _collection(self):
+        from app.database import get_db
+        db = get_db()
+        return db[COLLECTION] if db is not None else None
+
+    def _remember(self, key: str, response: dict, latency_ms: float, ttl: float):
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        self._entries[key] = (response, latency_ms, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[dict]:
+        if not self.enabled:
+            return None
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] <= time.monotonic():
+            del self._entries[key]
+            entry = None
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.memory_hits += 1
+            self.saved_latency_ms += entry[1]
+            return copy.deepcopy(entry[0])
+
+        coll = self._collection()
+        doc = None
+        if coll is not None:
+            try:
+                doc = await coll.find_one({"_id": key})
+            except Exception as e:
+                self.errors += 1
+                print(f"LLM cache lookup failed: {e}")
+        ttl = self.ttl_seconds
+        if doc is not None and doc.get("created_at") is not None:
+            ttl -= (datetime.utcnow() - doc["created_at"]).total_seconds()
+        if doc is None or ttl <= 0:
+            self.misses += 1
+            return None
+        latency_ms = doc.get("latency_ms", 0.0)
+        self._remember(key, doc["response"], latency_ms, ttl)
+        self.db_hits += 1
+        self.saved_latency_ms += latency_ms
+        return copy.deepcopy(doc["response"])
+
+    async def put(self, key: str, model: str, response: dict, latency_ms: float):
+        if not self.enabled:
+            return
+        latency_ms = round(latency_ms, 1)
+        self._remember(key, copy.deepcopy(response), latency_ms, self.ttl_seconds)
+        self.stores += 1
+        coll = self._collection()
+        if coll is None:
+            return
+        try:
+            await coll.replace_one(
+                {"_id": key},
+                {"model": model, "response": response, "latency_ms": latency_ms, "created_at": datetime.utcnow()},
+                upsert=True,
+            )
+        except Exception as e:
+            self.errors += 1
+            print(f"LLM cache store failed: {e}")
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.db_hits
+        lookups = hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "stores": self.stores,
+            "errors": self.errors,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "saved_latency_ms": round(self.saved_latency_ms, 1),
+        }
+
+
+_settings = get_settings()
+llm_cache = LLMResponseCache(_settings.llm_cache_size, _settings.llm_cache_enabled, _settings.llm_cache_ttl_seconds)
@@ -0,0 +1,270 @@
+"""Chat-completions client with a concurrency cap, deadlines, retries and a
+circuit breaker.
+
+Every call waits for one of `max_concurrency` slots, then tries the request
+until `deadline` seconds have passed since the call started (queueing
+included), retrying connection errors, timeouts, 429s and 5xx responses
+with full-jitter exponential backoff. After `failure_threshold` consecutive
+upstream failures the breaker opens and calls raise `CircuitOpenError`
+immediately, so callers return their fallback instead of tying up a worker.
+After `reset_seconds` a single probe call is let through to test recovery.
+
+Point `openai_base_url` at a local server to exercise all of this offline.
+"""
+import asyncio
+import random
+import time
+from typing import AsyncIterator, Optional
+
+import openai
+from openai import AsyncOpenAI
+
+from app.config import get_settings
+
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,  # includes APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+)
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def release_probe(self):
+        """End a half-open probe without a verdict on the provider's health."""
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+        }
+
+
+class ResilientChatClient:
+    def __init__(
+        self,
+        api_key: str = "",
+        base_url: Optional[str] = None,
+        max_concurrency: int = 16,
+        deadline: float = 30.0,
+        max_retries: int = 2,
+        retry_base_delay: float = 0.5,
+        failure_threshold: int = 5,
+        reset_seconds: float = 30.0,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client: Optional[AsyncOpenAI] = None
+        self.in_flight = 0
+        self.calls = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.deadline_exceeded = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        if self._client is None:
+            # Retries and timeouts are handled here, not by the SDK. Without
+            # a key the SDK raises here, which callers treat as a failed call;
+            # a local base_url needs no real key.
+            self._client = AsyncOpenAI(
+                api_key=self.api_key or (None if self.base_url is None else "local"),
+                base_url=self.base_url,
+                max_retries=0,
+                timeout=self.deadline,
+            )
+        return self._client
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, self.retry_base_delay * (2 ** attempt))
+
+    async def _create(self, expires_at: float, **kwargs):
+        """Issue the request with retries; the caller holds a concurrency slot."""
+        attempt = 0
+        while True:
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                self.deadline_exceeded += 1
+                raise asyncio.TimeoutError("LLM call deadline exceeded")
+            try:
+                return await asyncio.wait_for(self.client.chat.completions.create(**kwargs), remaining)
+            except RETRYABLE_ERRORS as e:
+                delay = self._backoff(attempt)
+                if attempt >= self.max_retries or time.monotonic() + delay >= expires_at:
+                    if isinstance(e, asyncio.TimeoutError):
+                        self.deadline_exceeded += 1
+                    raise
+                attempt += 1
+                self.retries += 1
+                await asyncio.sleep(delay)
+
+    async def _acquire(self, expires_at: float):
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpenError("LLM provider circuit is open")
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), max(expires_at - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            self.deadline_exceeded += 1
+            self.breaker.release_probe()
+            raise
+        self.in_flight += 1
+        self.calls += 1
+
+    def _release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def _cancelled(self):
+        """The caller went away mid-call; that says nothing about the provider's health."""
+        self.cancelled += 1
+        self.breaker.release_probe()
+
+    def _record(self, error: Optional[BaseException]):
+        if error is None:
+            self.succeeded += 1
+            self.breaker.record_success()
+            return
+        self.failed += 1
+        if isinstance(error, RETRYABLE_ERRORS):
+            self.breaker.record_failure()
+        else:
+            # A 400 means our request was bad, not that the provider is down.
+            self.breaker.release_probe()
+
+    async def chat_completion(self, **kwargs):
+        expires_at = time.monotonic() + self.deadline
+        await self._acquire(expires_at)
+        try:
+            response = await self._create(expires_at, **kwargs)
+        except Exception as e:
+            self._record(e)
+            raise
+        except BaseException:
+            self._cancelled()
+            raise
+        finally:
+            self._release()
+        self._record(None)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.prompt_tokens += usage.prompt_tokens or 0
+            self.completion_tokens += usage.completion_tokens or 0
+        return response
+
+    async def stream_chat_completion(self, **kwargs) -> AsyncIterator:
+        """Yield streamed chunks. The deadline covers the wait for the first
+        chunk; after that each chunk must arrive within `deadline` seconds.
+        The concurrency slot is held until the stream ends; a stream the
+        consumer closes or cancels early (aclose(), client disconnect) is
+        counted as cancelled, not as a success or failure.
+        """
+        expires_at = time.monotonic() + self.deadline
+        await self._acquire(expires_at)
+        error, cancelled, stream = None, False, None
+        try:
+            stream = await self._create(expires_at, stream=True, **kwargs)
+            chunks = stream.__aiter__()
+            timeout = max(expires_at - time.monotonic(), 0)
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                yield chunk
+                timeout = self.deadline
+        except Exception as e:
+            error = e
+            raise
+        except BaseException:
+            # GeneratorExit or CancelledError
+            cancelled = True
+            raise
+        finally:
+            self._release()
+            if cancelled:
+                self._cancelled()
+            else:
+                self._record(error)
+            if stream is not None:
+                await stream.close()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "deadline_exceeded": self.deadline_exceeded,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "avg_prompt_tokens": round(self.prompt_tokens / self.succeeded, 1) if self.succeeded else 0.0,
+            "circuit": self.breaker.stats(),
+        }
+
+
+_settings = get_settings()
+llm_client = ResilientChatClient(
+    api_key=_settings.openai_api_key,
+    base_url=_settings.openai_base_url,
+    max_concurrency=_settings.llm_max_concurrency,
+    deadline=_settings.llm_deadline_seconds,
+    max_retries=_settings.llm_max_retries,
+    retry_base_delay=_settings.llm_retry_base_delay_seconds,
+    failure_threshold=_settings.llm_circuit_failure_threshold,
+    reset_seconds=_settings.llm_circuit_reset_seconds,
+)
@@ -2,6 +2,7 @@
 import os
 import json
 import numpy as np
+import pandas as pd
 import joblib
 from xgboost import XGBClassifier
 
@@ -71,28 +72,66 @@ class MLService:
 
         return np.array([feat], dtype=np.float32)
 
+    def build_feature_matrix(self, frame: pd.DataFrame) -> np.ndarray:
+        """Vectorized build_feature_vector over a normalized batch frame.
+
+        `frame` must carry age, gender, smoking, alcohol, n_existing_conditions,
+        n_family_history, symptom_duration_days, a pipe-joined `symptoms`
+        string column and any `vs_*` / `lab_*` columns (see batch_service).
+        """
+        all_symptoms = self.meta["all_symptoms"]
+        n = len(frame)
+        base = np.column_stack([
+            frame["age"].to_numpy(dtype=np.float32),
+            (frame["gender"].str.lower() == "male").to_numpy(dtype=np.float32),
+            frame["smoking"].to_numpy(dtype=np.float32),
+            frame["alcohol"].to_numpy(dtype=np.float32),
+            frame["n_existing_conditions"].to_numpy(dtype=np.float32),
+            frame["n_family_history"].to_numpy(dtype=np.float32),
+            frame["symptom_duration_days"].to_numpy(dtype=np.float32),
+        ])
+
+        symptoms = frame["symptoms"].str.get_dummies(sep="|")
+        sym = symptoms.reindex(columns=all_symptoms, fill_value=0).to_numpy(dtype=np.float32)
+
+        def numeric_block(prefix: str, names: list[str]) -> np.ndarray:
+            block = np.zeros((n, len(names)), dtype=np.float32)
+            for j, name in enumerate(names):
+                col = f"{prefix}{name}"
+                if col in frame.columns:
+                    block[:, j] = pd.to_numeric(frame[col], errors="coerce").fillna(0).to_numpy(dtype=np.float32)
+            return block
+
+        vitals = numeric_block("vs_", self.meta["vital_features"])
+        labs = numeric_block("lab_", self.meta["lab_features"])
+        return np.hstack([base, sym, vitals, labs])
+
+    def _format_predictions(self, probas: np.ndarray) -> list[dict]:
+        classes = self.label_encoder.classes_
+        top_indices = np.argsort(-probas, axis=1, kind="stable")[:, :5]
+        results = []
+        for row_probas, top in zip(probas, top_indices):
+            results.append({
+                "predicted_disease": str(classes[top[0]]),
+                "confidence": round(float(row_probas[top[0]]) * 100, 2),
+                "top_predictions": [
+                    {"disease": str(classes[i]), "confidence": round(float(row_probas[i]) * 100, 2)}
+                    for i in top
+                ],
+            })
+        return results
+
     def predict(self, data: dict) -> dict:
         self.load()
         X = self.build_feature_vector(data)
-        probas = self.model.predict_proba(X)[0]
-        pred_idx = np.argmax(probas)
-        pred_disease = self.label_encoder.inverse_transform([pred_idx])[0]
-        confidence = float(probas[pred_idx])
-
-        top_indices = np.argsort(probas)[::-1][:5]
-        top_predictions = []
-        for i in top_indices:
-            disease = self.label_encoder.inverse_transform([i])[0]
-            top_predictions.append({
-                "disease": disease,
-                "confidence": round(float(probas[i]) * 100, 2),
-            })
+        return self._format_predictions(self.model.predict_proba(X))[0]
 
-        return {
-            "predicted_disease": pred_disease,
-            "confidence": round(confidence * 100, 2),
-            "top_predictions": top_predictions,
-        }
+    def predict_matrix(self, X: np.ndarray) -> list[dict]:
+        """Score a whole feature matrix with one model call."""
+        self.load()
+        if len(X) == 0:
+            return []
+        return self._format_predictions(self.model.predict_proba(X))
 
     def get_available_symptoms(self) -> list[str]:
         self.load()
@@ -1,42 +1,103 @@
 """OpenAI service for AI-powered diagnosis suggestions and root cause analysis."""
-from openai import AsyncOpenAI
+import json
+import time
+from typing import AsyncIterator
 from app.config import get_settings
+from app.services.llm_cache import diagnosis_cache_key, llm_cache
+from app.services.llm_client import llm_client
+from app.services.reference_ranges import assess, format_findings
 
+DIAGNOSIS_MODEL = "gpt-4o"
+
+SUGGESTION_KEYS = (
+    "ai_suggestion", "root_cause", "recommended_tests",
+    "recommended_treatments", "red_flags", "differential_notes",
+)
+_LIST_KEYS = {"recommended_tests", "recommended_treatments", "red_flags"}
+
+
+class JSONFieldStream:
+    """Incrementally parse a streamed JSON object, yielding each top-level
+    (key, value) pair as soon as its value is complete.
+
+    Leading markdown fences or prose before the opening brace are skipped.
+    A value is only accepted once the delimiter after it has arrived, so a
+    number split across chunks is never reported early.
+    """
 
-class OpenAIService:
     def __init__(self):
-        self._client = None
+        self._buf = ""
+        self._pos = 0
+        self._started = False
+        self._done = False
+        self._decoder = json.JSONDecoder()
+
+    def _skip_ws(self, pos: int) -> int:
+        while pos < len(self._buf) and self._buf[pos] in " \t\r\n":
+            pos += 1
+        return pos
+
+    def feed(self, text: str) -> list[tuple[str, object]]:
+        self._buf += text
+        out = []
+        if not self._started:
+            brace = self._buf.find("{", self._pos)
+            if brace < 0:
+                return out
+            self._pos = brace + 1
+            self._started = True
+        while not self._done:
+            pos = self._skip_ws(self._pos)
+            if pos < len(self._buf) and self._buf[pos] == ",":
+                pos = self._skip_ws(pos + 1)
+            if pos >= len(self._buf):
+                break
+            if self._buf[pos] == "}":
+                self._done = True
+                break
+            try:
+                key, pos = self._decoder.raw_decode(self._buf, pos)
+                pos = self._skip_ws(pos)
+                if pos >= len(self._buf) or self._buf[pos] != ":":
+                    break
+                value, end = self._decoder.raw_decode(self._buf, self._skip_ws(pos + 1))
+            except json.JSONDecodeError:
+                break
+            after = self._skip_ws(end)
+            if after >= len(self._buf):
+                break
+            out.append((key, value))
+            self._pos = after
+        return out
 
     @property
-    def client(self) -> AsyncOpenAI:
-        if self._client is None:
-            settings = get_settings()
-            self._client = AsyncOpenAI(api_key=settings.openai_api_key)
-        return self._client
+    def done(self) -> bool:
+        """Whether the object's closing brace has arrived."""
+        return self._done
 
-    async def get_diagnosis_suggestion(
+    def close(self) -> list[tuple[str, object]]:
+        """Flush a final value that was not followed by a delimiter."""
+        if self._done or not self._started:
+            return []
+        return self.feed("}")
+
+
+class OpenAIService:
+    def _build_diagnosis_prompt(
         self,
         predicted_disease: str,
         confidence: float,
         top_predictions: list[dict],
         patient_data: dict,
-    ) -> dict:
+    ) -> str:
         symptoms = ", ".join(patient_data.get("symptoms", []))
         existing = ", ".join(patient_data.get("existing_conditions", [])) or "None"
         family = ", ".join(patient_data.get("family_history", [])) or "None"
 
-        vital_signs = patient_data.get("vital_signs", {}) or {}
-        if hasattr(vital_signs, "model_dump"):
-            vital_signs = vital_signs.model_dump()
-        lab_results = patient_data.get("lab_results", {}) or {}
-        if hasattr(lab_results, "model_dump"):
-            lab_results = lab_results.model_dump()
-
-        vitals_str = ", ".join(f"{k}: {v}" for k, v in vital_signs.items() if v) if vital_signs else "Not available"
-        labs_str = ", ".join(f"{k}: {v}" for k, v in lab_results.items() if v) if lab_results else "Not available"
+        measurements = self._measurement_lines(patient_data)
         preds_str = "\n".join(f"  - {p['disease']}: {p['confidence']}%" for p in top_predictions[:5])
 
-        prompt = f"""You are a senior medical consultant AI assistant helping doctors with diagnosis.
+        return f"""You are a senior medical consultant AI assistant helping doctors with diagnosis.
 
 PATIENT PROFILE:
 - Age: {patient_data.get('age', 'N/A')}, Gender: {patient_data.get('gender', 'N/A')}
@@ -45,8 +106,7 @@ PATIENT PROFILE:
 - Existing conditions: {existing}
 - Family history: {family}
 - Smoking: {patient_data.get('smoking', False)}, Alcohol: {patient_data.get('alcohol', False)}
-- Vital Signs: {vitals_str}
-- Lab Results: {labs_str}
+{measurements}
 
 ML MODEL PREDICTIONS:
 - Primary prediction: {predicted_disease} (confidence: {confidence}%)
@@ -64,40 +124,176 @@ Provide a structured medical analysis with:
 Format the response as structured JSON with keys: assessment, root_cause, recommended_tests (array), treatment_plan, red_flags (array), differential_notes.
 Respond ONLY with valid JSON, no markdown."""
 
+    @staticmethod
+    def _measurement_lines(patient_data: dict) -> str:
+        """Vitals and labs for the prompt.
+
+        By default only abnormal and borderline values are listed, with a
+        count of the normal ones; `llm_prompt_abnormal_only=False` restores
+        the full listing of every non-empty value.
+        """
+        if get_settings().llm_prompt_abnormal_only:
+            return f"- Abnormal/borderline findings (L/H = low/high, reference range): {format_findings(assess(patient_data))}"
+
+        vital_signs = patient_data.get("vital_signs", {}) or {}
+        if hasattr(vital_signs, "model_dump"):
+            vital_signs = vital_signs.model_dump()
+        lab_results = patient_data.get("lab_results", {}) or {}
+        if hasattr(lab_results, "model_dump"):
+            lab_results = lab_results.model_dump()
+
+        vitals_str = ", ".join(f"{k}: {v}" for k, v in vital_signs.items() if v) if vital_signs else "Not available"
+        labs_str = ", ".join(f"{k}: {v}" for k, v in lab_results.items() if v) if lab_results else "Not available"
+        return f"- Vital Signs: {vitals_str}\n- Lab Results: {labs_str}"
+
+    def _diagnosis_messages(self, prompt: str) -> list[dict]:
+        return [
+            {"role": "system", "content": "You are a medical AI assistant. Respond only with valid JSON."},
+            {"role": "user", "content": prompt},
+        ]
+
+    @staticmethod
+    def _suggestion_field(key: str, value):
+        """Map one key of the model's JSON onto the API response field."""
+        if key == "assessment":
+            return "ai_suggestion", value
+        if key == "treatment_plan":
+            return "recommended_treatments", [value]
+        if key in SUGGESTION_KEYS:
+            return key, value
+        return None
+
+    def _suggestion_from_json(self, result: dict) -> dict:
+        return {
+            "ai_suggestion": result.get("assessment", ""),
+            "root_cause": result.get("root_cause", ""),
+            "recommended_tests": result.get("recommended_tests", []),
+            "recommended_treatments": [result.get("treatment_plan", "")],
+            "red_flags": result.get("red_flags", []),
+            "differential_notes": result.get("differential_notes", ""),
+        }
+
+    def _fallback_suggestion(self, predicted_disease: str, confidence: float) -> dict:
+        return {
+            "ai_suggestion": f"ML model predicts {predicted_disease} with {confidence}% confidence. Please consult with specialists for detailed analysis.",
+            "root_cause": "Unable to generate AI analysis. Please review patient data manually.",
+            "recommended_tests": [],
+            "recommended_treatments": [],
+            "red_flags": [],
+            "differential_notes": "",
+        }
+
+    async def get_diagnosis_suggestion(
+        self,
+        predicted_disease: str,
+        confidence: float,
+        top_predictions: list[dict],
+        patient_data: dict,
+        use_cache: bool = True,
+    ) -> dict:
+        """Suggestion for a prediction, served from llm_cache when possible.
+
+        With `use_cache=False` the cache is not read but a fresh answer
+        still replaces the stored one.
+        """
+        cache_key = diagnosis_cache_key(DIAGNOSIS_MODEL, predicted_disease, confidence, top_predictions, patient_data)
+        if use_cache:
+            cached = await llm_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        else:
+            llm_cache.bypassed += 1
+
+        prompt = self._build_diagnosis_prompt(predicted_disease, confidence, top_predictions, patient_data)
+        start = time.monotonic()
         try:
-            response = await self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You are a medical AI assistant. Respond only with valid JSON."},
-                    {"role": "user", "content": prompt},
-                ],
+            response = await llm_client.chat_completion(
+                model=DIAGNOSIS_MODEL,
+                messages=self._diagnosis_messages(prompt),
                 temperature=0.3,
                 max_tokens=2000,
             )
 
-            import json
             content = response.choices[0].message.content.strip()
             if content.startswith("```"):
                 content = content.split("\n", 1)[1].rsplit("```", 1)[0].strip()
-            result = json.loads(content)
-            return {
-                "ai_suggestion": result.get("assessment", ""),
-                "root_cause": result.get("root_cause", ""),
-                "recommended_tests": result.get("recommended_tests", []),
-                "recommended_treatments": [result.get("treatment_plan", "")],
-                "red_flags": result.get("red_flags", []),
-                "differential_notes": result.get("differential_notes", ""),
-            }
+            result = self._suggestion_from_json(json.loads(content))
         except Exception as e:
             print(f"OpenAI API error: {e}")
-            return {
-                "ai_suggestion": f"ML model predicts {predicted_disease} with {confidence}% confidence. Please consult with specialists for detailed analysis.",
-                "root_cause": "Unable to generate AI analysis. Please review patient data manually.",
-                "recommended_tests": [],
-                "recommended_treatments": [],
-                "red_flags": [],
-                "differential_notes": "",
-            }
+            return self._fallback_suggestion(predicted_disease, confidence)
+        await llm_cache.put(cache_key, DIAGNOSIS_MODEL, result, (time.monotonic() - start) * 1000)
+        return result
+
+    async def stream_diagnosis_suggestion(
+        self,
+        predicted_disease: str,
+        confidence: float,
+        top_predictions: list[dict],
+        patient_data: dict,
+        use_cache: bool = True,
+    ) -> AsyncIterator[tuple[str, object]]:
+        """Stream the suggestion as (field, value) pairs as each JSON key completes.
+
+        Fields use the same names as get_diagnosis_suggestion's result. On
+        error the remaining fields are filled from the fallback suggestion.
+        A cached suggestion is replayed field by field; a streamed one is
+        cached only if its JSON object arrived complete.
+        """
+        cache_key = diagnosis_cache_key(DIAGNOSIS_MODEL, predicted_disease, confidence, top_predictions, patient_data)
+        if use_cache:
+            cached = await llm_cache.get(cache_key)
+            if cached is not None:
+                for field, value in cached.items():
+                    yield field, value
+                return
+        else:
+            llm_cache.bypassed += 1
+
+        prompt = self._build_diagnosis_prompt(predicted_disease, confidence, top_predictions, patient_data)
+        emitted = {}
+        start = time.monotonic()
+        stream = llm_client.stream_chat_completion(
+            model=DIAGNOSIS_MODEL,
+            messages=self._diagnosis_messages(prompt),
+            temperature=0.3,
+            max_tokens=2000,
+        )
+        try:
+            parser = JSONFieldStream()
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                for key, value in parser.feed(delta):
+                    mapped = self._suggestion_field(key, value)
+                    if mapped:
+                        emitted[mapped[0]] = mapped[1]
+                        yield mapped
+            # A stream cut short (max_tokens, dropped connection) is shown but not cached.
+            complete = parser.done
+            for key, value in parser.close():
+                mapped = self._suggestion_field(key, value)
+                if mapped:
+                    emitted[mapped[0]] = mapped[1]
+                    yield mapped
+            if not emitted:
+                raise ValueError("No JSON fields in model response")
+        except Exception as e:
+            print(f"OpenAI API streaming error: {e}")
+            fallback = self._fallback_suggestion(predicted_disease, confidence)
+            for key, value in fallback.items():
+                if key not in emitted:
+                    yield key, value
+            return
+        finally:
+            # Release the client's slot now, not when the generator is collected.
+            await stream.aclose()
+        if not complete:
+            return
+        result = {key: emitted.get(key, [] if key in _LIST_KEYS else "") for key in SUGGESTION_KEYS}
+        await llm_cache.put(cache_key, DIAGNOSIS_MODEL, result, (time.monotonic() - start) * 1000)
 
 
 openai_service = OpenAIService()
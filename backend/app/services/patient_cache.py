@@ -0,0 +1,129 @@
+"""In-process LRU/TTL cache of serialized patient documents.
+
+Entries are reachable by both the Mongo `_id` (as a string) and the
+external `patient_id`. Writes made by this process invalidate entries
+directly; other replicas can be kept in sync by running `watch_changes()`,
+which follows the `patients` change stream.
+"""
+import asyncio
+import copy
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import bson
+
+from app.config import get_settings
+
+
+class _Entry:
+    __slots__ = ("doc", "expires_at", "size")
+
+    def __init__(self, doc: dict, expires_at: float, size: int):
+        self.doc = doc
+        self.expires_at = expires_at
+        self.size = size
+
+
+class PatientCache:
+    def __init__(self, max_entries: int = 5000, ttl_seconds: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._by_id: OrderedDict[str, _Entry] = OrderedDict()
+        self._by_patient_id: dict[str, str] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[dict]:
+        """Look up by `_id` first, then by `patient_id`, like get_patient does."""
+        doc_id = key if key in self._by_id else self._by_patient_id.get(key)
+        entry = self._by_id.get(doc_id) if doc_id else None
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at < time.monotonic():
+            self._remove(doc_id)
+            self.misses += 1
+            return None
+        self._by_id.move_to_end(doc_id)
+        self.hits += 1
+        return copy.deepcopy(entry.doc)
+
+    def put(self, doc: dict):
+        """Cache a serialized patient (with `id` instead of `_id`)."""
+        if self.max_entries <= 0:
+            return
+        doc_id = doc["id"]
+        self._remove(doc_id)
+        try:
+            size = len(bson.encode(doc))
+        except Exception:
+            size = 0
+        self._by_id[doc_id] = _Entry(copy.deepcopy(doc), time.monotonic() + self.ttl_seconds, size)
+        self._bytes += size
+        if doc.get("patient_id"):
+            self._by_patient_id[doc["patient_id"]] = doc_id
+        while len(self._by_id) > self.max_entries:
+            self._remove(next(iter(self._by_id)))
+
+    def invalidate(self, key: str):
+        """Drop the entry reachable by `key`, whether it is an `_id` or a `patient_id`."""
+        doc_id = key if key in self._by_id else self._by_patient_id.get(key)
+        if doc_id and self._remove(doc_id):
+            self.invalidations += 1
+        # A patient_id may point at nothing cached yet; forget the mapping anyway.
+        self._by_patient_id.pop(key, None)
+
+    def invalidate_many(self, keys):
+        for key in keys:
+            if key:
+                self.invalidate(str(key))
+
+    def clear(self):
+        self._by_id.clear()
+        self._by_patient_id.clear()
+        self._bytes = 0
+
+    def _remove(self, doc_id: str) -> bool:
+        entry = self._by_id.pop(doc_id, None)
+        if entry is None:
+            return False
+        self._bytes -= entry.size
+        pid = entry.doc.get("patient_id")
+        if pid and self._by_patient_id.get(pid) == doc_id:
+            del self._by_patient_id[pid]
+        return True
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._by_id),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "approx_bytes": self._bytes,
+        }
+
+    async def watch_changes(self, collection):
+        """Invalidate entries changed by other replicas. Requires a replica set."""
+        while True:
+            try:
+                async with collection.watch(
+                    [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+                ) as stream:
+                    async for change in stream:
+                        self.invalidate(str(change["documentKey"]["_id"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Patient cache change stream error: {e}. Retrying in 5s.")
+                await asyncio.sleep(5)
+
+
+_settings = get_settings()
+patient_cache = PatientCache(_settings.patient_cache_size, _settings.patient_cache_ttl_seconds)
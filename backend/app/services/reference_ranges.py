@@ -0,0 +1,187 @@
+"""Age- and sex-aware reference ranges for vital signs and lab results.
+
+Units follow the rest of the app (see generate_synthetic_data): temperature
+in °F, cell counts per µL, most chemistry in mg/dL. Each field lists rules
+as (sex, min_age, max_age, low, high); the first rule whose sex (None =
+any) and age bracket [min_age, max_age) match is used. A bound of None
+means the range is open on that side, and a field with no matching rule is
+not assessed.
+"""
+from typing import Optional
+
+# Share of the range width (or of the bound, for open ranges) inside each
+# edge that counts as borderline.
+BORDERLINE_MARGIN = 0.05
+
+_ADULT = 18
+_ANY_AGE = (0, None)
+
+REFERENCE_RANGES: dict[str, dict] = {
+    # Vital signs
+    "blood_pressure_systolic": {"label": "Systolic BP", "unit": "mmHg", "rules": [
+        (None, 0, _ADULT, 90, 120), (None, 65, None, 90, 140), (None, _ADULT, 65, 90, 130),
+    ]},
+    "blood_pressure_diastolic": {"label": "Diastolic BP", "unit": "mmHg", "rules": [
+        (None, 0, _ADULT, 55, 80), (None, _ADULT, None, 60, 85),
+    ]},
+    "heart_rate": {"label": "Heart rate", "unit": "bpm", "rules": [
+        (None, 0, 12, 70, 120), (None, 12, None, 60, 100),
+    ]},
+    "temperature": {"label": "Temperature", "unit": "°F", "rules": [(None, *_ANY_AGE, 97.0, 99.5)]},
+    "respiratory_rate": {"label": "Respiratory rate", "unit": "/min", "rules": [
+        (None, 0, 12, 18, 30), (None, 12, None, 12, 20),
+    ]},
+    "oxygen_saturation": {"label": "SpO2", "unit": "%", "rules": [(None, *_ANY_AGE, 95, 100)]},
+    "bmi": {"label": "BMI", "unit": "kg/m²", "rules": [(None, _ADULT, None, 18.5, 24.9)]},
+    # Haematology
+    "hemoglobin": {"label": "Hemoglobin", "unit": "g/dL", "rules": [
+        (None, 0, _ADULT, 11.0, 15.5), ("male", _ADULT, None, 13.5, 17.5), (None, _ADULT, None, 12.0, 15.5),
+    ]},
+    "wbc_count": {"label": "WBC", "unit": "/µL", "rules": [
+        (None, 0, 12, 5000, 14500), (None, 12, None, 4000, 11000),
+    ]},
+    "rbc_count": {"label": "RBC", "unit": "million/µL", "rules": [
+        (None, 0, _ADULT, 4.0, 5.5), ("male", _ADULT, None, 4.5, 5.9), (None, _ADULT, None, 4.0, 5.2),
+    ]},
+    "platelet_count": {"label": "Platelets", "unit": "/µL", "rules": [(None, *_ANY_AGE, 150000, 450000)]},
+    # Glucose and lipids
+    "blood_sugar_fasting": {"label": "Fasting glucose", "unit": "mg/dL", "rules": [(None, *_ANY_AGE, 70, 99)]},
+    "blood_sugar_pp": {"label": "Post-prandial glucose", "unit": "mg/dL", "rules": [(None, *_ANY_AGE, 70, 139)]},
+    "hba1c": {"label": "HbA1c", "unit": "%", "rules": [(None, *_ANY_AGE, 4.0, 5.6)]},
+    "cholesterol_total": {"label": "Total cholesterol", "unit": "mg/dL", "rules": [(None, *_ANY_AGE, None, 199)]},
+    "cholesterol_hdl": {"label": "HDL", "unit": "mg/dL", "rules": [
+        ("female", _ADULT, None, 50, None), (None, *_ANY_AGE, 40, None),
+    ]},
+    "cholesterol_ldl": {"label": "LDL", "unit": "mg/dL", "rules": [(None, *_ANY_AGE, None, 129)]},
+    "triglycerides": {"label": "Triglycerides", "unit": "mg/dL", "rules": [(None, *_ANY_AGE, None, 149)]},
+    # Kidney
+    "creatinine": {"label": "Creatinine", "unit": "mg/dL", "rules": [
+        (None, 0, _ADULT, 0.3, 0.7), ("male", _ADULT, None, 0.7, 1.3), (None, _ADULT, None, 0.6, 1.1),
+    ]},
+    "urea": {"label": "Urea", "unit": "mg/dL", "rules": [(None, 65, None, 15, 55), (None, *_ANY_AGE, 15, 45)]},
+    "uric_acid": {"label": "Uric acid", "unit": "mg/dL", "rules": [
+        ("male", _ADULT, None, 3.4, 7.0), (None, *_ANY_AGE, 2.4, 6.0),
+    ]},
+    # Liver
+    "sgot": {"label": "AST (SGOT)", "unit": "U/L", "rules": [(None, *_ANY_AGE, 8, 40)]},
+    "sgpt": {"label": "ALT (SGPT)", "unit": "U/L", "rules": [(None, *_ANY_AGE, 7, 56)]},
+    "alkaline_phosphatase": {"label": "ALP", "unit": "U/L", "rules": [
+        (None, 0, _ADULT, 100, 390), (None, _ADULT, None, 44, 147),
+    ]},
+    "bilirubin_total": {"label": "Total bilirubin", "unit": "mg/dL", "rules": [(None, *_ANY_AGE, 0.1, 1.2)]},
+    "albumin": {"label": "Albumin", "unit": "g/dL", "rules": [(None, *_ANY_AGE, 3.5, 5.0)]},
+    # Thyroid
+    "tsh": {"label": "TSH", "unit": "mIU/L", "rules": [(None, 70, None, 0.4, 6.0), (None, *_ANY_AGE, 0.4, 4.0)]},
+    "t3": {"label": "T3", "unit": "ng/mL", "rules": [(None, *_ANY_AGE, 0.8, 2.0)]},
+    "t4": {"label": "Free T4", "unit": "ng/dL", "rules": [(None, *_ANY_AGE, 0.8, 1.8)]},
+    # Vitamins and minerals
+    "vitamin_d": {"label": "Vitamin D", "unit": "ng/mL", "rules": [(None, *_ANY_AGE, 30, 100)]},
+    "vitamin_b12": {"label": "Vitamin B12", "unit": "pg/mL", "rules": [(None, *_ANY_AGE, 200, 900)]},
+    "iron": {"label": "Iron", "unit": "µg/dL", "rules": [("male", _ADULT, None, 65, 175), (None, *_ANY_AGE, 50, 170)]},
+    "calcium": {"label": "Calcium", "unit": "mg/dL", "rules": [(None, *_ANY_AGE, 8.5, 10.5)]},
+    "sodium": {"label": "Sodium", "unit": "mmol/L", "rules": [(None, *_ANY_AGE, 135, 145)]},
+    "potassium": {"label": "Potassium", "unit": "mmol/L", "rules": [(None, *_ANY_AGE, 3.5, 5.0)]},
+}
+
+
+def reference_range(field: str, age: Optional[float], gender: Optional[str]) -> Optional[tuple]:
+    """(low, high) for a field and patient, or None if the field is not assessed."""
+    spec = REFERENCE_RANGES.get(field)
+    if spec is None:
+        return None
+    sex = (gender or "").lower()
+    age = age if age is not None else _ADULT
+    for rule_sex, min_age, max_age, low, high in spec["rules"]:
+        if rule_sex is not None and rule_sex != sex:
+            continue
+        if age < min_age or (max_age is not None and age >= max_age):
+            continue
+        return low, high
+    return None
+
+
+def classify(value: float, low: Optional[float], high: Optional[float]) -> str:
+    """normal, low, high, borderline_low or borderline_high."""
+    if low is not None and value < low:
+        return "low"
+    if high is not None and value > high:
+        return "high"
+    if low is not None and high is not None:
+        margin = (high - low) * BORDERLINE_MARGIN
+        if value < low + margin:
+            return "borderline_low"
+        if value > high - margin:
+            return "borderline_high"
+    elif low is not None and value < low * (1 + BORDERLINE_MARGIN):
+        return "borderline_low"
+    elif high is not None and value > high * (1 - BORDERLINE_MARGIN):
+        return "borderline_high"
+    return "normal"
+
+
+def _as_dict(values) -> dict:
+    if hasattr(values, "model_dump"):
+        values = values.model_dump()
+    return values or {}
+
+
+def assess(patient_data: dict) -> dict:
+    """Flag abnormal and borderline vitals and labs for a patient.
+
+    Returns the non-normal findings, worst first (out of range before
+    borderline), plus counts of how many values were measured and assessed.
+    """
+    age = patient_data.get("age")
+    gender = patient_data.get("gender")
+    if hasattr(gender, "value"):
+        gender = gender.value
+    findings = []
+    measured = assessed = 0
+    for group in ("vital_signs", "lab_results"):
+        for field, value in _as_dict(patient_data.get(group)).items():
+            if value is None:
+                continue
+            measured += 1
+            bounds = reference_range(field, age, gender)
+            if bounds is None:
+                continue
+            assessed += 1
+            status = classify(value, *bounds)
+            if status == "normal":
+                continue
+            spec = REFERENCE_RANGES[field]
+            findings.append({
+                "field": field,
+                "label": spec["label"],
+                "value": value,
+                "unit": spec["unit"],
+                "low": bounds[0],
+                "high": bounds[1],
+                "status": status,
+            })
+    findings.sort(key=lambda f: f["status"].startswith("borderline"))
+    return {"findings": findings, "measured": measured, "assessed": assessed}
+
+
+def _format_range(low, high) -> str:
+    if low is None:
+        return f"≤{high}"
+    if high is None:
+        return f"≥{low}"
+    return f"{low}-{high}"
+
+
+_STATUS_MARKS = {"low": "L", "high": "H", "borderline_low": "borderline L", "borderline_high": "borderline H"}
+
+
+def format_findings(assessment: dict) -> str:
+    """Compact prompt text, e.g. "Hemoglobin 7.6 g/dL L (13.5-17.5); ...; 23/35 other values normal"."""
+    if not assessment["measured"]:
+        return "Not available"
+    parts = [
+        f"{f['label']} {f['value']:g} {f['unit']} {_STATUS_MARKS[f['status']]} ({_format_range(f['low'], f['high'])})"
+        for f in assessment["findings"]
+    ]
+    normal = assessment["assessed"] - len(assessment["findings"])
+    parts.append(f"{normal}/{assessment['assessed']} other values normal")
+    return "; ".join(parts)
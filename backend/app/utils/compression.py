@@ -0,0 +1,138 @@
+"""Negotiated gzip/brotli response compression.
+
+Brotli is used when the `brotli` package is installed and the client
+accepts it; otherwise gzip. Bodies below `minimum_size`, responses that are
+already encoded and Server-Sent Events streams are passed through as-is.
+Streamed bodies are flushed per chunk so NDJSON consumers still see rows
+as they are produced.
+"""
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+
+class _GzipCompressor:
+    def __init__(self, level: int):
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+
+    def sync_flush(self) -> bytes:
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._obj.flush(zlib.Z_FINISH)
+
+
+class _BrotliCompressor:
+    def __init__(self, quality: int):
+        self._obj = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.process(data)
+
+    def sync_flush(self) -> bytes:
+        return self._obj.flush()
+
+    def finish(self) -> bytes:
+        return self._obj.finish()
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick "br" or "gzip" from an Accept-Encoding header, honouring q=0."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if token:
+            accepted[token.strip().lower()] = q
+    wildcard = accepted.get("*", 0.0)
+    if brotli is not None and accepted.get("br", wildcard) > 0:
+        return "br"
+    if accepted.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def _compressor(self, encoding: str):
+        if encoding == "br":
+            return _BrotliCompressor(self.brotli_quality)
+        return _GzipCompressor(self.gzip_level)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is not None:
+                chunk = compressor.compress(body)
+                chunk += compressor.sync_flush() if more_body else compressor.finish()
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+                return
+
+            headers = MutableHeaders(raw=start_message["headers"])
+            if (
+                "content-encoding" in headers
+                or headers.get("content-type", "").startswith("text/event-stream")
+                or (not more_body and len(body) < self.minimum_size)
+            ):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressor = self._compressor(encoding)
+            headers["Content-Encoding"] = encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                if "content-length" in headers:
+                    del headers["Content-Length"]
+                chunk = compressor.compress(body) + compressor.sync_flush()
+            else:
+                chunk = compressor.compress(body) + compressor.finish()
+                headers["Content-Length"] = str(len(chunk))
+            start_message["headers"] = headers.raw
+            await send(start_message)
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,47 @@
+"""Build Mongo find() projections from `view=` and `fields=` query parameters."""
+from typing import Optional
+from fastapi import HTTPException
+
+VIEWS = ("summary", "full")
+
+PATIENT_SUMMARY_FIELDS = [
+    "patient_id", "first_name", "last_name", "age", "gender", "country",
+    "diagnosis", "severity", "symptoms", "created_at",
+]
+
+HISTORY_SUMMARY_FIELDS = [
+    "patient_id", "age", "gender", "symptoms", "diagnosis", "confidence",
+    "ai_suggestion", "root_cause", "created_at",
+]
+
+
+def build_projection(
+    view: str,
+    fields: str,
+    summary_fields: list[str],
+    allowed_fields: Optional[set[str]] = None,
+) -> Optional[dict]:
+    """Return a projection dict, or None for the full document.
+
+    An explicit `fields` list (comma separated, dotted paths allowed) wins
+    over `view`. `_id` is always returned since responses expose it as `id`.
+    """
+    if view not in VIEWS:
+        raise HTTPException(400, f"Unknown view '{view}'. Use one of: {', '.join(VIEWS)}")
+
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        if allowed_fields is not None:
+            unknown = [f for f in requested if f.split(".", 1)[0] not in allowed_fields]
+            if unknown:
+                raise HTTPException(400, f"Unknown fields: {', '.join(unknown)}")
+        # "vital_signs" and "vital_signs.bmi" together is a path collision in Mongo.
+        selected = [f for f in requested if not any(f.startswith(p + ".") for p in requested)]
+    elif view == "summary":
+        selected = summary_fields
+    else:
+        return None
+
+    projection = {f: 1 for f in selected if f not in ("id", "_id")}
+    projection["_id"] = 1
+    return projection
@@ -0,0 +1,46 @@
+"""Fast JSON encoding for API responses.
+
+FastAPI passes plain dict return values through `jsonable_encoder` before
+the response class renders them. Hot list endpoints return a
+`FastJSONResponse` directly to skip that pass; orjson handles datetimes
+natively and ObjectIds go through `orjson_default`.
+"""
+from typing import Any
+
+import numpy as np
+import orjson
+from bson import Decimal128, ObjectId
+from fastapi.responses import JSONResponse
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def orjson_default(obj: Any):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, Decimal128):
+        return float(obj.to_decimal())
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=orjson_default, option=ORJSON_OPTIONS)
+
+
+class FastJSONResponse(JSONResponse):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def serialize_doc(doc: dict) -> dict:
+    """Return a copy of a Mongo document with `_id` exposed as a string `id`."""
+    out = {k: v for k, v in doc.items() if k != "_id"}
+    if "_id" in doc:
+        out["id"] = str(doc["_id"])
+    return out
@@ -0,0 +1,98 @@
+"""Cold start and per-image latency of the eager and ONNX image model backends.
+
+Each backend/precision runs in a fresh interpreter, the way a new worker
+would: time to import it, load the model and answer the first image, and
+the resulting RSS. Then steady-state latency per image, one at a time and
+in batches of 8. Needs the pinned weights and the ONNX export:
+
+    cd backend && python -m app.ml.download_image_model && python -m app.ml.export_image_model
+    cd backend && python -m benchmarks.bench_image_backends --threads 4
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+from app.config import get_settings
+
+VARIANTS = [("eager", False), ("eager", True), ("onnx", False), ("onnx", True)]
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * 4096 / 2**20
+
+
+def _child(backend: str, quantize: bool, model_dir: str, threads: int, n: int) -> dict:
+    from app.ml.export_image_model import sample_images
+    images = sample_images(n=max(n, 8))
+
+    started = time.perf_counter()
+    if backend == "onnx":
+        import onnxruntime  # noqa: F401 -- imported by load(); timed separately here
+        from app.services.image_backends import OnnxBackend
+        model = OnnxBackend(model_dir, quantize, threads)
+    else:
+        import torch  # noqa: F401
+        import transformers  # noqa: F401
+        from transformers import AutoModelForImageClassification  # noqa: F401 -- resolves the lazy module
+        from app.services.image_backends import EagerBackend
+        model = EagerBackend(model_dir, True, quantize, threads)
+    imported = time.perf_counter()
+    model.load()
+    loaded = time.perf_counter()
+    model.logits(images[:1])
+    first = time.perf_counter()
+
+    single = []
+    for image in images[:n]:
+        t0 = time.perf_counter()
+        model.logits([image])
+        single.append(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    model.logits(images[:8])
+    batched = (time.perf_counter() - t0) / 8
+
+    single.sort()
+    return {
+        "variant": model.variant,
+        "import_s": imported - started,
+        "load_s": loaded - imported,
+        "cold_start_s": first - started,
+        "rss_mb": _rss_mb(),
+        "p50_ms": single[len(single) // 2] * 1000,
+        "batch8_ms_per_image": batched * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model-dir", default=get_settings().image_model_dir)
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads (0 = runtime default)")
+    parser.add_argument("-n", type=int, default=10, help="images for the steady-state measurement")
+    parser.add_argument("--child", nargs=2, metavar=("BACKEND", "QUANTIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        backend, quantize = args.child[0], args.child[1] == "1"
+        print(json.dumps(_child(backend, quantize, args.model_dir, args.threads, args.n)))
+        return
+
+    print(f"{'variant':<12}{'import s':>10}{'load s':>9}{'cold start s':>14}{'RSS MB':>9}{'p50 ms':>9}{'batch-8 ms/img':>16}")
+    for backend, quantize in VARIANTS:
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_image_backends", "--child", backend, "1" if quantize else "0",
+             "--model-dir", args.model_dir, "--threads", str(args.threads), "-n", str(args.n)],
+            capture_output=True, text=True,
+        )
+        if out.returncode != 0:
+            print(f"{backend}/{'int8' if quantize else 'fp32'}: failed\n{out.stderr.strip().splitlines()[-1]}")
+            continue
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{r['variant']:<12}{r['import_s']:>10.2f}{r['load_s']:>9.2f}{r['cold_start_s']:>14.2f}"
+              f"{r['rss_mb']:>9.0f}{r['p50_ms']:>9.1f}{r['batch8_ms_per_image']:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""CPU latency of the local image model, fp32 vs int8, and top-k agreement.
+
+Runs the Swin classifier behind image_service's fallback path as it was
+(fp32 under no_grad), in inference_mode, and dynamically quantized to int8
+(quantize_linear), at each --threads setting. Agreement is measured
+against the fp32 model on the same inputs: how often the top-1 label
+matches, and the mean overlap of the top-5 sets.
+
+    cd backend && python -m benchmarks.bench_image_model --images path/to/scans --threads 1 2 4
+
+Without --images, synthetic images are used. --random-init builds the same
+architecture with random weights when the pretrained ones cannot be
+downloaded; timings are still representative, agreement is only a rough
+indication of quantization error.
+"""
+import argparse
+import copy
+import os
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from app.services.image_backends import quantize_linear
+from app.services.image_preprocess import decode_image
+from app.services.image_service import image_service
+
+
+def _load(random_init: bool):
+    if random_init:
+        from transformers import SwinConfig, SwinForImageClassification, ViTImageProcessor
+        # swin-base-patch4-window7-224 with the in22k label count
+        config = SwinConfig(embed_dim=128, depths=[2, 2, 18, 2], num_heads=[4, 8, 16, 32], num_labels=21841)
+        torch.manual_seed(0)
+        return ViTImageProcessor(size={"height": 224, "width": 224}), SwinForImageClassification(config).eval()
+    from transformers import AutoFeatureExtractor, AutoModelForImageClassification
+    return (
+        AutoFeatureExtractor.from_pretrained(image_service.model_name),
+        AutoModelForImageClassification.from_pretrained(image_service.model_name).eval(),
+    )
+
+
+def _images(directory, n: int) -> list[Image.Image]:
+    if directory:
+        images = []
+        for name in sorted(os.listdir(directory))[:n]:
+            with open(os.path.join(directory, name), "rb") as f:
+                try:
+                    images.append(decode_image(f.read(), 1024, 256).convert("RGB"))
+                except ValueError:
+                    pass
+        return images
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:256, 0:256]
+    images = []
+    for _ in range(n):
+        fx, fy, phase = rng.uniform(10, 80, 2).tolist() + [rng.uniform(0, 6)]
+        base = 127 + 90 * np.sin(x / fx + phase) * np.cos(y / fy) + rng.normal(0, 12, x.shape)
+        images.append(Image.fromarray(base.clip(0, 255).astype(np.uint8), "L").convert("RGB"))
+    return images
+
+
+def _run(model, inputs: list[dict], context) -> tuple[list[float], torch.Tensor]:
+    latencies, top = [], []
+    with context():
+        model(**inputs[0])  # warm-up
+        for x in inputs:
+            t0 = time.perf_counter()
+            logits = model(**x).logits
+            latencies.append(time.perf_counter() - t0)
+            top.append(torch.topk(logits, 5).indices[0])
+    return latencies, torch.stack(top)
+
+
+def _agreement(reference: torch.Tensor, candidate: torch.Tensor) -> tuple[float, float]:
+    top1 = (reference[:, 0] == candidate[:, 0]).float().mean().item()
+    overlap = np.mean([len(set(r.tolist()) & set(c.tolist())) / 5 for r, c in zip(reference, candidate)])
+    return top1, float(overlap)
+
+
+def _ms(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--images", help="directory of images to classify (default: synthetic)")
+    parser.add_argument("-n", type=int, default=20, help="number of images")
+    parser.add_argument("--threads", type=int, nargs="+", default=[torch.get_num_threads()])
+    parser.add_argument("--random-init", action="store_true", help="random weights instead of downloading")
+    args = parser.parse_args()
+
+    extractor, fp32 = _load(args.random_init)
+    int8 = quantize_linear(copy.deepcopy(fp32))
+    inputs = [extractor(images=image, return_tensors="pt") for image in _images(args.images, args.n)]
+
+    def size_mb(model):
+        return sum(t.numel() * t.element_size() for t in model.state_dict().values() if isinstance(t, torch.Tensor)) / 1e6
+
+    print(f"{len(inputs)} images; state dict fp32 {size_mb(fp32):.0f} MB")
+    print(f"{'threads':>7}  {'variant':<22}{'p50 ms':>9}{'p95 ms':>9}{'top-1 agree':>13}{'top-5 overlap':>15}")
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        reference = None
+        for name, model, context in (
+            ("fp32 no_grad (before)", fp32, torch.no_grad),
+            ("fp32 inference_mode", fp32, torch.inference_mode),
+            ("int8 inference_mode", int8, torch.inference_mode),
+        ):
+            latencies, top = _run(model, inputs, context)
+            reference = top if reference is None else reference
+            top1, overlap = _agreement(reference, top)
+            print(f"{threads:>7}  {name:<22}{_ms(latencies, 0.5):>9.1f}{_ms(latencies, 0.95):>9.1f}"
+                  f"{top1:>13.1%}{overlap:>15.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Upload size and CPU cost of image preprocessing for the vision model.
+
+Builds synthetic scans (a 12 MP photo-like JPEG, a 16-bit greyscale PNG
+like an exported radiograph, and a small JPEG that needs no resizing) and
+compares sending the raw bytes, as before, against prepare_for_vision at
+each detail level. Also times decode_image against a full decode.
+
+    cd backend && python -m benchmarks.bench_image_preprocess
+"""
+import io
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.services.image_preprocess import decode_image, prepare_for_vision
+
+
+def _samples() -> dict:
+    rng = np.random.default_rng(0)
+    samples = {}
+
+    y, x = np.mgrid[0:3000, 0:4000]
+    photo = np.stack([(x // 16) % 256, (y // 12) % 256, ((x + y) // 20) % 256], -1)
+    photo = (photo + rng.integers(0, 24, photo.shape)).clip(0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(photo, "RGB").save(buf, "JPEG", quality=92)
+    samples["12MP JPEG"] = buf.getvalue()
+
+    y, x = np.mgrid[0:2500, 0:2000]
+    xray = (20000 + 15000 * np.sin(x / 150.0) * np.cos(y / 200.0) + rng.normal(0, 800, x.shape))
+    buf = io.BytesIO()
+    Image.fromarray(xray.clip(0, 65535).astype(np.uint16)).save(buf, "PNG")
+    samples["16-bit PNG"] = buf.getvalue()
+
+    buf = io.BytesIO()
+    Image.fromarray(photo[:600, :800], "RGB").save(buf, "JPEG", quality=85)
+    samples["small JPEG"] = buf.getvalue()
+    return samples
+
+
+def _timed(fn, repeat: int = 3):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return result, best * 1000
+
+
+def main():
+    print(f"{'image':<12}{'mode':<10}{'size':>12}{'payload KB':>12}{'ms':>9}")
+    for name, data in _samples().items():
+        with Image.open(io.BytesIO(data)) as im:
+            size = f"{im.width}x{im.height}"
+        print(f"{name:<12}{'raw':<10}{size:>12}{len(data) * 4 / 3 / 1024:>12.0f}{'-':>9}")
+        for detail in ("high", "low"):
+            prepared, ms = _timed(lambda: prepare_for_vision(data, detail))
+            size = f"{prepared['width']}x{prepared['height']}"
+            print(f"{'':<12}{detail:<10}{size:>12}{len(prepared['data_url']) / 1024:>12.0f}{ms:>9.1f}")
+
+        _, full_ms = _timed(lambda: Image.open(io.BytesIO(data)).convert("RGB"))
+        _, model_ms = _timed(lambda: decode_image(data, 1024, 256))
+        print(f"{'':<12}decode for the local model: full {full_ms:.1f} ms, bounded {model_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
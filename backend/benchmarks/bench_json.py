@@ -0,0 +1,98 @@
+"""Compare response encoding before/after FastJSONResponse.
+
+"before" is what FastAPI did for a plain dict return value:
+jsonable_encoder() followed by json.dumps() in JSONResponse.
+"after" is serialize_doc() + orjson via FastJSONResponse.render().
+
+Runs offline against synthetic documents shaped like the list, history
+and export endpoint payloads.
+
+    cd backend && python -m benchmarks.bench_json
+"""
+import gzip
+import json
+import time
+from datetime import datetime
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from app.utils.generate_synthetic_data import generate_record
+from app.utils.serialization import FastJSONResponse, serialize_doc
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _patient_docs(n: int) -> list[dict]:
+    docs = []
+    for i in range(n):
+        doc = generate_record(i)
+        doc["_id"] = ObjectId()
+        doc["created_at"] = datetime.fromisoformat(doc["created_at"])
+        doc["updated_at"] = datetime.fromisoformat(doc["updated_at"])
+        docs.append(doc)
+    return docs
+
+
+def _history_docs(n: int) -> list[dict]:
+    return [
+        {
+            **{k: d[k] for k in ("age", "gender", "symptoms", "vital_signs", "lab_results")},
+            "_id": d["_id"],
+            "diagnosis": d["diagnosis"],
+            "confidence": 87.5,
+            "ai_suggestion": "Assessment text " * 40,
+            "root_cause": d["root_cause"],
+            "created_at": d["created_at"],
+        }
+        for d in _patient_docs(n)
+    ]
+
+
+def _before(docs: list[dict], key: str) -> bytes:
+    items = []
+    for doc in docs:
+        doc = dict(doc)
+        doc["id"] = str(doc.pop("_id"))
+        items.append(doc)
+    payload = jsonable_encoder({key: items, "total": len(items)})
+    return json.dumps(payload, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def _after(docs: list[dict], key: str) -> bytes:
+    return FastJSONResponse({key: [serialize_doc(d) for d in docs], "total": len(docs)}).body
+
+
+def _time(fn, *args, repeat: int = 20) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main():
+    cases = [
+        ("list (20 patients)", _patient_docs(20), "patients", 200),
+        ("history (20 records)", _history_docs(20), "history", 200),
+        ("export (1000 patients)", _patient_docs(1000), "data", 10),
+    ]
+    print(f"{'payload':<24}{'before ms':>11}{'after ms':>10}{'speedup':>9}{'raw KB':>9}{'gzip KB':>9}{'br KB':>8}")
+    for name, docs, key, repeat in cases:
+        before = _time(_before, docs, key, repeat=repeat)
+        after = _time(_after, docs, key, repeat=repeat)
+        body = _after(docs, key)
+        gz = len(gzip.compress(body, 6))
+        br = len(brotli.compress(body, quality=4)) if brotli else 0
+        print(
+            f"{name:<24}{before:>11.2f}{after:>10.2f}{before / after:>8.1f}x"
+            f"{len(body) / 1024:>9.1f}{gz / 1024:>9.1f}{(br / 1024 if br else float('nan')):>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
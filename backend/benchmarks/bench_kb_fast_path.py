@@ -0,0 +1,67 @@
+"""Latency distribution and LLM call rate with and without the knowledge-base
+fast path.
+
+Scores synthetic patients with the trained model, then replays /predict's
+suggestion step under each policy: "always LLM" and knowledge-base-first
+at several confidence thresholds. ML and knowledge-base time are measured;
+LLM latency is sampled from an assumed log-normal (median LLM_MEDIAN_S),
+so the run is offline and repeatable. "served accuracy" is how often the
+predictions answered from the knowledge base match the record's true label.
+
+    cd backend && python -m benchmarks.bench_kb_fast_path
+"""
+import random
+import time
+
+from app.services.knowledge_base import KnowledgeBase
+from app.services.ml_service import ml_service
+from app.utils.generate_synthetic_data import DISEASES, generate_record
+
+LLM_MEDIAN_S = 4.0
+LLM_SIGMA = 0.45
+THRESHOLDS = [95.0, 90.0, 85.0, 75.0, 60.0]
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    return sorted_values[min(int(len(sorted_values) * q), len(sorted_values) - 1)]
+
+
+def main(n: int = 1000, seed: int = 7):
+    random.seed(seed)
+    records = [generate_record(i) for i in range(n)]
+    ml_service.load()
+
+    scored = []
+    for record in records:
+        t0 = time.perf_counter()
+        prediction = ml_service.predict(record)
+        scored.append((record, prediction, time.perf_counter() - t0))
+    llm_latency = [random.lognormvariate(0, LLM_SIGMA) * LLM_MEDIAN_S for _ in records]
+
+    policies = [("always LLM", None)] + [(f"KB >= {t:g}%", t) for t in THRESHOLDS]
+    print(f"{n} synthetic patients; LLM latency log-normal, median {LLM_MEDIAN_S:g}s")
+    print(f"{'policy':<14}{'LLM calls':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'served accuracy':>17}")
+    for name, threshold in policies:
+        kb = KnowledgeBase(DISEASES, threshold if threshold is not None else float("inf"))
+        latencies = []
+        calls = agree = served = 0
+        for (record, prediction, ml_s), llm_s in zip(scored, llm_latency):
+            t0 = time.perf_counter()
+            if kb.should_serve(prediction):
+                kb.suggestion(prediction, record)
+                served += 1
+                agree += prediction["predicted_disease"] == record["diagnosis"]
+                latencies.append(ml_s + time.perf_counter() - t0)
+            else:
+                calls += 1
+                latencies.append(ml_s + llm_s)
+        latencies.sort()
+        accuracy = f"{agree / served:.1%}" if served else "-"
+        print(
+            f"{name:<14}{calls / n:>10.1%}{_percentile(latencies, 0.5) * 1000:>10.1f}"
+            f"{_percentile(latencies, 0.95) * 1000:>10.1f}{_percentile(latencies, 0.99) * 1000:>10.1f}{accuracy:>17}"
+        )
+
+
+if __name__ == "__main__":
+    main()
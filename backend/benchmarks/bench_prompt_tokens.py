@@ -0,0 +1,78 @@
+"""Compare diagnosis prompt size with and without abnormal-only findings.
+
+"before" lists every non-empty vital and lab value (the original prompt,
+`llm_prompt_abnormal_only=False`); "after" lists only abnormal and
+borderline values from app.services.reference_ranges plus a count of the
+normal ones.
+
+Tokens are counted with tiktoken's gpt-4o encoding when it is installed,
+otherwise estimated at 4 characters per token.
+
+    cd backend && python -m benchmarks.bench_prompt_tokens
+"""
+import statistics
+
+from app.config import get_settings
+from app.services.openai_service import openai_service
+from app.services.reference_ranges import assess
+from app.utils.generate_synthetic_data import generate_record
+
+try:
+    import tiktoken
+    _encoding = tiktoken.encoding_for_model("gpt-4o")
+except Exception:  # not installed, or no offline encoding file
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return round(len(text) / 4)
+
+
+def _prompt(record: dict, abnormal_only: bool) -> str:
+    get_settings().llm_prompt_abnormal_only = abnormal_only
+    top = [{"disease": record["diagnosis"], "confidence": 82.0}, {"disease": "Other", "confidence": 9.0}]
+    return openai_service._build_diagnosis_prompt(record["diagnosis"], 82.0, top, record)
+
+
+def _section(record: dict, abnormal_only: bool) -> str:
+    get_settings().llm_prompt_abnormal_only = abnormal_only
+    return openai_service._measurement_lines(record)
+
+
+def _row(name: str, counts: list[int]):
+    counts = sorted(counts)
+    print(
+        f"{name:<28}{statistics.mean(counts):>8.0f}{counts[len(counts) // 2]:>8}"
+        f"{counts[int(len(counts) * 0.95)]:>8}"
+    )
+
+
+def main(n: int = 500):
+    records = [generate_record(i) for i in range(n)]
+    settings = get_settings()
+    original = settings.llm_prompt_abnormal_only
+    try:
+        counts = {
+            (what, mode): [count_tokens(fn(r, mode)) for r in records]
+            for what, fn in (("prompt", _prompt), ("vitals+labs section", _section))
+            for mode in (False, True)
+        }
+    finally:
+        settings.llm_prompt_abnormal_only = original
+    flagged = [len(assess(r)["findings"]) for r in records]
+
+    counter = "tiktoken gpt-4o" if _encoding is not None else "~4 chars/token estimate"
+    print(f"{n} synthetic patients, tokens counted with {counter}")
+    print(f"{'':<28}{'mean':>8}{'p50':>8}{'p95':>8}")
+    for what in ("prompt", "vitals+labs section"):
+        for mode, label in ((False, "before"), (True, "after")):
+            _row(f"{what} {label}", counts[(what, mode)])
+        saved = 1 - sum(counts[(what, True)]) / sum(counts[(what, False)])
+        print(f"{'':<28}saved {saved:.1%}")
+    print(f"flagged findings per patient: {statistics.mean(flagged):.1f}")
+
+
+if __name__ == "__main__":
+    main()
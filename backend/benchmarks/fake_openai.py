@@ -0,0 +1,183 @@
+"""Local stand-in for the OpenAI chat-completions API.
+
+Answers POST /v1/chat/completions (plain and streamed) with canned JSON in
+the shape openai_service and image_service expect, after a latency drawn
+from a configurable distribution, and fails a configurable share of
+requests with 429/5xx. GET /stats reports what it has served, including
+the most requests it has had open at once. Point the
+backend at it with OPENAI_BASE_URL=http://127.0.0.1:8001/v1.
+
+    cd backend && python -m benchmarks.fake_openai --port 8001 \\
+        --latency lognormal --latency-median 2.5 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+DIAGNOSIS_ANSWER = {
+    "assessment": "The ML prediction is consistent with the reported symptoms and findings.",
+    "root_cause": "Most likely a common presentation of the predicted condition; confirm with targeted tests.",
+    "recommended_tests": ["Complete blood count", "Comprehensive metabolic panel"],
+    "treatment_plan": "Treat per current guidelines for the predicted condition and review in two weeks.",
+    "red_flags": ["Worsening breathlessness", "Persistent high fever"],
+    "differential_notes": "Rule out the other top predictions before starting long-term therapy.",
+}
+IMAGE_ANSWER = {
+    "image_type": "medical image",
+    "findings": "No acute abnormality identified on this synthetic response.",
+    "confidence": 80.0,
+    "abnormalities_detected": [],
+    "recommendation": "Correlate clinically; radiologist review recommended.",
+}
+
+
+class FakeProfile:
+    """Latency distribution and failure injection for the fake server."""
+
+    def __init__(
+        self,
+        latency: str = "lognormal",
+        latency_median: float = 2.5,
+        latency_sigma: float = 0.4,
+        latency_max: float = 30.0,
+        error_rate: float = 0.0,
+        error_statuses: tuple = (429, 500, 503),
+        chunk_delay: float = 0.02,
+        seed=None,
+    ):
+        self.latency = latency
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.latency_max = latency_max
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.chunk_delay = chunk_delay
+        self._random = random.Random(seed)
+
+    def delay(self) -> float:
+        if self.latency == "fixed":
+            value = self.latency_median
+        elif self.latency == "uniform":
+            value = self._random.uniform(0, 2 * self.latency_median)
+        else:
+            value = self._random.lognormvariate(0, self.latency_sigma) * self.latency_median
+        return min(value, self.latency_max)
+
+    def error_status(self):
+        if self._random.random() < self.error_rate:
+            return self._random.choice(self.error_statuses)
+        return None
+
+
+def _is_image_request(body: dict) -> bool:
+    return any(
+        isinstance(m.get("content"), list)
+        and any(part.get("type") == "image_url" for part in m["content"])
+        for m in body.get("messages", [])
+    )
+
+
+def _prompt_tokens(body: dict) -> int:
+    text = "".join(
+        m["content"] if isinstance(m.get("content"), str)
+        else "".join(p.get("text", "") for p in m.get("content", []))
+        for m in body.get("messages", [])
+    )
+    return max(1, len(text) // 4)
+
+
+def create_app(profile: FakeProfile) -> Starlette:
+    stats = {
+        "requests": 0, "streamed": 0, "errors": 0, "by_status": {},
+        "in_flight": 0, "max_in_flight": 0, "started": time.time(),
+    }
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            await asyncio.sleep(profile.delay())
+        finally:
+            stats["in_flight"] -= 1
+
+        status = profile.error_status()
+        if status is not None:
+            stats["errors"] += 1
+            stats["by_status"][status] = stats["by_status"].get(status, 0) + 1
+            return JSONResponse(
+                {"error": {"message": f"Injected {status}", "type": "fake_error", "code": status}},
+                status_code=status,
+            )
+
+        content = json.dumps(IMAGE_ANSWER if _is_image_request(body) else DIAGNOSIS_ANSWER)
+        model = body.get("model", "gpt-4o")
+        created = int(time.time())
+        if body.get("stream"):
+            stats["streamed"] += 1
+
+            async def chunks():
+                for start in range(0, len(content), 24):
+                    chunk = {
+                        "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": {"content": content[start:start + 24]}, "finish_reason": None}],
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    await asyncio.sleep(profile.chunk_delay)
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(chunks(), media_type="text/event-stream")
+
+        prompt_tokens = _prompt_tokens(body)
+        completion_tokens = len(content) // 4
+        return JSONResponse({
+            "id": "chatcmpl-fake", "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    async def get_stats(request: Request):
+        return JSONResponse({**stats, "uptime_seconds": round(time.time() - stats["started"], 1)})
+
+    return Starlette(routes=[
+        Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+        Route("/stats", get_stats),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", choices=("fixed", "uniform", "lognormal"), default="lognormal")
+    parser.add_argument("--latency-median", type=float, default=2.5, help="seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.4, help="log-normal shape")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failed with 429/5xx")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    import uvicorn
+    profile = FakeProfile(
+        latency=args.latency,
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(profile), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""Open-loop load test of the API against the local fake OpenAI server.
+
+By default starts benchmarks.fake_openai and the app under uvicorn (with
+OPENAI_BASE_URL pointing at the fake) as subprocesses, drives each route
+at its own target rate for `--duration` seconds and prints p50/p95/p99
+latency, throughput and error rate per route. Requests are sent on
+schedule whether or not earlier ones have finished, so a slow server shows
+up as latency and errors rather than as a lower offered rate.
+
+Nothing leaves the machine; the app still needs a MongoDB, taken from
+MONGODB_URI (default mongodb://localhost:27017/euron_loadtest).
+
+    cd backend && python -m benchmarks.load_test \\
+        --rate predict=20 --rate analyze-image=2 --rate health=5 \\
+        --duration 60 --llm-latency-median 2.5 --llm-error-rate 0.02
+
+Use --base-url to drive an app that is already running instead.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+from app.utils.generate_synthetic_data import generate_record
+
+ROUTES = ("predict", "predict-stream", "analyze-image", "health")
+
+
+def _diagnosis_bodies(n: int) -> list[dict]:
+    fields = (
+        "age", "gender", "symptoms", "symptom_duration_days", "smoking", "alcohol",
+        "existing_conditions", "family_history", "vital_signs", "lab_results",
+    )
+    bodies = []
+    for i in range(n):
+        record = generate_record(i)
+        bodies.append({k: record[k] for k in fields})
+    return bodies
+
+
+def _png(size: int = 512) -> bytes:
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.effect_noise((size, size), 40).convert("RGB").save(buf, "PNG")
+    return buf.getvalue()
+
+
+class RouteStats:
+    def __init__(self, name: str, rate: float):
+        self.name = name
+        self.rate = rate
+        self.latencies: list[float] = []
+        self.statuses: Counter = Counter()
+        self.sent = 0
+        self.dropped = 0
+
+    def record(self, status, latency: float):
+        self.statuses[status] += 1
+        if status == 200:
+            self.latencies.append(latency)
+
+    def summary(self, duration: float) -> dict:
+        lat = sorted(self.latencies)
+
+        def pct(q):
+            return round(lat[min(int(len(lat) * q), len(lat) - 1)] * 1000, 1) if lat else None
+
+        completed = sum(self.statuses.values())
+        errors = completed - self.statuses[200]
+        return {
+            "route": self.name,
+            "target_rps": self.rate,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "ok": self.statuses[200],
+            "error_rate": round(errors / completed, 4) if completed else 0.0,
+            "throughput_rps": round(self.statuses[200] / duration, 2),
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "p99_ms": pct(0.99),
+            "max_ms": round(lat[-1] * 1000, 1) if lat else None,
+            "statuses": {str(k): v for k, v in self.statuses.items()},
+        }
+
+
+class LoadTest:
+    def __init__(self, base_url: str, rates: dict, duration: float, arrival: str, max_in_flight: int,
+                 force_llm: bool, no_cache: bool, timeout: float):
+        self.base_url = base_url
+        self.rates = rates
+        self.duration = duration
+        self.arrival = arrival
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        params = {}
+        if force_llm:
+            params["llm"] = "true"
+        if no_cache:
+            params["no_cache"] = "true"
+        self.params = params
+        self.stats = {name: RouteStats(name, rate) for name, rate in rates.items()}
+        self.bodies = _diagnosis_bodies(200)
+        self.image = _png() if "analyze-image" in rates else b""
+        self.in_flight = 0
+
+    async def _request(self, client: httpx.AsyncClient, route: str):
+        if route == "predict":
+            return await client.post("/api/diagnosis/predict", json=random.choice(self.bodies), params=self.params)
+        if route == "predict-stream":
+            async with client.stream(
+                "POST", "/api/diagnosis/predict/stream", json=random.choice(self.bodies), params=self.params,
+            ) as response:
+                await response.aread()
+                return response
+        if route == "analyze-image":
+            return await client.post(
+                "/api/diagnosis/analyze-image",
+                files={"file": ("scan.png", self.image, "image/png")},
+                data={"image_type": "xray"},
+            )
+        return await client.get("/api/health")
+
+    async def _one(self, client: httpx.AsyncClient, route: str):
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            response = await self._request(client, route)
+            status = response.status_code
+        except httpx.TimeoutException:
+            status = "timeout"
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        finally:
+            self.in_flight -= 1
+        self.stats[route].record(status, time.perf_counter() - start)
+
+    async def _drive(self, client: httpx.AsyncClient, route: str, rate: float, tasks: set):
+        loop = asyncio.get_running_loop()
+        stats = self.stats[route]
+        end = loop.time() + self.duration
+        next_at = loop.time()
+        while next_at < end:
+            await asyncio.sleep(max(0.0, next_at - loop.time()))
+            if self.in_flight >= self.max_in_flight:
+                stats.dropped += 1
+            else:
+                stats.sent += 1
+                task = asyncio.create_task(self._one(client, route))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            next_at += random.expovariate(rate) if self.arrival == "poisson" else 1 / rate
+
+    async def run(self) -> list[dict]:
+        limits = httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight)
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=limits) as client:
+            tasks: set = set()
+            started = time.perf_counter()
+            await asyncio.gather(*(self._drive(client, r, rate, tasks) for r, rate in self.rates.items()))
+            if tasks:
+                await asyncio.wait(tasks, timeout=self.timeout)
+            elapsed = time.perf_counter() - started
+        return [s.summary(elapsed) for s in self.stats.values()]
+
+
+def _wait_ready(url: str, timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def _start_stack(args) -> tuple[str, list[subprocess.Popen]]:
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    fake = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.fake_openai", "--port", str(args.fake_port),
+        "--latency", args.llm_latency, "--latency-median", str(args.llm_latency_median),
+        "--error-rate", str(args.llm_error_rate), "--seed", "1",
+    ])
+    env = {
+        **os.environ,
+        "OPENAI_BASE_URL": f"{fake_url}/v1",
+        "OPENAI_API_KEY": "fake-key",
+        "MONGODB_URI": os.environ.get("MONGODB_URI", "mongodb://localhost:27017/euron_loadtest"),
+    }
+    app = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(args.app_port),
+        "--workers", str(args.workers), "--log-level", "warning",
+    ], env=env)
+    procs = [fake, app]
+    try:
+        _wait_ready(f"{fake_url}/stats")
+        _wait_ready(f"http://127.0.0.1:{args.app_port}/api/health")
+    except Exception:
+        for p in procs:
+            p.terminate()
+        raise
+    return f"http://127.0.0.1:{args.app_port}", procs
+
+
+def _print_table(results: list[dict]):
+    print(f"{'route':<16}{'target':>8}{'sent':>7}{'ok':>7}{'err %':>7}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for r in results:
+        def ms(v):
+            return f"{v:>9.1f}" if v is not None else f"{'-':>9}"
+        print(
+            f"{r['route']:<16}{r['target_rps']:>8g}{r['sent']:>7}{r['ok']:>7}{r['error_rate'] * 100:>7.1f}"
+            f"{r['throughput_rps']:>8.2f}{ms(r['p50_ms'])}{ms(r['p95_ms'])}{ms(r['p99_ms'])}"
+        )
+        other = {k: v for k, v in r["statuses"].items() if k != "200"}
+        if other or r["dropped"]:
+            print(f"{'':<16}non-200: {other or '{}'}; dropped at max in-flight: {r['dropped']}")
+
+
+def _parse_rates(values: list[str]) -> dict:
+    rates = {}
+    for value in values:
+        route, _, rate = value.partition("=")
+        if route not in ROUTES or not rate:
+            raise SystemExit(f"--rate must be ROUTE=RPS with ROUTE one of {', '.join(ROUTES)}")
+        rates[route] = float(rate)
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rate", action="append", default=[], metavar="ROUTE=RPS",
+                        help=f"target requests/second for a route ({', '.join(ROUTES)}); repeatable")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load per run")
+    parser.add_argument("--arrival", choices=("poisson", "uniform"), default="poisson")
+    parser.add_argument("--max-in-flight", type=int, default=500, help="requests beyond this are dropped, not queued")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request client timeout in seconds")
+    parser.add_argument("--llm", action="store_true", help="send ?llm=true so every prediction calls the (fake) LLM")
+    parser.add_argument("--no-cache", action="store_true", help="send ?no_cache=true to bypass the LLM cache")
+    parser.add_argument("--base-url", help="drive an already running app instead of starting one")
+    parser.add_argument("--app-port", type=int, default=8010)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--fake-port", type=int, default=8001)
+    parser.add_argument("--llm-latency", choices=("fixed", "uniform", "lognormal"), default="lognormal")
+    parser.add_argument("--llm-latency-median", type=float, default=2.5)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    rates = _parse_rates(args.rate) or {"predict": 10.0, "health": 2.0}
+    procs = []
+    base_url = args.base_url
+    if base_url is None:
+        base_url, procs = _start_stack(args)
+    else:
+        _wait_ready(f"{base_url}/api/health")
+    try:
+        test = LoadTest(base_url, rates, args.duration, args.arrival, args.max_in_flight,
+                        args.llm, args.no_cache, args.timeout)
+        results = asyncio.run(test.run())
+        health = httpx.get(f"{base_url}/api/health", timeout=10).json()
+    finally:
+        for p in procs:
+            p.terminate()
+            p.wait(timeout=10)
+
+    print(f"{base_url}: {args.duration:g}s, {args.arrival} arrivals")
+    _print_table(results)
+    for key in ("llm_client", "llm_cache", "knowledge_base", "history_writer"):
+        if key in health:
+            print(f"{key}: {json.dumps(health[key])}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"results": results, "health": health}, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
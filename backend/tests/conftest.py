@@ -0,0 +1,59 @@
+import threading
+import time
+
+import httpx
+import pytest
+import uvicorn
+
+from app.services.llm_client import ResilientChatClient
+from benchmarks.fake_openai import FakeProfile, create_app
+
+
+class FakeOpenAI:
+    """benchmarks.fake_openai served on a free local port in a background thread."""
+
+    def __init__(self, profile: FakeProfile):
+        self.server = uvicorn.Server(uvicorn.Config(
+            create_app(profile), host="127.0.0.1", port=0, ws="none", log_level="warning",
+        ))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.monotonic() + 10
+        while not self.server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("fake OpenAI server did not start")
+            time.sleep(0.01)
+        port = self.server.servers[0].sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}/v1"
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(5)
+
+    def stats(self) -> dict:
+        return httpx.get(self.base_url.removesuffix("/v1") + "/stats").json()
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    """Start a fake server and route openai_service's LLM calls to it.
+
+    Returns a factory taking FakeProfile arguments; latency defaults to a
+    fixed 0.2 s so overlapping calls are observable.
+    """
+    servers = []
+
+    def start(**profile) -> FakeOpenAI:
+        profile = {"latency": "fixed", "latency_median": 0.2, "chunk_delay": 0.0, "seed": 0, **profile}
+        server = FakeOpenAI(FakeProfile(**profile)).__enter__()
+        servers.append(server)
+        client = ResilientChatClient(base_url=server.base_url, deadline=10.0, max_retries=0)
+        monkeypatch.setattr("app.services.openai_service.llm_client", client)
+        return server
+
+    yield start
+    for server in servers:
+        server.__exit__(None, None, None)
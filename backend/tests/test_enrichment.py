@@ -0,0 +1,69 @@
+import asyncio
+
+from app.services.enrichment import BatchEnricher
+from app.services.openai_service import openai_service
+
+
+def _row(row: int, disease: str, confidence: float = 40.0) -> dict:
+    # Below kb_confidence_threshold, so every row goes to the LLM.
+    return {
+        "row": row,
+        "predicted_disease": disease,
+        "confidence": confidence,
+        "top_predictions": [{"disease": disease, "confidence": confidence}],
+    }
+
+
+def _patient(age: int) -> dict:
+    return {"age": age, "gender": "Female", "symptoms": ["cough", "fever"], "symptom_duration_days": 3}
+
+
+async def _enrich(enricher: BatchEnricher, results: list[dict], docs: list[dict]) -> list[dict]:
+    return [row async for row in enricher.enrich_chunk(results, docs)]
+
+
+def test_identical_profiles_share_one_llm_call(fake_openai):
+    server = fake_openai()
+    # Three distinct profiles, each submitted twice.
+    results = [_row(i, "Influenza") for i in range(6)]
+    docs = [_patient(30 + i % 3) for i in range(6)]
+    enricher = BatchEnricher(concurrency=4, use_cache=False)
+
+    rows = asyncio.run(_enrich(enricher, results, docs))
+
+    assert sorted(r["row"] for r in rows) == list(range(6))
+    assert all(r["suggestion_source"] == "llm" for r in rows)
+    assert server.stats()["requests"] == 3
+    assert enricher.llm_requests == 3
+    assert enricher.deduplicated == 3
+
+
+def test_llm_calls_are_capped_at_concurrency(fake_openai):
+    server = fake_openai()
+    results = [_row(i, "Influenza") for i in range(8)]
+    docs = [_patient(20 + i) for i in range(8)]
+    enricher = BatchEnricher(concurrency=2, use_cache=False)
+
+    rows = asyncio.run(_enrich(enricher, results, docs))
+
+    stats = server.stats()
+    assert len(rows) == 8
+    assert stats["requests"] == 8
+    assert stats["max_in_flight"] == 2
+
+
+def test_failed_llm_calls_fall_back_per_row(fake_openai):
+    server = fake_openai(error_rate=1.0, error_statuses=(500,))
+    results = [_row(1, "Influenza"), {"row": 2, "error": "missing age"}, _row(3, "Asthma")]
+    docs = [_patient(40), _patient(50)]
+    enricher = BatchEnricher(concurrency=2, use_cache=False)
+
+    rows = {r["row"]: r for r in asyncio.run(_enrich(enricher, results, docs))}
+
+    assert set(rows) == {1, 2, 3}
+    assert rows[2] == {"row": 2, "error": "missing age"}
+    for row, disease in ((1, "Influenza"), (3, "Asthma")):
+        fallback = openai_service._fallback_suggestion(disease, 40.0)
+        assert rows[row]["ai_suggestion"] == fallback["ai_suggestion"]
+        assert rows[row]["suggestion_source"] == "llm"
+    assert server.stats()["errors"] == 2
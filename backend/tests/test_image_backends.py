@@ -0,0 +1,84 @@
+"""Agreement of the int8 and ONNX image model backends with eager fp32.
+
+Runs on a small Swin with random weights and the same processor config as
+the pinned model, so no download is needed. Random weights give flat
+logits, which makes top-1 a harsh measure; thresholds leave room for that.
+"""
+import warnings
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from app.ml.export_image_model import FP32_ATOL, check_parity, export, sample_images  # noqa: E402
+from app.services.image_backends import EagerBackend, OnnxBackend, top_k  # noqa: E402
+
+
+def _agreement(expected: np.ndarray, actual: np.ndarray) -> tuple[float, float]:
+    ref, got = top_k(expected), top_k(actual)
+    top1 = float(np.mean([r[1][0] == g[1][0] for r, g in zip(ref, got)]))
+    top5 = float(np.mean([len(set(r[1]) & set(g[1])) / 5 for r, g in zip(ref, got)]))
+    return top1, top5
+
+
+@pytest.fixture(scope="module")
+def model_dir(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("image_model"))
+    torch.manual_seed(0)
+    config = transformers.SwinConfig(embed_dim=32, depths=[1, 1, 2, 1], num_heads=[1, 2, 4, 8], num_labels=100)
+    transformers.SwinForImageClassification(config).eval().save_pretrained(directory)
+    transformers.ViTImageProcessor(size={"height": 224, "width": 224}).save_pretrained(directory)
+    return directory
+
+
+@pytest.fixture(scope="module")
+def images():
+    return sample_images(n=16)
+
+
+def test_int8_agrees_with_fp32(model_dir, images):
+    fp32 = EagerBackend(model_dir, quantize=False)
+    int8 = EagerBackend(model_dir, quantize=True)
+    fp32.load()
+    int8.load()
+
+    quantized = [m for m in int8._model.modules() if isinstance(m, torch.ao.nn.quantized.dynamic.Linear)]
+    assert quantized, "quantize_linear left no int8 Linear layers"
+    assert not any(type(m) is torch.nn.Linear for m in int8._model.modules())
+
+    top1, top5 = _agreement(fp32.logits(images), int8.logits(images))
+    assert top1 >= 0.75
+    assert top5 >= 0.8
+
+
+@pytest.fixture(scope="module")
+def exported(model_dir):
+    pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    with warnings.catch_warnings():
+        # Swin's shape checks trigger tracer warnings; the parity test is what matters.
+        warnings.simplefilter("ignore")
+        export(model_dir)
+    return model_dir
+
+
+def test_onnx_preprocessing_matches_the_extractor(exported, images):
+    eager = EagerBackend(exported, quantize=False)
+    onnx = OnnxBackend(exported, quantize=False)
+    eager.load()
+    onnx.load()
+
+    expected = eager._extractor(images=images, return_tensors="np")["pixel_values"]
+    np.testing.assert_allclose(onnx.preprocess(images), expected, atol=1e-5)
+
+
+def test_onnx_export_parity(exported, images):
+    report = check_parity(exported, images)
+
+    assert report["fp32"]["max_abs_diff"] <= FP32_ATOL
+    assert report["fp32"]["top1_agreement"] == 1.0
+    # ONNX Runtime and PyTorch quantize activations differently, so int8
+    # is held to top-5 overlap with eager int8 rather than exact top-1.
+    assert report["int8"]["top5_overlap"] >= 0.8
@@ -0,0 +1,38 @@
+import asyncio
+
+from app.services.llm_client import ResilientChatClient
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def _client(server) -> ResilientChatClient:
+    return ResilientChatClient(base_url=server.base_url, max_concurrency=1, deadline=10.0, max_retries=0)
+
+
+def test_stream_closed_early_is_cancelled_not_succeeded(fake_openai):
+    client = _client(fake_openai())
+
+    async def main():
+        stream = client.stream_chat_completion(model="gpt-4o", messages=MESSAGES)
+        await stream.__anext__()
+        await stream.aclose()
+
+    asyncio.run(main())
+    stats = client.stats()
+    assert (stats["cancelled"], stats["succeeded"], stats["failed"], stats["in_flight"]) == (1, 0, 0, 0)
+    assert client._semaphore._value == 1
+
+
+def test_cancelled_half_open_probe_is_released(fake_openai):
+    client = _client(fake_openai(latency_median=1.0))
+    client.breaker.state = "half_open"
+
+    async def main():
+        call = asyncio.ensure_future(client.chat_completion(model="gpt-4o", messages=MESSAGES))
+        await asyncio.sleep(0.2)
+        call.cancel()
+        await asyncio.gather(call, return_exceptions=True)
+
+    asyncio.run(main())
+    assert client.stats()["cancelled"] == 1
+    assert client.breaker.allow(), "a cancelled probe must not keep the breaker half-open forever"
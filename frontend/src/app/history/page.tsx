@@ -26,7 +26,7 @@ export default function HistoryPage() {
   const load = useCallback(async () => {
     setLoading(true);
     try {
-      const res = await getDiagnosisHistory({ page, limit: 15 });
+      const res = await getDiagnosisHistory({ page, limit: 15, view: "summary" });
       setRecords(res.data.history);
       setTotal(res.data.total);
     } catch (err) {
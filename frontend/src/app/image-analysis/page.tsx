@@ -109,7 +109,7 @@ export default function ImageAnalysisPage() {
             <input
               ref={fileRef}
               type="file"
-              accept="image/*"
+              accept="image/*,.dcm,application/dicom"
               onChange={(e) => handleFileChange(e.target.files?.[0] || null)}
               className="hidden"
             />
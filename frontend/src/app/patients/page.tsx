@@ -2,7 +2,7 @@
 
 import { useEffect, useState, useCallback } from "react";
 import { Search, ChevronLeft, ChevronRight, User } from "lucide-react";
-import { getPatients, type Patient } from "@/lib/api";
+import { getPatient, getPatients, type Patient } from "@/lib/api";
 
 export default function PatientsPage() {
   const [patients, setPatients] = useState<Patient[]>([]);
@@ -17,7 +17,7 @@ export default function PatientsPage() {
   const load = useCallback(async () => {
     setLoading(true);
     try {
-      const res = await getPatients({ page, limit: 20, search, diagnosis });
+      const res = await getPatients({ page, limit: 20, search, diagnosis, view: "summary" });
       setPatients(res.data.patients);
       setTotal(res.data.total);
       setPages(res.data.pages);
@@ -32,6 +32,18 @@ export default function PatientsPage() {
     load();
   }, [load]);
 
+  // The list only carries summary fields; the detail modal needs the full record.
+  const openPatient = async (p: Patient) => {
+    const id = p.id || p.patient_id;
+    if (!id) return;
+    try {
+      const res = await getPatient(id);
+      setSelected(res.data);
+    } catch (err) {
+      console.error(err);
+    }
+  };
+
   const severityColor: Record<string, string> = {
     Mild: "text-accent-green bg-accent-green/15",
     Moderate: "text-accent-orange bg-accent-orange/15",
@@ -195,7 +207,7 @@ export default function PatientsPage() {
                   <tr
                     key={p.id || p.patient_id}
                     className="border-b border-border/50 hover:bg-bg-card-hover cursor-pointer transition"
-                    onClick={() => setSelected(p)}
+                    onClick={() => openPatient(p)}
                   >
                     <td className="px-5 py-3.5">
                       <div className="flex items-center gap-3">
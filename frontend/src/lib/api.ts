@@ -96,6 +96,15 @@ export interface DiagnosisResponse {
   root_cause?: string;
   recommended_tests: string[];
   recommended_treatments: string[];
+  abnormal_findings?: {
+    field: string;
+    label: string;
+    value: number;
+    unit: string;
+    low: number | null;
+    high: number | null;
+    status: "low" | "high" | "borderline_low" | "borderline_high";
+  }[];
 }
 
 export interface StatsData {
@@ -114,10 +123,17 @@ export const getPatients = (params: {
   limit?: number;
   search?: string;
   diagnosis?: string;
+  view?: "summary" | "full";
+  fields?: string;
 }) => api.get("/api/patients", { params });
 
 export const getPatient = (id: string) => api.get(`/api/patients/${id}`);
 
+export const getPatientDiagnoses = (
+  id: string,
+  params: { start?: string; end?: string; limit?: number } = {}
+) => api.get(`/api/patients/${id}/diagnoses`, { params });
+
 export const createPatient = (data: Partial<Patient>) =>
   api.post("/api/patients/", data);
 
@@ -143,11 +159,26 @@ export const analyzeImage = (file: File, imageType: string) => {
   });
 };
 
+// Several images or zip archives of them (e.g. a study's slices) in one request.
+export const analyzeImages = (files: File[], imageType: string) => {
+  const formData = new FormData();
+  files.forEach((file) => formData.append("files", file));
+  formData.append("image_type", imageType);
+  return api.post("/api/diagnosis/analyze-images", formData, {
+    headers: { "Content-Type": "multipart/form-data" },
+  });
+};
+
 export const getSymptoms = () => api.get("/api/diagnosis/symptoms");
 
 export const getDiseases = () => api.get("/api/diagnosis/diseases");
 
-export const getDiagnosisHistory = (params: { page?: number; limit?: number }) =>
+export const getDiagnosisHistory = (params: {
+  page?: number;
+  limit?: number;
+  view?: "summary" | "full";
+  fields?: string;
+}) =>
   api.get("/api/diagnosis/history", { params });
 
 export const seedDatabase = () => api.post("/api/data/seed");